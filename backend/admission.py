@@ -0,0 +1,146 @@
+from typing import Callable, Optional
+import asyncio
+import logging
+import time
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LEVEL_NORMAL = 0
+LEVEL_SHED_CURSORS = 1
+LEVEL_REJECT_JOINS = 2
+LEVEL_NAMES = ("normal", "shed_cursors", "reject_joins")
+
+OVERLOADED_CLOSE_CODE = 1013
+FRAME_TOO_LARGE_CLOSE_CODE = 1009
+
+FRAME_COST_BYTES = 16 * 1024
+
+THROTTLED_FRAMES = REGISTRY.counter(
+    "mycollab_throttled_frames_total", "Inbound frames delayed by a rate limit", ("scope",))
+THROTTLED_SECONDS = REGISTRY.counter(
+    "mycollab_throttled_seconds_total", "Time connections spent waiting on a rate limit", ("scope",))
+OVERSIZED_FRAMES = REGISTRY.counter(
+    "mycollab_oversized_frames_total", "Connections closed for sending a frame over the size limit")
+SHED_CURSOR_FLUSHES = REGISTRY.counter(
+    "mycollab_shed_cursor_flushes_total", "Cursor broadcasts postponed while shedding load")
+REJECTED_JOINS = REGISTRY.counter(
+    "mycollab_rejected_joins_total", "Websocket joins refused while overloaded")
+LOAD_LEVEL = REGISTRY.gauge(
+    "mycollab_load_level", "Load shedding level: 0 normal, 1 shedding cursor updates, 2 also rejecting joins")
+
+
+def frame_cost(size: int) -> float:
+    return 1 + size / FRAME_COST_BYTES
+
+
+class TokenBucket:
+    """Refills at rate tokens per second up to burst. reserve() always takes
+    the tokens, letting the balance go negative, and returns how long the
+    caller should wait before acting, so concurrent callers are served in
+    the order they reserved."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= cost
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    async def acquire(self, scope: str, cost: float = 1.0):
+        delay = self.reserve(cost)
+        if delay > 0:
+            THROTTLED_FRAMES.labels(scope).inc()
+            THROTTLED_SECONDS.labels(scope).inc(delay)
+            await asyncio.sleep(delay)
+
+
+class AdmissionController:
+    """Picks a load shedding level from event loop lag and the amount of
+    accepted work still waiting to be committed. Past the first thresholds
+    cursor broadcasts are postponed; past the second, new websocket joins
+    are refused with 1013 so the clients already connected keep their
+    capacity. The level only drops after staying below the thresholds for
+    hold seconds."""
+
+    def __init__(self, lag: Callable[[], float], backlog: Callable[[], int],
+                 cursor_lag: float = 0.05, join_lag: float = 0.25,
+                 cursor_backlog: int = 2000, join_backlog: int = 10000,
+                 interval: float = 0.1, hold: float = 2.0):
+        self.lag = lag
+        self.backlog = backlog
+        self.cursor_lag = cursor_lag
+        self.join_lag = join_lag
+        self.cursor_backlog = cursor_backlog
+        self.join_backlog = join_backlog
+        self.interval = interval
+        self.hold = hold
+        self.level = LEVEL_NORMAL
+        self._raised_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    @property
+    def shedding_cursors(self) -> bool:
+        return self.level >= LEVEL_SHED_CURSORS
+
+    def admit_join(self) -> bool:
+        if self.level >= LEVEL_REJECT_JOINS:
+            REJECTED_JOINS.inc()
+            return False
+        return True
+
+    def measure(self) -> int:
+        lag = self.lag()
+        backlog = self.backlog()
+        if lag >= self.join_lag or backlog >= self.join_backlog:
+            return LEVEL_REJECT_JOINS
+        if lag >= self.cursor_lag or backlog >= self.cursor_backlog:
+            return LEVEL_SHED_CURSORS
+        return LEVEL_NORMAL
+
+    def update(self, now: Optional[float] = None) -> int:
+        now = time.monotonic() if now is None else now
+        level = self.measure()
+        if level >= self.level:
+            if level > self.level:
+                logger.warning("Load level raised to %s", LEVEL_NAMES[level])
+            self.level = level
+            self._raised_at = now
+        elif now - self._raised_at >= self.hold:
+            logger.info("Load level lowered to %s", LEVEL_NAMES[level])
+            self.level = level
+            self._raised_at = now
+        LOAD_LEVEL.set(self.level)
+        return self.level
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.update()
+            except Exception:
+                logger.exception("Failed to update load level")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
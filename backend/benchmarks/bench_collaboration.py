@@ -0,0 +1,343 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+TYPED_TEXT = "abcdefghijklmnopqrstuvwxyz    \n(){};=."
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(pct / 100 * (len(values) - 1)))))
+    return values[index]
+
+
+def _latency_summary(values: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        "count": len(values),
+        "p50_ms": _percentile(values, 50),
+        "p95_ms": _percentile(values, 95),
+        "p99_ms": _percentile(values, 99),
+        "max_ms": max(values) if values else None,
+    }
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _operation_delta(operation) -> int:
+    delta = 0
+    for component in operation:
+        if component.get("type") == "insert":
+            delta += len(component["value"])
+        elif component.get("type") == "delete":
+            delta -= component["length"]
+    return delta
+
+
+class Stats:
+    def __init__(self):
+        self.committed: Dict[Tuple[str, int], float] = {}
+        self.received: List[Tuple[str, int, float]] = []
+        self.commit_latencies: List[float] = []
+        self.operations = 0
+        self.cursor_updates = 0
+        self.chat_messages = 0
+        self.errors = 0
+        self.resyncs = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.frames_sent = 0
+        self.frames_received = 0
+
+
+class SimulatedClient:
+    """Types into one document like an editor would: one operation in flight,
+    keystrokes typed meanwhile are folded into the next operation, and every
+    keystroke moves the cursor. lag_ms delays each direction of the link
+    without reordering frames, like a slow but otherwise healthy network."""
+
+    def __init__(self, url: str, doc_id: str, user_id: str, stats: Stats, args, rng: random.Random):
+        self.url = url
+        self.doc_id = doc_id
+        self.user_id = user_id
+        self.stats = stats
+        self.args = args
+        self.rng = rng
+        self.binary = args.encoding == "binary"
+        self.version = 0
+        self.length = 0
+        self.in_flight: Optional[Tuple[int, float]] = None
+        self.buffered = ""
+        self.websocket = None
+        self.delayed = args.lag_ms > 0 or args.jitter_ms > 0
+        self.outbox: asyncio.Queue = asyncio.Queue()
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.last_sent = 0.0
+        self.tasks: List[asyncio.Task] = []
+
+    def _deliver_at(self, last: float) -> float:
+        lag = self.args.lag_ms + self.rng.uniform(-self.args.jitter_ms, self.args.jitter_ms)
+        return max(time.perf_counter() + max(lag, 0) / 1000, last)
+
+    async def _delayed(self, queue: asyncio.Queue, deliver):
+        while True:
+            deliver_at, item = await queue.get()
+            delay = deliver_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await deliver(item)
+
+    async def _send(self, message: dict):
+        data = self.codec.encode(message)
+        self.stats.bytes_sent += len(data)
+        self.stats.frames_sent += 1
+        if self.delayed:
+            self.last_sent = self._deliver_at(self.last_sent)
+            self.outbox.put_nowait((self.last_sent, data))
+        else:
+            await self.websocket.send(data)
+
+    async def _transmit(self, data):
+        await self.websocket.send(data)
+
+    async def connect(self):
+        import websockets
+        from wire_protocol import BINARY_CODEC, BINARY_SUBPROTOCOL, JSON_CODEC
+
+        self.codec = BINARY_CODEC if self.binary else JSON_CODEC
+        subprotocols = [BINARY_SUBPROTOCOL] if self.binary else None
+        self.websocket = await websockets.connect(
+            f"{self.url}/ws/{self.doc_id}?user_id={self.user_id}&username={self.user_id}",
+            subprotocols=subprotocols, max_size=None, compression=None)
+
+    async def run(self, deadline: float):
+        self.tasks.append(asyncio.create_task(self._read()))
+        if self.delayed:
+            self.tasks.append(asyncio.create_task(self._delayed(self.outbox, self._transmit)))
+            self.tasks.append(asyncio.create_task(self._delayed(self.inbox, self._handle)))
+        try:
+            while time.perf_counter() < deadline:
+                await asyncio.sleep(self.rng.expovariate(1000 / self.args.typing_interval_ms))
+                self.buffered += self.rng.choice(TYPED_TEXT)
+                await self._flush()
+                if self.args.cursor:
+                    self.stats.cursor_updates += 1
+                    await self._send({"type": "cursor_update", "cursor_position": {
+                        "line": self.rng.randint(1, 100), "column": self.rng.randint(1, 80)}})
+                if self.rng.random() < self.args.chat_probability:
+                    self.stats.chat_messages += 1
+                    await self._send({"type": "chat_message", "message": "hello", "username": self.user_id})
+            await asyncio.sleep(self.args.drain_seconds)
+        finally:
+            for task in self.tasks:
+                task.cancel()
+            await self.websocket.close()
+
+    async def _flush(self):
+        if self.in_flight is not None or not self.buffered:
+            return
+        pos = self.rng.randint(0, self.length)
+        if self.length and self.rng.random() < self.args.delete_probability:
+            pos = min(pos, self.length - 1)
+            operation = [{"type": "retain", "length": pos}, {"type": "delete", "length": 1},
+                         {"type": "retain", "length": self.length - pos - 1}]
+            delta = -1
+        else:
+            operation = [{"type": "retain", "length": pos}, {"type": "insert", "value": self.buffered},
+                         {"type": "retain", "length": self.length - pos}]
+            delta = len(self.buffered)
+            self.buffered = ""
+        operation = [component for component in operation if component.get("length", 1)]
+        self.in_flight = (delta, time.perf_counter())
+        self.stats.operations += 1
+        await self._send({"type": "operation", "version": self.version, "operation": operation})
+
+    async def _read(self):
+        last_received = 0.0
+        async for data in self.websocket:
+            self.stats.bytes_received += len(data)
+            self.stats.frames_received += 1
+            if self.delayed:
+                last_received = self._deliver_at(last_received)
+                self.inbox.put_nowait((last_received, data))
+            else:
+                await self._handle(data)
+
+    async def _handle(self, data):
+        stats = self.stats
+        received_at = time.perf_counter()
+        message = self.codec.decode(data)
+        message_type = message.get("type")
+        if message_type in ("document_state", "document_delta"):
+            self.version = message["version"]
+            self.length = len(message.get("content", ""))
+        elif message_type == "operation_applied":
+            for entry in message.get("operations") or [message]:
+                if entry["user_id"] == self.user_id:
+                    continue
+                operation = entry["operation"]
+                if not isinstance(operation, list):
+                    operation = operation.to_list()
+                self.length += _operation_delta(operation)
+                self.version = max(self.version, entry["version"])
+                stats.received.append((self.doc_id, entry["version"], received_at))
+        elif message_type == "operation_confirmed":
+            if self.in_flight is not None:
+                delta, sent_at = self.in_flight
+                self.length += delta
+                stats.commit_latencies.append((received_at - sent_at) * 1000)
+                stats.committed[(self.doc_id, message["version"])] = sent_at
+                self.in_flight = None
+            self.version = max(self.version, message["version"])
+            await self._flush()
+        elif message_type == "error":
+            stats.errors += 1
+            if self.in_flight is not None:
+                self.in_flight = None
+                stats.resyncs += 1
+                asyncio.create_task(self._resync())
+
+    async def _resync(self):
+        old = self.websocket
+        await self.connect()
+        self.tasks.append(asyncio.create_task(self._read()))
+        await old.close()
+
+
+def _listen_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(4096)
+    return sock
+
+
+async def run(args) -> dict:
+    os.environ.setdefault("MYCOLLAB_STORAGE", args.storage)
+    os.environ.setdefault("MYCOLLAB_DATA_DIR", tempfile.mkdtemp(prefix="mycollab-bench-"))
+    os.chdir(BACKEND_DIR)
+    import uvicorn
+    from main import app
+
+    sock = _listen_socket()
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning", ws_max_size=64 * 1024 * 1024))
+    server_task = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:
+        await asyncio.sleep(0.01)
+    url = f"ws://127.0.0.1:{sock.getsockname()[1]}"
+
+    rng = random.Random(args.seed)
+    stats = Stats()
+    clients = [SimulatedClient(url, f"bench-{d}", f"user-{d}-{c}", stats, args, random.Random(rng.random()))
+               for d in range(args.docs) for c in range(args.clients)]
+    rss_before = _rss_bytes()
+    await asyncio.gather(*(client.connect() for client in clients))
+
+    started = time.perf_counter()
+    rss_samples = []
+
+    async def sample_rss():
+        while True:
+            rss_samples.append(_rss_bytes() or 0)
+            await asyncio.sleep(0.5)
+
+    sampler = asyncio.create_task(sample_rss())
+    await asyncio.gather(*(client.run(started + args.duration) for client in clients))
+    elapsed = time.perf_counter() - started - args.drain_seconds
+    sampler.cancel()
+
+    server.should_exit = True
+    await server_task
+
+    broadcast_latencies = []
+    for doc_id, version, received_at in stats.received:
+        sent_at = stats.committed.get((doc_id, version))
+        if sent_at is not None:
+            broadcast_latencies.append((received_at - sent_at) * 1000)
+
+    committed = len(stats.commit_latencies)
+    return {
+        "benchmark": "collaboration",
+        "config": {
+            "docs": args.docs,
+            "clients_per_doc": args.clients,
+            "duration_seconds": args.duration,
+            "typing_interval_ms": args.typing_interval_ms,
+            "lag_ms": args.lag_ms,
+            "jitter_ms": args.jitter_ms,
+            "encoding": args.encoding,
+            "storage": os.environ["MYCOLLAB_STORAGE"],
+        },
+        "elapsed_seconds": elapsed,
+        "operations_sent": stats.operations,
+        "operations_committed": committed,
+        "ops_per_second": committed / elapsed if elapsed else None,
+        "cursor_updates": stats.cursor_updates,
+        "chat_messages": stats.chat_messages,
+        "errors": stats.errors,
+        "resyncs": stats.resyncs,
+        "commit_latency": _latency_summary(stats.commit_latencies),
+        "broadcast_latency": _latency_summary(broadcast_latencies),
+        "wire": {
+            "bytes_sent": stats.bytes_sent,
+            "bytes_received": stats.bytes_received,
+            "frames_sent": stats.frames_sent,
+            "frames_received": stats.frames_received,
+        },
+        "rss_bytes": {
+            "before": rss_before,
+            "peak": max(rss_samples) if rss_samples else None,
+            "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end websocket collaboration load benchmark")
+    parser.add_argument("--docs", type=int, default=10)
+    parser.add_argument("--clients", type=int, default=4, help="clients per document")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of typing")
+    parser.add_argument("--drain-seconds", type=float, default=1.0)
+    parser.add_argument("--typing-interval-ms", type=float, default=150.0, help="mean time between keystrokes")
+    parser.add_argument("--delete-probability", type=float, default=0.1)
+    parser.add_argument("--chat-probability", type=float, default=0.01)
+    parser.add_argument("--no-cursor", dest="cursor", action="store_false")
+    parser.add_argument("--lag-ms", type=float, default=0.0, help="simulated one-way network delay")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--encoding", choices=("json", "binary"), default="json")
+    parser.add_argument("--storage", choices=("memory", "file"), default="memory")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="write JSON results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
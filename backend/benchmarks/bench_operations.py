@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from operational_transform import OperationalTransform, TextOperation
+from text_buffer import BUFFER_TYPES
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+WORDS = ["the", "quick", "brown", "fox", "jumps", "over", "lazy", "dog", "\n", "def", "return", "()"]
+
+
+def make_text(size: int, rng: random.Random) -> str:
+    parts = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        parts.append(word)
+        parts.append(" ")
+        length += len(word) + 1
+    return "".join(parts)[:size]
+
+
+def keystroke(size: int, rng: random.Random) -> TextOperation:
+    pos = rng.randint(0, size)
+    return TextOperation.normalize([pos, "x", size - pos])
+
+
+def scattered_edit(text: str, rng: random.Random, edits: int = 20) -> str:
+    chars = list(text)
+    for _ in range(edits):
+        pos = rng.randrange(len(chars))
+        if rng.random() < 0.5:
+            del chars[pos]
+        else:
+            chars.insert(pos, rng.choice("abcdef"))
+    return "".join(chars)
+
+
+def measure(fn: Callable[[], object], repeat: int) -> Dict[str, float]:
+    number, _ = timeit.Timer(fn).autorange()
+    runs = sorted(t / number for t in timeit.Timer(fn).repeat(repeat=repeat, number=number))
+    return {
+        "median_us": runs[len(runs) // 2] * 1e6,
+        "min_us": runs[0] * 1e6,
+        "iterations": number * repeat,
+    }
+
+
+def run(args) -> dict:
+    ot = OperationalTransform()
+    rng = random.Random(args.seed)
+    results: List[dict] = []
+
+    for size in args.sizes:
+        text = make_text(size, rng)
+        op = keystroke(size, rng)
+        concurrent = [keystroke(size, rng)]
+        rope = BUFFER_TYPES["rope"](text)
+        edited = text[:size // 2] + "hello" + text[size // 2:]
+        scattered = scattered_edit(text, rng)
+
+        cases = {
+            "apply_operation": lambda: ot.apply_operation(text, op),
+            "apply_to_buffer[rope]": lambda: ot.apply_to_buffer(rope, op),
+            "transform_operation": lambda: ot.transform_operation(op, concurrent, 0),
+            "create_operation[insert]": lambda: ot.create_operation(text, edited),
+            "create_operation[scattered]": lambda: ot.create_operation(text, scattered),
+        }
+        for name, fn in cases.items():
+            if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                continue
+            result = {"benchmark": name, "document_size": size}
+            result.update(measure(fn, args.repeat))
+            results.append(result)
+            print(f"{name:30s} {size:>9d} chars  {result['median_us']:12.2f} us", file=sys.stderr)
+
+    return {"benchmark": "operations", "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the operational transform hot paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="document sizes in characters")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="+", default=None, help="benchmark name prefixes to run")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="write JSON results to this file")
+    args = parser.parse_args()
+
+    results = run(args)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from document_manager import DocumentManager
+from operational_transform import OperationalTransform, TextOperation
+from persistence import OperationStore, SegmentFileBackend
+
+
+def _typing_operation(rng: random.Random, length: int) -> TextOperation:
+    pos = rng.randint(0, length)
+    if length and rng.random() < 0.15:
+        pos = min(pos, length - 1)
+        return TextOperation.normalize([pos, -1, length - pos - 1])
+    return TextOperation.normalize([pos, rng.choice("abcdefghij \n"), length - pos])
+
+
+async def _write_phase(data_dir: str, docs: int, ops: int, snapshot_interval: int, fsync: bool, seed: int):
+    rng = random.Random(seed)
+    backend = SegmentFileBackend(data_dir, fsync=fsync)
+    store = OperationStore(backend, snapshot_interval=snapshot_interval)
+    await store.start()
+    manager = DocumentManager(store=store)
+    ot = OperationalTransform()
+
+    doc_ids = [await manager.create_document(f"bench-{i}", "x" * 1024) for i in range(docs)]
+    await store.flush()
+    base_bytes = backend.bytes_written
+    base_fsyncs = backend.fsyncs
+    base_batches = store.batches_committed
+
+    logical_bytes = 0
+    started = time.perf_counter()
+    for _ in range(ops):
+        for doc_id in doc_ids:
+            doc = await manager.get_document_ref(doc_id)
+            operation = _typing_operation(rng, len(doc.buffer))
+            logical_bytes += len(json.dumps(list(operation.components), separators=(",", ":")))
+            manager.apply_operation(doc_id, operation, ot.apply_to_buffer(doc.buffer, operation))
+        await asyncio.gather(*(manager.wait_persisted(doc_id) for doc_id in doc_ids))
+    elapsed = time.perf_counter() - started
+    await store.close()
+
+    total_ops = ops * docs
+    physical_bytes = backend.bytes_written - base_bytes
+    return {
+        "operations": total_ops,
+        "seconds": elapsed,
+        "ops_per_second": total_ops / elapsed if elapsed else None,
+        "batches": store.batches_committed - base_batches,
+        "fsyncs": backend.fsyncs - base_fsyncs,
+        "logical_bytes": logical_bytes,
+        "physical_bytes": physical_bytes,
+        "write_amplification": physical_bytes / logical_bytes if logical_bytes else None,
+    }, {doc_id: manager.get_resident_document(doc_id).content for doc_id in doc_ids}
+
+
+async def _recovery_phase(data_dir: str, expected: dict):
+    store = OperationStore(SegmentFileBackend(data_dir))
+    await store.start()
+    manager = DocumentManager(store=store)
+    started = time.perf_counter()
+    for doc_id, content in expected.items():
+        doc = await manager.get_document_ref(doc_id)
+        if doc is None or doc.content != content:
+            raise AssertionError(f"Recovered document {doc_id} does not match")
+    elapsed = time.perf_counter() - started
+    await store.close()
+    return {
+        "documents": len(expected),
+        "seconds": elapsed,
+        "ms_per_document": elapsed * 1000 / len(expected) if expected else None,
+    }
+
+
+async def run(args) -> dict:
+    results = []
+    for snapshot_interval in args.snapshot_intervals:
+        data_dir = tempfile.mkdtemp(prefix="mycollab-bench-", dir=args.dir)
+        try:
+            write, expected = await _write_phase(data_dir, args.docs, args.ops, snapshot_interval,
+                                                 not args.no_fsync, args.seed)
+            recovery = await _recovery_phase(data_dir, expected)
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+        results.append({
+            "snapshot_interval": snapshot_interval,
+            "write": write,
+            "recovery": recovery,
+        })
+    return {
+        "benchmark": "persistence",
+        "docs": args.docs,
+        "ops_per_doc": args.ops,
+        "fsync": not args.no_fsync,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Operation log write amplification and recovery benchmark")
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--ops", type=int, default=500, help="operations per document")
+    parser.add_argument("--snapshot-intervals", type=int, nargs="+", default=[100, 1000, 1000000])
+    parser.add_argument("--dir", default=None, help="directory for temporary stores")
+    parser.add_argument("--no-fsync", action="store_true")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="write JSON results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+from bisect import bisect_right
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import argparse
+import asyncio
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import os
+import re
+import signal
+import socket
+import tempfile
+import threading
+import uuid
+
+from message_bus import MessageBus, RespBroker, create_bus
+from wire_protocol import BINARY_CODEC, ProtocolError
+
+logger = logging.getLogger(__name__)
+
+ROUTED_PATH = re.compile(r"^/(?:ws|api/documents)/([^/]+)")
+OPEN_TIMEOUT = 10.0
+DRAIN_TIMEOUT = 5.0
+OWNER_UNAVAILABLE_CLOSE_CODE = 1013
+RELAY_WINDOW = 64
+RELAY_ACK_EVERY = 16
+
+_CLIENT_GONE = object()
+
+_LOCAL_SCOPE_KEYS = ("app", "state")
+
+
+def _relayable(value: Any) -> bool:
+    if value is None or type(value) in (bool, int, float, str, bytes):
+        return True
+    if isinstance(value, dict):
+        return all(type(key) is str and _relayable(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return all(_relayable(item) for item in value)
+    return False
+
+
+class RelayStream:
+    """One end of a tunnelled connection. At most RELAY_WINDOW events are in
+    flight in each direction: the sender takes a credit per event and the
+    receiver returns credits in batches as it consumes them, so a slow
+    client or app stalls its peer instead of growing the queue."""
+
+    __slots__ = ("peer", "queue", "credit", "consumed", "closed")
+
+    def __init__(self, peer: str):
+        self.peer = peer
+        self.queue: asyncio.Queue = asyncio.Queue(RELAY_WINDOW + 2)
+        self.credit = asyncio.Semaphore(RELAY_WINDOW)
+        self.consumed = 0
+        self.closed = False
+
+
+class HashRing:
+    def __init__(self, nodes: Iterable[str], replicas: int = 128):
+        self.nodes = sorted(set(nodes))
+        if not self.nodes:
+            raise ValueError("A hash ring needs at least one node")
+        points = []
+        for node in self.nodes:
+            for i in range(replicas):
+                points.append((self._hash(f"{node}#{i}"), node))
+        points.sort()
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def owner(self, key: str) -> str:
+        i = bisect_right(self._hashes, self._hash(key))
+        return self._owners[i % len(self._owners)]
+
+
+class ClusterNode:
+    """Each document is owned by one node, chosen by consistent hashing. A
+    document-scoped HTTP request or websocket that arrives on another node is
+    tunnelled to the owner as ASGI events over the message bus. The owner
+    runs the request through its own app, so document state only ever lives
+    on one node."""
+
+    def __init__(self, node_id: str, nodes: Iterable[str], bus: MessageBus, prefix: str = "mycollab"):
+        self.node_id = node_id
+        self.ring = HashRing(nodes)
+        if node_id not in self.ring.nodes:
+            raise ValueError(f"Node {node_id} is not a cluster member")
+        self.bus = bus
+        self.prefix = prefix
+        self.app = None
+        self.local_scope: Dict[str, Any] = {}
+        self.relayed = 0
+        self.served = 0
+        self._stream_ids = itertools.count()
+        self._edge_streams: Dict[str, RelayStream] = {}
+        self._owner_streams: Dict[str, RelayStream] = {}
+
+    def channel(self, node_id: str) -> str:
+        return f"{self.prefix}:node:{node_id}"
+
+    def owner(self, doc_id: str) -> str:
+        return self.ring.owner(doc_id)
+
+    def new_document_id(self) -> str:
+        while True:
+            doc_id = str(uuid.uuid4())
+            if self.owner(doc_id) == self.node_id:
+                return doc_id
+
+    def group_by_owner(self, doc_ids: Iterable[str]) -> Dict[str, List[int]]:
+        groups: Dict[str, List[int]] = {}
+        for i, doc_id in enumerate(doc_ids):
+            groups.setdefault(self.owner(doc_id), []).append(i)
+        return groups
+
+    async def start(self):
+        await self.bus.start()
+        await self.bus.subscribe(self.channel(self.node_id), self._on_message)
+
+    async def close(self):
+        await self.bus.close()
+
+    def _on_message(self, data: bytes):
+        try:
+            envelope = BINARY_CODEC.decode(data)
+        except ProtocolError as e:
+            logger.warning("Dropping malformed bus message: %s", e)
+            return
+
+        stream_id = envelope.get("stream")
+        op = envelope.get("op")
+        if op == "open":
+            stream = self._owner_streams[stream_id] = RelayStream(envelope["reply_to"])
+            asyncio.create_task(self._serve(stream_id, stream, envelope["scope"]))
+            return
+        stream = self._owner_streams.get(stream_id) or self._edge_streams.get(stream_id)
+        if stream is None:
+            return
+        if op == "event":
+            try:
+                stream.queue.put_nowait(envelope["event"])
+            except asyncio.QueueFull:
+                logger.warning("Relay stream %s overran its window, closing it", stream_id)
+                while not stream.queue.empty():
+                    stream.queue.get_nowait()
+                self._end(stream)
+        elif op == "ack":
+            for _ in range(min(int(envelope.get("count", 0)), RELAY_WINDOW)):
+                stream.credit.release()
+        elif op == "end":
+            self._end(stream)
+
+    def _end(self, stream: RelayStream):
+        if stream.closed:
+            return
+        stream.closed = True
+        stream.queue.put_nowait(None)
+        stream.credit.release()
+
+    async def _publish(self, node_id: str, stream: str, op: str, **fields: Any):
+        envelope = {"type": "tunnel", "op": op, "stream": stream}
+        envelope.update(fields)
+        await self.bus.publish(self.channel(node_id), BINARY_CODEC.encode(envelope))
+
+    async def _send_event(self, stream_id: str, stream: RelayStream, event: Dict[str, Any]) -> bool:
+        await stream.credit.acquire()
+        if stream.closed:
+            stream.credit.release()
+            return False
+        await self._publish(stream.peer, stream_id, "event", event=event)
+        return True
+
+    async def _consumed(self, stream_id: str, stream: RelayStream):
+        stream.consumed += 1
+        if stream.consumed >= RELAY_ACK_EVERY and not stream.closed:
+            count, stream.consumed = stream.consumed, 0
+            await self._publish(stream.peer, stream_id, "ack", count=count)
+
+    async def _serve(self, stream_id: str, stream: RelayStream, scope: Dict[str, Any]):
+        scope = dict(scope)
+        scope.update(self.local_scope)
+        if "state" in scope:
+            scope["state"] = dict(scope["state"])
+        if scope.get("client") is not None:
+            scope["client"] = tuple(scope["client"])
+        if scope.get("server") is not None:
+            scope["server"] = tuple(scope["server"])
+        disconnect = {"type": "websocket.disconnect" if scope["type"] == "websocket" else "http.disconnect",
+                      "code": 1006}
+        closed = False
+
+        async def receive():
+            nonlocal closed
+            if closed:
+                return disconnect
+            event = await stream.queue.get()
+            if event is None:
+                closed = True
+                return disconnect
+            await self._consumed(stream_id, stream)
+            return event
+
+        async def send(event):
+            await self._send_event(stream_id, stream, event)
+
+        self.served += 1
+        try:
+            await self.app(scope, receive, send)
+        except Exception:
+            logger.exception("Tunnelled %s request for %s failed", scope["type"], scope.get("path"))
+        finally:
+            self._owner_streams.pop(stream_id, None)
+            if not stream.closed:
+                stream.closed = True
+                await self._publish(stream.peer, stream_id, "end")
+
+    def route(self, scope) -> Optional[str]:
+        if scope["type"] not in ("http", "websocket"):
+            return None
+        match = ROUTED_PATH.match(scope["path"])
+        if match is None:
+            return None
+        owner = self.owner(match.group(1))
+        return None if owner == self.node_id else owner
+
+    async def relay(self, owner: str, scope, receive, send):
+        stream_id = f"{self.node_id}:{next(self._stream_ids)}"
+        stream = self._edge_streams[stream_id] = RelayStream(owner)
+        self.relayed += 1
+        websocket = scope["type"] == "websocket"
+        started = False
+        client_gone = False
+
+        async def pump():
+            while True:
+                event = await receive()
+                if not await self._send_event(stream_id, stream, event):
+                    return
+                if event["type"] in ("websocket.disconnect", "http.disconnect"):
+                    stream.queue.put_nowait(_CLIENT_GONE)
+                    return
+
+        await self._publish(owner, stream_id, "open", reply_to=self.node_id,
+                            scope={key: value for key, value in scope.items()
+                                   if key not in _LOCAL_SCOPE_KEYS and _relayable(value)})
+        pump_task = asyncio.create_task(pump())
+        try:
+            timeout = OPEN_TIMEOUT
+            while True:
+                try:
+                    event = await asyncio.wait_for(stream.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if event is None:
+                    break
+                if event is _CLIENT_GONE:
+                    client_gone = True
+                    timeout = DRAIN_TIMEOUT
+                    continue
+                await self._consumed(stream_id, stream)
+                if client_gone:
+                    continue
+                if not started:
+                    timeout = None
+                try:
+                    await send(event)
+                except Exception as e:
+                    logger.info("Relayed connection to %s closed: %s", scope["path"], e)
+                    client_gone = True
+                    timeout = DRAIN_TIMEOUT
+                    continue
+                started = started or event["type"] in ("websocket.accept", "http.response.start")
+                if event["type"] == "websocket.close":
+                    break
+                if event["type"] == "http.response.body" and not event.get("more_body"):
+                    break
+        except Exception:
+            logger.exception("Relay of %s to node %s failed", scope["path"], owner)
+        finally:
+            pump_task.cancel()
+            self._edge_streams.pop(stream_id, None)
+            if not stream.closed:
+                stream.closed = True
+                await self._publish(owner, stream_id, "end")
+
+        if not started and not client_gone:
+            logger.warning("Owner node %s did not answer for %s", owner, scope["path"])
+            if websocket:
+                await send({"type": "websocket.close", "code": OWNER_UNAVAILABLE_CLOSE_CODE})
+            else:
+                await send({"type": "http.response.start", "status": 503,
+                            "headers": [(b"content-type", b"text/plain")]})
+                await send({"type": "http.response.body", "body": b"Document owner unavailable"})
+
+    async def forward(self, owner: str, method: str, path: str, body: bytes) -> Tuple[int, bytes]:
+        done = asyncio.Event()
+        response: Dict[str, Any] = {"status": 502, "body": bytearray()}
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(event):
+            if event["type"] == "http.response.start":
+                response["status"] = event["status"]
+            elif event["type"] == "http.response.body":
+                response["body"] += event.get("body", b"")
+                if not event.get("more_body"):
+                    done.set()
+
+        scope = {"type": "http", "http_version": "1.1", "scheme": "http", "method": method, "path": path,
+                 "raw_path": path.encode("ascii"), "root_path": "", "query_string": b"",
+                 "headers": [[b"content-type", b"application/json"], [b"content-length", str(len(body)).encode()]],
+                 "client": None, "server": None}
+        try:
+            await self.relay(owner, scope, receive, send)
+        finally:
+            done.set()
+        return response["status"], bytes(response["body"])
+
+
+def create_cluster_node(nodes: Optional[str], node_id: Optional[str], bus_url: str) -> Optional[ClusterNode]:
+    if not nodes:
+        return None
+    return ClusterNode(node_id, [node.strip() for node in nodes.split(",") if node.strip()], create_bus(bus_url))
+
+
+class ClusterRouter:
+    def __init__(self, app, node: ClusterNode):
+        self.app = app
+        self.node = node
+        node.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            self.node.local_scope = {key: scope[key] for key in _LOCAL_SCOPE_KEYS if key in scope}
+        owner = self.node.route(scope)
+        if owner is None:
+            return await self.app(scope, receive, send)
+        await self.node.relay(owner, scope, receive, send)
+
+
+def _listen_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(node_id: str, nodes: List[str], bus_url: str, host: str, port: int, log_level: str):
+    os.environ["MYCOLLAB_CLUSTER_NODES"] = ",".join(nodes)
+    os.environ["MYCOLLAB_NODE_ID"] = node_id
+    os.environ["MYCOLLAB_BUS_URL"] = bus_url
+    import uvicorn
+    from main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, log_level=log_level))
+    server.run(sockets=[_listen_socket(host, port)])
+
+
+def _run_broker(broker: RespBroker, ready: threading.Event, stop: threading.Event):
+    async def serve():
+        await broker.start()
+        ready.set()
+        while not stop.is_set():
+            await asyncio.sleep(0.2)
+        await broker.close()
+    asyncio.run(serve())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run MyCollab as several worker processes sharing one port")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--bus", default=os.environ.get("MYCOLLAB_BUS_URL"),
+                        help="redis://host:port or unix:///path; defaults to a local broker")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    broker_thread = None
+    stop = threading.Event()
+    bus_url = args.bus
+    if not bus_url:
+        path = os.path.join(tempfile.mkdtemp(prefix="mycollab-"), "bus.sock")
+        ready = threading.Event()
+        broker_thread = threading.Thread(target=_run_broker, args=(RespBroker(path), ready, stop), daemon=True)
+        broker_thread.start()
+        ready.wait()
+        bus_url = f"unix://{path}"
+
+    nodes = [f"worker-{i}" for i in range(args.workers)]
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=_run_worker, args=(node_id, nodes, bus_url, args.host, args.port, args.log_level))
+               for node_id in nodes]
+    for worker in workers:
+        worker.start()
+
+    def shutdown(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGINT)
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    for worker in workers:
+        worker.join()
+    stop.set()
+    if broker_thread is not None:
+        broker_thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+from typing import Any, Collection, Dict, List, Optional, Set, Union
+import asyncio
+import base64
+import time
+import zlib
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from admission import (FRAME_TOO_LARGE_CLOSE_CODE, OVERSIZED_FRAMES, SHED_CURSOR_FLUSHES, AdmissionController,
+                       TokenBucket, frame_cost)
+from document_manager import DocumentManager
+from execution import ExecutionPolicy
+from metrics import BROADCAST_FRAMES, RECEIVED_BYTES, RECEIVED_FRAMES, STAGE_SECONDS
+from operational_transform import TextOperation
+from send_queue import SendQueue, FRAME_CURSOR, FRAME_CONTENT, FRAME_MESSAGE, POLICY_DROP_CURSOR
+from spectators import Spectator, SpectatorRoom
+from text_buffer import TextBuffer
+from wire_protocol import COMPRESS_THRESHOLD, ENCODE_SECONDS, Frame, negotiate_codec
+
+DECODE_SECONDS = STAGE_SECONDS.labels("decode")
+FAN_OUT_SECONDS = STAGE_SECONDS.labels("fan_out")
+BROADCAST_FRAMES_BY_KIND = {kind: BROADCAST_FRAMES.labels(kind) for kind in (FRAME_CURSOR, FRAME_CONTENT, FRAME_MESSAGE)}
+DOCUMENT_LIMITED_TYPES = ("operation", "content_update", "chat_message")
+
+class ConnectionManager:
+    def __init__(self, doc_manager: DocumentManager, send_queue_size: int = 256, overflow_policy: str = POLICY_DROP_CURSOR,
+                 cursor_tick_interval: float = 0.033, policy: Optional[ExecutionPolicy] = None,
+                 spectator_interval: float = 0.1, admission: Optional[AdmissionController] = None,
+                 max_frame_bytes: int = 4 * 1024 * 1024, connection_rate: float = 100.0, connection_burst: float = 200.0,
+                 document_rate: float = 500.0, document_burst: float = 1000.0):
+        self.doc_manager = doc_manager
+        self.policy = policy
+        self.admission = admission
+        self.max_frame_bytes = max_frame_bytes
+        self.connection_rate = connection_rate
+        self.connection_burst = connection_burst
+        self.document_rate = document_rate
+        self.document_burst = document_burst
+        self.send_queue_size = send_queue_size
+        self.overflow_policy = overflow_policy
+        self.cursor_tick_interval = cursor_tick_interval
+        self.active_connections: Dict[str, Set[WebSocket]] = {}
+        self.user_info: Dict[WebSocket, dict] = {}
+        self.send_queues: Dict[WebSocket, SendQueue] = {}
+        self.dirty_cursors: Dict[str, Set[WebSocket]] = {}
+        self.cursor_tickers: Dict[str, asyncio.Task] = {}
+        self.spectator_interval = spectator_interval
+        self.spectator_rooms: Dict[str, SpectatorRoom] = {}
+        self.spectator_docs: Dict[WebSocket, str] = {}
+        self.rate_limits: Dict[WebSocket, TokenBucket] = {}
+        self.document_rate_limits: Dict[str, TokenBucket] = {}
+        doc_manager.is_pinned = self.is_pinned
+
+    def is_pinned(self, doc_id: str) -> bool:
+        return doc_id in self.active_connections or doc_id in self.spectator_rooms
+
+    async def connect(self, websocket: WebSocket, doc_id: str, user_id: str, username: str):
+        codec, subprotocol = negotiate_codec(
+            websocket.scope.get("subprotocols", []),
+            websocket.query_params.get("encoding")
+        )
+        await websocket.accept(subprotocol=subprotocol)
+
+        send_queue = SendQueue(websocket, self.send_queue_size, self.overflow_policy, on_close=self.disconnect, codec=codec)
+        self.send_queues[websocket] = send_queue
+        send_queue.start()
+
+        try:
+            await self.doc_manager.open_document(doc_id)
+
+            query_params = websocket.query_params
+            send_queue.enqueue(codec.encode(await self.sync_message(
+                doc_id,
+                query_params.get("since_version"),
+                query_params.get("content_hash"),
+                query_params.get("compression") == "deflate" and not codec.binary
+            )), FRAME_CONTENT)
+        except BaseException:
+            self.disconnect(websocket)
+            raise
+
+        if doc_id not in self.active_connections:
+            self.active_connections[doc_id] = set()
+
+        self.active_connections[doc_id].add(websocket)
+        if self.connection_rate > 0:
+            self.rate_limits[websocket] = TokenBucket(self.connection_rate, self.connection_burst)
+        if self.document_rate > 0 and doc_id not in self.document_rate_limits:
+            self.document_rate_limits[doc_id] = TokenBucket(self.document_rate, self.document_burst)
+        self.user_info[websocket] = {
+            "user_id": user_id,
+            "username": username,
+            "doc_id": doc_id,
+            "cursor_position": {"line": 0, "column": 0},
+            "flushed_cursor_position": {"line": 0, "column": 0}
+        }
+
+        await self.broadcast_user_joined(doc_id, user_id, username, websocket)
+
+    async def reject(self, websocket: WebSocket, code: int):
+        _, subprotocol = negotiate_codec(
+            websocket.scope.get("subprotocols", []),
+            websocket.query_params.get("encoding")
+        )
+        await websocket.accept(subprotocol=subprotocol)
+        await websocket.close(code=code)
+
+    async def connect_spectator(self, websocket: WebSocket, doc_id: str, interval: float = 0.0):
+        codec, subprotocol = negotiate_codec(
+            websocket.scope.get("subprotocols", []),
+            websocket.query_params.get("encoding")
+        )
+        await websocket.accept(subprotocol=subprotocol)
+
+        doc = await self.doc_manager.open_document(doc_id)
+
+        query_params = websocket.query_params
+        sync = Frame(await self.sync_message(
+            doc_id,
+            query_params.get("since_version"),
+            query_params.get("content_hash"),
+            query_params.get("compression") == "deflate" and not codec.binary
+        ))
+        room = self.spectator_rooms.get(doc_id)
+        if room is None:
+            room = self.spectator_rooms[doc_id] = SpectatorRoom(doc_id, self.doc_manager, self.spectator_interval)
+        send_queue = SendQueue(websocket, self.send_queue_size, self.overflow_policy,
+                               on_close=self.disconnect_spectator, codec=codec)
+        send_queue.start()
+        room.add(Spectator(send_queue, doc.version, max(interval, 0.0)), sync)
+        self.spectator_docs[websocket] = doc_id
+
+    def disconnect_spectator(self, websocket: WebSocket):
+        doc_id = self.spectator_docs.pop(websocket, None)
+        room = self.spectator_rooms.get(doc_id)
+        if room is None:
+            return
+        room.remove(websocket)
+        if not room:
+            del self.spectator_rooms[doc_id]
+
+    def notify_spectators(self, doc_id: str):
+        room = self.spectator_rooms.get(doc_id)
+        if room is not None:
+            room.notify()
+
+    async def sync_message(self, doc_id: str, since_version: Optional[str], content_hash: Optional[str],
+                           compress: bool = False) -> Dict[str, Any]:
+        doc = await self.doc_manager.open_document(doc_id)
+        if since_version is not None and content_hash:
+            try:
+                since = int(since_version)
+            except ValueError:
+                since = None
+            delta = None if since is None else await self.doc_manager.get_document_delta(doc_id, since, content_hash)
+            if delta is not None:
+                return {
+                    "type": "document_delta",
+                    "since_version": since,
+                    "version": doc.version,
+                    "operation": delta
+                }
+
+        content = doc.content
+        if compress and len(content) > COMPRESS_THRESHOLD:
+            return {
+                "type": "document_state",
+                "content": base64.b64encode(zlib.compress(content.encode("utf-8"), 6)).decode("ascii"),
+                "content_encoding": "deflate",
+                "version": doc.version
+            }
+        return {
+            "type": "document_state",
+            "content": content,
+            "version": doc.version
+        }
+
+    def disconnect(self, websocket: WebSocket):
+        send_queue = self.send_queues.pop(websocket, None)
+        if send_queue is not None:
+            send_queue.close()
+        self.rate_limits.pop(websocket, None)
+
+        if websocket in self.user_info:
+            user_info = self.user_info[websocket]
+            doc_id = user_info["doc_id"]
+            user_id = user_info["user_id"]
+            username = user_info["username"]
+
+            if doc_id in self.active_connections:
+                self.active_connections[doc_id].discard(websocket)
+                if not self.active_connections[doc_id]:
+                    del self.active_connections[doc_id]
+                    self.document_rate_limits.pop(doc_id, None)
+
+            if doc_id in self.dirty_cursors:
+                self.dirty_cursors[doc_id].discard(websocket)
+
+            del self.user_info[websocket]
+
+            asyncio.create_task(self.broadcast_user_left(doc_id, user_id, username))
+
+    async def receive(self, websocket: WebSocket) -> Dict[str, Any]:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+
+        data = message.get("bytes")
+        if data is None:
+            data = message.get("text")
+        send_queue = self.send_queues.get(websocket)
+        if send_queue is None:
+            raise WebSocketDisconnect(1000)
+        RECEIVED_FRAMES.inc()
+        RECEIVED_BYTES.inc(len(data))
+        if len(data) > self.max_frame_bytes:
+            OVERSIZED_FRAMES.inc()
+            send_queue.close()
+            await send_queue.close_websocket(FRAME_TOO_LARGE_CLOSE_CODE)
+            raise WebSocketDisconnect(FRAME_TOO_LARGE_CLOSE_CODE)
+        tokens = frame_cost(len(data))
+        bucket = self.rate_limits.get(websocket)
+        if bucket is not None:
+            await bucket.acquire("connection", tokens)
+
+        started = time.perf_counter()
+        codec = send_queue.codec
+        cost = codec.decode_cost(data)
+        if self.policy is not None and cost >= self.policy.inline_cost:
+            message = await self.policy.run("decode", cost, codec.decode, data, self.max_frame_bytes, picklable=True)
+        else:
+            message = codec.decode(data, self.max_frame_bytes)
+        DECODE_SECONDS.observe(time.perf_counter() - started)
+
+        if message.get("type") in DOCUMENT_LIMITED_TYPES:
+            info = self.user_info.get(websocket)
+            bucket = self.document_rate_limits.get(info["doc_id"]) if info is not None else None
+            if bucket is not None:
+                await bucket.acquire("document", tokens)
+        return message
+
+    def send(self, websocket: WebSocket, message: dict, kind: str = FRAME_MESSAGE) -> bool:
+        send_queue = self.send_queues.get(websocket)
+        if send_queue is None:
+            return False
+        started = time.perf_counter()
+        payload = send_queue.codec.encode(message)
+        ENCODE_SECONDS.observe(time.perf_counter() - started)
+        return send_queue.enqueue(payload, kind)
+
+    def send_frame(self, websocket: WebSocket, frame: Frame, kind: str = FRAME_MESSAGE) -> bool:
+        send_queue = self.send_queues.get(websocket)
+        if send_queue is None:
+            return False
+        return send_queue.enqueue(frame.encode(send_queue.codec), kind)
+
+    def _fan_out(self, doc_id: str, message: Union[dict, Frame], kind: str, key: str = None,
+                 exclude_websocket: WebSocket = None, exclude: Collection[WebSocket] = ()) -> int:
+        connections = self.active_connections.get(doc_id)
+        if not connections:
+            return 0
+
+        started = time.perf_counter()
+        frame = message if isinstance(message, Frame) else Frame(message)
+        delivered = 0
+        for connection in list(connections):
+            if connection is exclude_websocket or connection in exclude:
+                continue
+            send_queue = self.send_queues.get(connection)
+            if send_queue is not None and send_queue.enqueue(frame.encode(send_queue.codec), kind, key):
+                delivered += 1
+        BROADCAST_FRAMES_BY_KIND[kind].inc(delivered)
+        FAN_OUT_SECONDS.observe(time.perf_counter() - started)
+        return delivered
+
+    def broadcast_frame(self, doc_id: str, frame: Frame, kind: str = FRAME_MESSAGE,
+                        exclude: Collection[WebSocket] = ()) -> int:
+        return self._fan_out(doc_id, frame, kind, exclude=exclude)
+
+    async def broadcast_user_joined(self, doc_id: str, user_id: str, username: str, exclude_websocket: WebSocket):
+        self._fan_out(doc_id, {
+            "type": "user_joined",
+            "user_id": user_id,
+            "username": username
+        }, FRAME_MESSAGE, exclude_websocket=exclude_websocket)
+
+    async def broadcast_user_left(self, doc_id: str, user_id: str, username: str):
+        self._fan_out(doc_id, {
+            "type": "user_left",
+            "user_id": user_id,
+            "username": username
+        }, FRAME_MESSAGE)
+
+    async def broadcast_to_document(self, doc_id: str, message: dict, exclude_websocket: WebSocket = None):
+        kind = FRAME_CONTENT if message.get("type") == "content_update" else FRAME_MESSAGE
+        key = "content" if kind == FRAME_CONTENT else None
+        self._fan_out(doc_id, message, kind, key, exclude_websocket)
+
+    async def broadcast_cursor_update(self, doc_id: str, user_id: str, cursor_position: dict, exclude_websocket: WebSocket = None):
+        self._fan_out(doc_id, {
+            "type": "cursor_update",
+            "user_id": user_id,
+            "cursor_position": cursor_position
+        }, FRAME_CURSOR, f"cursor:{user_id}", exclude_websocket)
+
+    def update_cursor(self, websocket: WebSocket, cursor_position: dict):
+        info = self.user_info.get(websocket)
+        if info is None:
+            return
+
+        info["cursor_position"] = cursor_position
+        doc_id = info["doc_id"]
+        if cursor_position == info["flushed_cursor_position"]:
+            dirty = self.dirty_cursors.get(doc_id)
+            if dirty:
+                dirty.discard(websocket)
+            return
+
+        self.dirty_cursors.setdefault(doc_id, set()).add(websocket)
+        if doc_id not in self.cursor_tickers:
+            self.cursor_tickers[doc_id] = asyncio.create_task(self._run_cursor_ticker(doc_id))
+
+    def transform_cursors(self, doc_id: str, buffers: List[TextBuffer], operations: List[TextOperation],
+                          authors: Optional[Dict[WebSocket, int]] = None):
+        connections = self.active_connections.get(doc_id)
+        if not connections or not operations:
+            return
+
+        authors = authors or {}
+        for websocket in connections:
+            info = self.user_info.get(websocket)
+            if info is None:
+                continue
+            start = authors.get(websocket, -1) + 1
+            if start >= len(operations):
+                continue
+            position = info["cursor_position"]
+            line = position.get("line") if isinstance(position, dict) else None
+            column = position.get("column") if isinstance(position, dict) else None
+            if type(line) is not int or type(column) is not int or line < 1:
+                continue
+
+            offset = buffers[start].position_to_offset(line - 1, column - 1)
+            for operation in operations[start:]:
+                offset = operation.transform_index(offset)
+            new_line, new_column = buffers[-1].offset_to_position(offset)
+            moved = {**position, "line": new_line + 1, "column": new_column + 1}
+            if moved == position:
+                continue
+            if info["flushed_cursor_position"] == position:
+                info["flushed_cursor_position"] = moved
+            info["cursor_position"] = moved
+
+    async def _run_cursor_ticker(self, doc_id: str):
+        try:
+            while self.dirty_cursors.get(doc_id):
+                await asyncio.sleep(self.cursor_tick_interval)
+                if self.admission is not None and self.admission.shedding_cursors:
+                    SHED_CURSOR_FLUSHES.inc()
+                    continue
+                self.flush_cursor_updates(doc_id)
+        finally:
+            self.cursor_tickers.pop(doc_id, None)
+            if not self.dirty_cursors.get(doc_id):
+                self.dirty_cursors.pop(doc_id, None)
+
+    def flush_cursor_updates(self, doc_id: str) -> int:
+        dirty = self.dirty_cursors.get(doc_id)
+        if not dirty:
+            return 0
+
+        cursors = []
+        for websocket in dirty:
+            info = self.user_info.get(websocket)
+            if info is None or info["cursor_position"] == info["flushed_cursor_position"]:
+                continue
+            info["flushed_cursor_position"] = info["cursor_position"]
+            cursors.append({
+                "user_id": info["user_id"],
+                "cursor_position": info["cursor_position"]
+            })
+        dirty.clear()
+
+        if not cursors:
+            return 0
+        self._fan_out(doc_id, {
+            "type": "cursor_updates",
+            "cursors": cursors
+        }, FRAME_CURSOR)
+        return len(cursors)
@@ -1,132 +1,616 @@
-from typing import Dict, List, Any, Optional
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Any, Optional, Sequence, Tuple, Union
+import asyncio
+import hashlib
+import heapq
 import uuid
 from datetime import datetime
-from operational_transform import Operation
+from operational_transform import TextOperation, OperationalTransform
+from text_buffer import TextBuffer, BufferFactory, Rope
+from operation_log import OperationLog, OperationLogView
+from persistence import OperationStore
+from metrics import PROFILER
+
+MAX_DELTA_OPERATIONS = 10000
+CONTENT_HASH_CACHE_SIZE = 32
+
+METADATA_FIELDS = ("doc_id", "version", "created_at", "updated_at", "language")
+STATS_FIELDS = ("doc_id", "content_length", "line_count", "version", "operation_count",
+                "created_at", "updated_at", "language")
 
 class Document:
-    def __init__(self, doc_id: str, initial_content: str = ""):
+    def __init__(self, doc_id: str, initial_content: str = "", buffer_factory: BufferFactory = Rope):
         self.doc_id = doc_id
-        self.content = initial_content
+        self.buffer_factory = buffer_factory
+        self.buffer: TextBuffer = buffer_factory(initial_content)
+        self._content_cache: Optional[str] = initial_content
         self.version = 0
-        self.operations: List[List] = []
+        self.operations = OperationLog(base_buffer=self.buffer)
         self.created_at = datetime.now()
         self.updated_at = datetime.now()
         self.language = "javascript"
+        self.persisted_snapshot_version = 0
+        self._snapshot_key = None
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._content_hashes: "OrderedDict[int, str]" = OrderedDict()
     
-    def to_dict(self) -> Dict[str, Any]:
-        return {
+    @classmethod
+    def from_snapshot(cls, snapshot: Dict[str, Any], records: List, buffer_factory: BufferFactory,
+                      ot: OperationalTransform) -> "Document":
+        doc = cls(snapshot["doc_id"], snapshot["content"], buffer_factory)
+        doc.version = snapshot["version"]
+        doc.operations = OperationLog(base_version=doc.version, base_buffer=doc.buffer)
+        doc.created_at = datetime.fromisoformat(snapshot["created_at"])
+        doc.updated_at = datetime.fromisoformat(snapshot["updated_at"])
+        doc.language = snapshot["language"]
+        doc.persisted_snapshot_version = doc.version
+        
+        for version, timestamp, components in records:
+            if version != doc.version + 1:
+                break
+            operation = TextOperation.normalize(components)
+            doc.apply_operation(operation, ot.apply_to_buffer(doc.buffer, operation), timestamp)
+        if records:
+            doc.updated_at = datetime.fromtimestamp(doc.operations.timestamps[-1])
+        return doc
+    
+    @property
+    def content(self) -> str:
+        if self._content_cache is None:
+            self._content_cache = self.buffer.to_string()
+        return self._content_cache
+    
+    @content.setter
+    def content(self, value: str):
+        self.buffer = self.buffer_factory(value)
+        self._content_cache = value
+    
+    def to_dict(self, include_history: bool = True) -> Dict[str, Any]:
+        data = {
             "doc_id": self.doc_id,
             "content": self.content,
             "version": self.version,
             "created_at": self.created_at.isoformat(),
             "updated_at": self.updated_at.isoformat(),
-            "language": self.language,
-            "operations": [[op.to_dict() if hasattr(op, 'to_dict') else op for op in ops] for ops in self.operations]
+            "language": self.language
         }
+        if include_history:
+            data["operations"] = [ops.to_list() for ops in self.operations]
+        return data
+    
+    def select(self, fields: Iterable[str]) -> Dict[str, Any]:
+        return {field: DOCUMENT_FIELDS[field](self) for field in fields}
+    
+    def memory_size(self) -> int:
+        return len(self.buffer) + self.operations.size_bytes
+    
+    @property
+    def line_count(self) -> int:
+        return self.buffer.line_count
+    
+    def offset_to_position(self, offset: int) -> Tuple[int, int]:
+        return self.buffer.offset_to_position(offset)
+    
+    def position_to_offset(self, line: int, column: int) -> int:
+        return self.buffer.position_to_offset(line, column)
     
-    def apply_operation(self, operation: List, new_content: str) -> int:
-        self.operations.append(operation)
-        self.content = new_content
+    def snapshot(self) -> Dict[str, Any]:
+        key = (self.version, self.language, self.updated_at)
+        if self._snapshot_key != key:
+            self._snapshot = self.to_dict(include_history=False)
+            self._snapshot_key = key
+        return self._snapshot
+    
+    def operations_since(self, version: int) -> OperationLogView:
+        return self.operations.since(version)
+    
+    def compose_since(self, version: int) -> TextOperation:
+        return self.operations.compose_range(version, self.version)
+    
+    def buffer_at_version(self, version: int, ot: OperationalTransform) -> Optional[TextBuffer]:
+        if version < self.operations.base_version or version > self.version:
+            return None
+        if version == self.version:
+            return self.buffer
+        
+        checkpoint_version, buffer = self.operations.checkpoint_before(version)
+        base_version = self.operations.base_version
+        for operation in self.operations[checkpoint_version - base_version:version - base_version]:
+            buffer = ot.apply_to_buffer(buffer, operation)
+        return buffer
+    
+    def content_at_version(self, version: int, ot: OperationalTransform) -> Optional[str]:
+        if version == self.version:
+            return self.content
+        buffer = self.buffer_at_version(version, ot)
+        return None if buffer is None else buffer.to_string()
+    
+    def content_hash(self, version: int, ot: OperationalTransform) -> Optional[str]:
+        digest = self._content_hashes.get(version)
+        if digest is not None:
+            self._content_hashes.move_to_end(version)
+            return digest
+        
+        content = self.content_at_version(version, ot)
+        if content is None:
+            return None
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        self._content_hashes[version] = digest
+        if len(self._content_hashes) > CONTENT_HASH_CACHE_SIZE:
+            self._content_hashes.popitem(last=False)
+        return digest
+    
+    def apply_operation(self, operation: Any, new_content: Union[str, TextBuffer], timestamp: Optional[float] = None) -> int:
+        if isinstance(new_content, TextBuffer):
+            self.buffer = new_content
+            self._content_cache = None
+        else:
+            self.content = new_content
+        self.operations.append(TextOperation.normalize(operation), timestamp, self.buffer)
         self.version += 1
         self.updated_at = datetime.now()
         return self.version
 
+DOCUMENT_FIELDS: Dict[str, Callable[[Document], Any]] = {
+    "doc_id": lambda doc: doc.doc_id,
+    "version": lambda doc: doc.version,
+    "created_at": lambda doc: doc.created_at.isoformat(),
+    "updated_at": lambda doc: doc.updated_at.isoformat(),
+    "language": lambda doc: doc.language,
+    "content_length": lambda doc: len(doc.buffer),
+    "line_count": lambda doc: doc.line_count,
+    "operation_count": lambda doc: len(doc.operations),
+    "content": lambda doc: doc.content,
+    "operations": lambda doc: [ops.to_list() for ops in doc.operations],
+}
+
+def _stored_metadata(snapshot: Dict[str, Any], records: List) -> Dict[str, Any]:
+    version = snapshot["version"]
+    updated_at = snapshot["updated_at"]
+    for record_version, timestamp, _ in records:
+        if record_version != version + 1:
+            break
+        version = record_version
+        updated_at = datetime.fromtimestamp(timestamp).isoformat()
+    return {
+        "doc_id": snapshot["doc_id"],
+        "version": version,
+        "created_at": snapshot["created_at"],
+        "updated_at": updated_at,
+        "language": snapshot["language"]
+    }
+
 class DocumentManager:
-    def __init__(self):
-        self.documents: Dict[str, Document] = {}
+    """Keeps recently used documents resident in LRU order. When a store is
+    configured and the cache exceeds max_documents or max_bytes, idle
+    documents are snapshotted to the store and dropped; they are reloaded
+    from the snapshot on next access. Loads are awaited and concurrent loads
+    of one document share a single read. is_pinned reports documents that
+    must stay resident, such as those with open connections. With a store,
+    a resident document keeps at most about max_history operations in
+    memory; older history is read back from the store."""
     
-    def create_document(self, doc_id: str = None, initial_content: str = "", language: str = "javascript") -> str:
-        if doc_id is None:
-            doc_id = str(uuid.uuid4())
+    def __init__(self, buffer_factory: BufferFactory = Rope, store: Optional[OperationStore] = None,
+                 max_documents: Optional[int] = None, max_bytes: Optional[int] = None,
+                 max_history: Optional[int] = None):
+        self.documents: "OrderedDict[str, Document]" = OrderedDict()
+        self.buffer_factory = buffer_factory
+        self.store = store
+        self.ot = OperationalTransform()
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.max_history = max_history
+        self.is_pinned: Callable[[str], bool] = lambda doc_id: False
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+        self._sizes: Dict[str, int] = {}
+        self._evicting: Dict[str, Document] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._deleting: Dict[str, asyncio.Future] = {}
+        self._new_ids: List[str] = []
+    
+    def _resident(self, doc_id: str) -> Optional[Document]:
+        doc = self.documents.get(doc_id)
+        if doc is not None:
+            self.documents.move_to_end(doc_id)
+            self.hits += 1
+            return doc
+        
+        self.misses += 1
+        doc = self._evicting.pop(doc_id, None)
+        if doc is not None:
+            self.loads += 1
+            self._admit(doc)
+        return doc
+    
+    async def _get(self, doc_id: str) -> Optional[Document]:
+        doc = self._resident(doc_id)
+        if doc is not None or self.store is None or doc_id in self._deleting:
+            return doc
+        
+        loading = self._loading.get(doc_id)
+        if loading is None:
+            loading = self._loading[doc_id] = asyncio.ensure_future(self._load(doc_id))
+            loading.add_done_callback(lambda _: self._loading.pop(doc_id, None))
+        return await asyncio.shield(loading)
+    
+    async def _load(self, doc_id: str) -> Optional[Document]:
+        loaded = await self.store.load(doc_id)
+        if doc_id in self.documents or doc_id in self._evicting:
+            return self._resident(doc_id)
+        if loaded is None or doc_id in self._deleting:
+            return None
         
-        if doc_id in self.documents:
+        snapshot, records = loaded
+        doc = Document.from_snapshot(snapshot, records, self.buffer_factory, self.ot)
+        self.loads += 1
+        self._admit(doc)
+        return doc
+    
+    async def _exists(self, doc_id: str) -> bool:
+        if doc_id in self.documents or doc_id in self._evicting:
+            return True
+        if self.store is None or doc_id in self._deleting:
+            return False
+        return await self.store.exists(doc_id) and doc_id not in self._deleting
+    
+    def _admit(self, doc: Document):
+        self.documents[doc.doc_id] = doc
+        self._account(doc)
+    
+    def _account(self, doc: Document):
+        size = doc.memory_size()
+        self.resident_bytes += size - self._sizes.get(doc.doc_id, 0)
+        self._sizes[doc.doc_id] = size
+        if self._over_budget():
+            self._evict(doc.doc_id)
+    
+    def _over_budget(self) -> bool:
+        return ((self.max_documents is not None and len(self.documents) > self.max_documents)
+                or (self.max_bytes is not None and self.resident_bytes > self.max_bytes))
+    
+    def _evict(self, keep_doc_id: str):
+        if self.store is None:
+            return
+        
+        for _ in range(len(self.documents)):
+            if not self._over_budget():
+                break
+            doc_id, doc = next(iter(self.documents.items()))
+            if doc_id == keep_doc_id or self.is_pinned(doc_id):
+                self.documents.move_to_end(doc_id)
+                continue
+            self._release(doc)
+    
+    def _release(self, doc: Document):
+        doc_id = doc.doc_id
+        del self.documents[doc_id]
+        self.resident_bytes -= self._sizes.pop(doc_id, 0)
+        self.evictions += 1
+        PROFILER.forget(doc_id)
+        
+        if doc.version != doc.persisted_snapshot_version:
+            self._persist_snapshot(doc)
+        future = self.store.persisted(doc_id)
+        if future is None:
+            return
+        
+        self._evicting[doc_id] = doc
+        def release(_):
+            if self._evicting.get(doc_id) is doc and self.store.persisted(doc_id) is None:
+                del self._evicting[doc_id]
+        future.add_done_callback(release)
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        return {
+            "resident_documents": len(self.documents),
+            "resident_bytes": self.resident_bytes,
+            "max_documents": self.max_documents,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads,
+            "evictions": self.evictions
+        }
+    
+    def _persist_operation(self, doc: Document):
+        if self.store is None:
+            return
+        
+        operation = doc.operations[-1]
+        self.store.append(doc.doc_id, doc.version, doc.operations.timestamps[-1], list(operation.components))
+        if doc.version - doc.persisted_snapshot_version >= self.store.snapshot_interval:
+            self._persist_snapshot(doc)
+    
+    def _persist_snapshot(self, doc: Document):
+        if self.store is None:
+            return
+        
+        self.store.snapshot(doc.doc_id, doc.to_dict(include_history=False))
+        doc.persisted_snapshot_version = doc.version
+    
+    async def wait_persisted(self, doc_id: str):
+        if self.store is None:
+            return
+        
+        future = self.store.persisted(doc_id)
+        if future is not None:
+            await asyncio.shield(future)
+    
+    def _create(self, doc_id: str, initial_content: str = "", language: str = "javascript") -> Document:
+        if doc_id in self.documents or doc_id in self._evicting:
             raise ValueError(f"Document {doc_id} already exists")
         
-        doc = Document(doc_id, initial_content)
+        doc = Document(doc_id, initial_content, self.buffer_factory)
         doc.language = language
-        self.documents[doc_id] = doc
+        self._persist_snapshot(doc)
+        self._admit(doc)
+        self._add_new_id(doc_id)
+        return doc
+    
+    def _add_new_id(self, doc_id: str):
+        i = bisect_left(self._new_ids, doc_id)
+        if i == len(self._new_ids) or self._new_ids[i] != doc_id:
+            self._new_ids.insert(i, doc_id)
+        if self.store is not None:
+            self.store.persisted(doc_id).add_done_callback(lambda _: self._remove_new_id(doc_id))
+    
+    def _remove_new_id(self, doc_id: str):
+        i = bisect_left(self._new_ids, doc_id)
+        if i < len(self._new_ids) and self._new_ids[i] == doc_id:
+            del self._new_ids[i]
+    
+    async def create_document(self, doc_id: str = None, initial_content: str = "", language: str = "javascript") -> str:
+        if doc_id is None:
+            doc_id = str(uuid.uuid4())
+        elif await self._exists(doc_id):
+            raise ValueError(f"Document {doc_id} already exists")
+        
+        self._create(doc_id, initial_content, language)
         return doc_id
     
-    def get_document(self, doc_id: str) -> Optional[Dict[str, Any]]:
-        if doc_id not in self.documents:
+    async def open_document(self, doc_id: str) -> Document:
+        doc = await self._get(doc_id)
+        if doc is None:
+            doc = self._resident(doc_id) or self._create(doc_id)
+        return doc
+    
+    async def get_document(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        doc = await self._get(doc_id)
+        if doc is None:
             return None
         
-        return self.documents[doc_id].to_dict()
+        return doc.to_dict()
     
-    def update_document(self, doc_id: str, content: str, language: str = None) -> int:
-        if doc_id not in self.documents:
-            return 0
+    async def get_document_ref(self, doc_id: str) -> Optional[Document]:
+        return await self._get(doc_id)
+    
+    def get_resident_document(self, doc_id: str) -> Optional[Document]:
+        return self._resident(doc_id)
+    
+    async def get_document_snapshot(self, doc_id: str, include_history: bool = False) -> Optional[Dict[str, Any]]:
+        doc = await self._get(doc_id)
+        if doc is None:
+            return None
         
-        doc = self.documents[doc_id]
-        doc.content = content
-        doc.version += 1
-        doc.updated_at = datetime.now()
+        if include_history:
+            return doc.to_dict()
+        return doc.snapshot()
+    
+    async def update_document(self, doc_id: str, content: str, language: str = None) -> int:
+        doc = await self._get(doc_id)
+        if doc is None:
+            return 0
         
-        if language:
+        if language and language != doc.language:
             doc.language = language
+            self._persist_snapshot(doc)
+        
+        operation = self.ot.create_operation(doc.content, content)
+        if operation.is_noop():
+            return doc.version
         
-        return doc.version
+        version = doc.apply_operation(operation, content)
+        self._persist_operation(doc)
+        self._account(doc)
+        return version
     
-    def apply_operation(self, doc_id: str, operation: List, new_content: str) -> int:
-        if doc_id not in self.documents:
+    def apply_operation(self, doc_id: str, operation: Any, new_content: Union[str, TextBuffer]) -> int:
+        doc = self._resident(doc_id)
+        if doc is None:
             raise ValueError(f"Document {doc_id} not found")
         
-        return self.documents[doc_id].apply_operation(operation, new_content)
+        version = doc.apply_operation(operation, new_content)
+        self._persist_operation(doc)
+        if self.store is not None and self.max_history is not None:
+            doc.operations.compact(doc.version - self.max_history)
+        self._account(doc)
+        return version
     
-    def delete_document(self, doc_id: str) -> bool:
-        if doc_id in self.documents:
+    async def delete_document(self, doc_id: str) -> bool:
+        if await self._get(doc_id) is not None:
             del self.documents[doc_id]
+            self.resident_bytes -= self._sizes.pop(doc_id, 0)
+            self._remove_new_id(doc_id)
+            PROFILER.forget(doc_id)
+            if self.store is not None:
+                self._delete_stored(doc_id)
             return True
         return False
     
-    def list_documents(self) -> List[Dict[str, Any]]:
-        return [doc.to_dict() for doc in self.documents.values()]
+    def _delete_stored(self, doc_id: str):
+        future = self.store.delete(doc_id)
+        self._deleting[doc_id] = future
+        def deleted(_):
+            if self._deleting.get(doc_id) is future:
+                del self._deleting[doc_id]
+        future.add_done_callback(deleted)
+    
+    async def create_documents(self, specs: Sequence[Dict[str, Any]]) -> List[str]:
+        requested = [spec["doc_id"] for spec in specs if spec.get("doc_id") is not None]
+        if len(set(requested)) != len(requested):
+            raise ValueError("Duplicate document ids in request")
+        exists = await asyncio.gather(*(self._exists(doc_id) for doc_id in requested))
+        for doc_id, found in zip(requested, exists):
+            if found or doc_id in self.documents or doc_id in self._evicting:
+                raise ValueError(f"Document {doc_id} already exists")
+        
+        doc_ids = []
+        for spec in specs:
+            doc_id = spec.get("doc_id") or str(uuid.uuid4())
+            self._create(doc_id, spec.get("content", ""), spec.get("language", "javascript"))
+            doc_ids.append(doc_id)
+        return doc_ids
+    
+    async def peek_document(self, doc_id: str, fields: Sequence[str] = METADATA_FIELDS) -> Optional[Dict[str, Any]]:
+        doc = self.documents.get(doc_id) or self._evicting.get(doc_id)
+        if doc is not None:
+            return doc.select(fields)
+        if self.store is None or doc_id in self._deleting:
+            return None
+        
+        loaded = await self.store.load(doc_id)
+        if loaded is None or doc_id in self._deleting:
+            return None
+        snapshot, records = loaded
+        if all(field in METADATA_FIELDS for field in fields):
+            metadata = _stored_metadata(snapshot, records)
+            return {field: metadata[field] for field in fields}
+        return Document.from_snapshot(snapshot, records, self.buffer_factory, self.ot).select(fields)
+    
+    async def list_document_ids(self, after: Optional[str] = None, limit: Optional[int] = None) -> List[str]:
+        stored = []
+        if self.store is not None:
+            stored = await self.store.document_ids(after, None if limit is None else limit + len(self._deleting))
+        start = bisect_right(self._new_ids, after) if after is not None else 0
+        new_ids = self._new_ids[start:] if limit is None else self._new_ids[start:start + limit]
+        
+        doc_ids: List[str] = []
+        for doc_id in heapq.merge(stored, new_ids):
+            if doc_ids and doc_ids[-1] == doc_id:
+                continue
+            if doc_id in self._deleting and doc_id not in self.documents and doc_id not in self._evicting:
+                continue
+            doc_ids.append(doc_id)
+            if limit is not None and len(doc_ids) >= limit:
+                break
+        return doc_ids
+    
+    async def iter_documents(self, doc_ids: Iterable[str],
+                             fields: Sequence[str] = METADATA_FIELDS) -> AsyncIterator[Dict[str, Any]]:
+        for doc_id in doc_ids:
+            data = await self.peek_document(doc_id, fields)
+            if data is not None:
+                yield data
+    
+    async def fetch_documents(self, doc_ids: Sequence[str],
+                              fields: Sequence[str] = METADATA_FIELDS) -> List[Dict[str, Any]]:
+        documents = await asyncio.gather(*(self.peek_document(doc_id, fields) for doc_id in doc_ids))
+        return [data for data in documents if data is not None]
+    
+    async def list_documents(self, fields: Sequence[str] = METADATA_FIELDS, after: Optional[str] = None,
+                             limit: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        async for data in self.iter_documents(await self.list_document_ids(after, limit), fields):
+            yield data
     
-    def get_document_history(self, doc_id: str) -> Optional[List[Dict[str, Any]]]:
-        if doc_id not in self.documents:
+    def _history_entries(self, doc: Document, since_version: int, stop_version: int,
+                         stored: List) -> Iterator[Dict[str, Any]]:
+        base_version = doc.operations.base_version
+        if since_version < base_version:
+            for version, timestamp, components in stored:
+                yield {
+                    "version": version,
+                    "operations": TextOperation.normalize(components).to_list(),
+                    "timestamp": datetime.fromtimestamp(timestamp).isoformat()
+                }
+        
+        start = max(since_version, base_version) - base_version
+        stop = stop_version - base_version
+        for i in range(start, stop):
+            yield {
+                "version": base_version + i + 1,
+                "operations": doc.operations[i].to_list(),
+                "timestamp": datetime.fromtimestamp(doc.operations.timestamps[i]).isoformat()
+            }
+    
+    async def iter_document_history(self, doc_id: str, since_version: int = 0,
+                                    limit: Optional[int] = None) -> Optional[Iterator[Dict[str, Any]]]:
+        doc = await self._get(doc_id)
+        if doc is None:
             return None
         
-        doc = self.documents[doc_id]
-        history = []
+        since_version = max(since_version, 0)
+        stop_version = doc.version if limit is None else min(since_version + limit, doc.version)
+        base_version = doc.operations.base_version
+        stored = []
+        if since_version < base_version and self.store is not None:
+            stored = await self.store.read_operations(doc_id, since_version + 1, min(stop_version, base_version) + 1)
+        return self._history_entries(doc, since_version, stop_version, stored)
+    
+    async def get_document_history(self, doc_id: str, since_version: int = 0,
+                                   limit: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        entries = await self.iter_document_history(doc_id, since_version, limit)
+        if entries is None:
+            return None
+        return list(entries)
+    
+    async def get_document_delta(self, doc_id: str, since_version: int, content_hash: str) -> Optional[TextOperation]:
+        doc = await self._get(doc_id)
+        if doc is None:
+            return None
         
-        for i, ops in enumerate(doc.operations):
-            history.append({
-                "version": i + 1,
-                "operations": [op.to_dict() for op in ops],
-                "timestamp": doc.updated_at.isoformat()
-            })
+        if since_version < doc.operations.base_version or since_version > doc.version:
+            return None
+        if doc.version - since_version > MAX_DELTA_OPERATIONS:
+            return None
+        if doc.content_hash(since_version, self.ot) != content_hash:
+            return None
         
-        return history
+        delta = doc.compose_since(since_version)
+        if delta.change_length > len(doc.buffer) // 2:
+            return None
+        return delta
     
-    def get_document_at_version(self, doc_id: str, version: int) -> Optional[str]:
-        if doc_id not in self.documents:
+    async def _buffer_at_version(self, doc: Document, version: int) -> Optional[TextBuffer]:
+        if version >= doc.operations.base_version:
+            return doc.buffer_at_version(version, self.ot)
+        if version < 0 or self.store is None:
             return None
         
-        doc = self.documents[doc_id]
-        if version > doc.version or version < 0:
+        snapshot = await self.store.read_snapshot(doc.doc_id, version)
+        if snapshot is None:
+            return None
+        buffer = self.buffer_factory(snapshot["content"])
+        for _, _, components in await self.store.read_operations(doc.doc_id, snapshot["version"] + 1, version + 1):
+            buffer = self.ot.apply_to_buffer(buffer, TextOperation.normalize(components))
+        return buffer
+    
+    async def get_document_at_version(self, doc_id: str, version: int) -> Optional[str]:
+        doc = await self._get(doc_id)
+        if doc is None:
             return None
         
-        return doc.content
+        if version == doc.version:
+            return doc.content
+        buffer = await self._buffer_at_version(doc, version)
+        return None if buffer is None else buffer.to_string()
     
-    def set_document_language(self, doc_id: str, language: str) -> bool:
-        if doc_id not in self.documents:
+    async def set_document_language(self, doc_id: str, language: str) -> bool:
+        doc = await self._get(doc_id)
+        if doc is None:
             return False
         
-        self.documents[doc_id].language = language
+        doc.language = language
+        self._persist_snapshot(doc)
         return True
     
-    def get_document_stats(self, doc_id: str) -> Optional[Dict[str, Any]]:
-        if doc_id not in self.documents:
+    async def get_document_stats(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        doc = await self._get(doc_id)
+        if doc is None:
             return None
         
-        doc = self.documents[doc_id]
-        return {
-            "doc_id": doc_id,
-            "content_length": len(doc.content),
-            "line_count": len(doc.content.split('\n')),
-            "version": doc.version,
-            "operation_count": len(doc.operations),
-            "created_at": doc.created_at.isoformat(),
-            "updated_at": doc.updated_at.isoformat(),
-            "language": doc.language
-        }
\ No newline at end of file
+        return doc.select(STATS_FIELDS)
@@ -0,0 +1,143 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+import asyncio
+import logging
+import multiprocessing
+import time
+
+from metrics import LATENCY_BUCKETS, PROFILER, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+MODE_INLINE = "inline"
+MODE_THREAD = "thread"
+MODE_PROCESS = "process"
+
+EXECUTIONS = REGISTRY.counter(
+    "mycollab_executions_total", "CPU-heavy tasks by kind and where they ran", ("kind", "mode"))
+OFFLOAD_SECONDS = REGISTRY.histogram(
+    "mycollab_offload_seconds", "Wall time of offloaded tasks, including time spent queued", ("mode",))
+LOOP_LAG_SECONDS = REGISTRY.histogram(
+    "mycollab_event_loop_lag_seconds", "How late the event loop woke a periodic timer",
+    buckets=(0.0005,) + LATENCY_BUCKETS[7:])
+LOOP_LAG_MAX_SECONDS = REGISTRY.gauge(
+    "mycollab_event_loop_lag_max_seconds", "Largest event loop lag seen in the last monitor window")
+
+
+def _timed(fn: Callable, *args: Any) -> Tuple[Any, float]:
+    started = time.thread_time()
+    result = fn(*args)
+    return result, time.thread_time() - started
+
+
+class ExecutionPolicy:
+    """Decides where a CPU-heavy task runs from its estimated cost: inline on
+    the event loop when it is cheap, on a thread when it has to read live
+    document state, and in a process when its inputs are plain values and the
+    cost is high enough to be worth shipping them. Callers await the result,
+    so work for one document still completes in submission order."""
+
+    def __init__(self, inline_cost: int = 64 * 1024, process_cost: int = 1024 * 1024,
+                 max_threads: int = 2, max_processes: int = 0):
+        self.inline_cost = inline_cost
+        self.process_cost = process_cost
+        self.max_threads = max_threads
+        self.max_processes = max_processes
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._processes: Optional[ProcessPoolExecutor] = None
+        self._counters = {}
+
+    def mode(self, cost: int, picklable: bool = False) -> str:
+        if cost < self.inline_cost:
+            return MODE_INLINE
+        if picklable and self.max_processes > 0 and cost >= self.process_cost:
+            return MODE_PROCESS
+        if self.max_threads > 0:
+            return MODE_THREAD
+        return MODE_INLINE
+
+    def start(self):
+        if self.max_processes > 0:
+            self._executor(MODE_PROCESS).submit(_timed, len, "")
+
+    def _executor(self, mode: str) -> Executor:
+        if mode == MODE_PROCESS:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(self.max_processes, mp_context=multiprocessing.get_context("spawn"))
+            return self._processes
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(self.max_threads, thread_name_prefix="mycollab-ot")
+        return self._threads
+
+    def _count(self, kind: str, mode: str):
+        counter = self._counters.get((kind, mode))
+        if counter is None:
+            counter = self._counters[(kind, mode)] = EXECUTIONS.labels(kind, mode)
+        counter.inc()
+
+    async def run(self, kind: str, cost: int, fn: Callable, *args: Any, picklable: bool = False,
+                  doc_id: Optional[str] = None) -> Any:
+        mode = self.mode(cost, picklable)
+        self._count(kind, mode)
+        if mode == MODE_INLINE:
+            if doc_id is None:
+                return fn(*args)
+            with PROFILER.section(doc_id):
+                return fn(*args)
+
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        result, cpu_seconds = await loop.run_in_executor(self._executor(mode), _timed, fn, *args)
+        OFFLOAD_SECONDS.labels(mode).observe(time.perf_counter() - started)
+        if doc_id is not None:
+            PROFILER.charge(doc_id, cpu_seconds)
+        return result
+
+    def close(self):
+        for executor in (self._threads, self._processes):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        self._threads = self._processes = None
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.05, window: int = 100, decay: float = 0.8):
+        self.interval = interval
+        self.window = window
+        self.decay = decay
+        self.max_lag = 0.0
+        self.recent_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        window_max = 0.0
+        samples = 0
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            LOOP_LAG_SECONDS.observe(lag)
+            self.recent_lag = max(lag, self.recent_lag * self.decay)
+            window_max = max(window_max, lag)
+            samples += 1
+            if samples >= self.window:
+                self.max_lag = window_max
+                LOOP_LAG_MAX_SECONDS.set(window_max)
+                if window_max > 0.1:
+                    logger.warning("Event loop lagged by up to %.0f ms", window_max * 1000)
+                window_max = 0.0
+                samples = 0
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
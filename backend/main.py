@@ -1,19 +1,78 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from contextlib import asynccontextmanager
+from pydantic import BaseModel, Field
 import json
 import uuid
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Set
 import asyncio
 from datetime import datetime
 import uvicorn
 import os
+import time
 
-from operational_transform import OperationalTransform
-from document_manager import DocumentManager
+from operational_transform import OperationalTransform, TextOperation
+from document_manager import DOCUMENT_FIELDS, METADATA_FIELDS, DocumentManager
+from connection_manager import ConnectionManager
+from text_buffer import get_buffer_factory
+from wire_protocol import ProtocolError
+from persistence import create_store
+from sequencer import OperationSequencer
+from cluster import ClusterRouter, create_cluster_node
+from metrics import CONTENT_TYPE, PROFILER, REGISTRY, STAGE_SECONDS
+from execution import ExecutionPolicy, LoopLagMonitor
+from admission import OVERLOADED_CLOSE_CODE, AdmissionController
+from static_assets import HealthCheck, StaticAssets
 
-app = FastAPI(title="MyCollab - Collaborative Code Editor")
+store = create_store(
+    os.environ.get("MYCOLLAB_STORAGE", "file"),
+    data_dir=os.environ.get("MYCOLLAB_DATA_DIR", "data"),
+    redis_url=os.environ.get("MYCOLLAB_REDIS_URL", "redis://localhost:6379/0"),
+    snapshot_interval=int(os.environ.get("MYCOLLAB_SNAPSHOT_INTERVAL", "1000"))
+)
+
+cluster = create_cluster_node(
+    os.environ.get("MYCOLLAB_CLUSTER_NODES"),
+    os.environ.get("MYCOLLAB_NODE_ID"),
+    os.environ.get("MYCOLLAB_BUS_URL", "redis://localhost:6379/0")
+)
+
+execution_policy = ExecutionPolicy(
+    inline_cost=int(os.environ.get("MYCOLLAB_OFFLOAD_INLINE_COST", "65536")),
+    process_cost=int(os.environ.get("MYCOLLAB_OFFLOAD_PROCESS_COST", "1048576")),
+    max_threads=int(os.environ.get("MYCOLLAB_OFFLOAD_THREADS", "2")),
+    max_processes=int(os.environ.get("MYCOLLAB_OFFLOAD_PROCESSES", "0"))
+)
+lag_monitor = LoopLagMonitor()
+admission = AdmissionController(
+    lambda: lag_monitor.recent_lag,
+    lambda: sum(len(seq.queue) for seq in sequencer.sequencers.values()) + (store.pending if store is not None else 0),
+    cursor_lag=int(os.environ.get("MYCOLLAB_SHED_CURSOR_LAG_MS", "50")) / 1000,
+    join_lag=int(os.environ.get("MYCOLLAB_SHED_JOIN_LAG_MS", "250")) / 1000,
+    cursor_backlog=int(os.environ.get("MYCOLLAB_SHED_CURSOR_BACKLOG", "2000")),
+    join_backlog=int(os.environ.get("MYCOLLAB_SHED_JOIN_BACKLOG", "10000"))
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if store is not None:
+        await store.start()
+    if cluster is not None:
+        await cluster.start()
+    execution_policy.start()
+    lag_monitor.start()
+    admission.start()
+    yield
+    await admission.close()
+    await lag_monitor.close()
+    if cluster is not None:
+        await cluster.close()
+    if store is not None:
+        await store.close()
+    execution_policy.close()
+
+app = FastAPI(title="MyCollab - Collaborative Code Editor", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,191 +82,336 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-doc_manager = DocumentManager()
+if cluster is not None:
+    app.add_middleware(ClusterRouter, node=cluster)
+
+app.add_middleware(HealthCheck)
+
+static_assets = StaticAssets(
+    os.environ.get("MYCOLLAB_FRONTEND_DIR", "../frontend"),
+    reload=os.environ.get("MYCOLLAB_STATIC_RELOAD", "0") == "1"
+)
+
+doc_manager = DocumentManager(
+    get_buffer_factory(os.environ.get("MYCOLLAB_TEXT_BUFFER", "rope")),
+    store,
+    max_documents=int(os.environ.get("MYCOLLAB_CACHE_MAX_DOCUMENTS", "10000")),
+    max_bytes=int(os.environ.get("MYCOLLAB_CACHE_MAX_MB", "512")) * 1024 * 1024,
+    max_history=int(os.environ.get("MYCOLLAB_HISTORY_MAX_OPERATIONS", "10000"))
+)
 ot = OperationalTransform()
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, Set[WebSocket]] = {}
-        self.user_info: Dict[WebSocket, dict] = {}
-
-    async def connect(self, websocket: WebSocket, doc_id: str, user_id: str, username: str):
-        await websocket.accept()
-        
-        if doc_id not in self.active_connections:
-            self.active_connections[doc_id] = set()
-        
-        self.active_connections[doc_id].add(websocket)
-        self.user_info[websocket] = {
-            "user_id": user_id,
-            "username": username,
-            "doc_id": doc_id,
-            "cursor_position": {"line": 0, "column": 0}
-        }
-        
-        doc_state = doc_manager.get_document(doc_id)
-        if not doc_state:
-            doc_manager.create_document(doc_id)
-            doc_state = doc_manager.get_document(doc_id)
-        
-        await websocket.send_text(json.dumps({
-            "type": "document_state",
-            "content": doc_state["content"],
-            "version": doc_state["version"]
-        }))
-        
-        await self.broadcast_user_joined(doc_id, user_id, username, websocket)
-
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.user_info:
-            user_info = self.user_info[websocket]
-            doc_id = user_info["doc_id"]
-            user_id = user_info["user_id"]
-            username = user_info["username"]
-            
-            if doc_id in self.active_connections:
-                self.active_connections[doc_id].discard(websocket)
-                if not self.active_connections[doc_id]:
-                    del self.active_connections[doc_id]
-            
-            del self.user_info[websocket]
-            
-            asyncio.create_task(self.broadcast_user_left(doc_id, user_id, username))
-
-    async def broadcast_user_joined(self, doc_id: str, user_id: str, username: str, exclude_websocket: WebSocket):
-        if doc_id in self.active_connections:
-            message = json.dumps({
-                "type": "user_joined",
-                "user_id": user_id,
-                "username": username
-            })
-            for connection in self.active_connections[doc_id]:
-                if connection != exclude_websocket:
-                    try:
-                        await connection.send_text(message)
-                    except:
-                        pass
-
-    async def broadcast_user_left(self, doc_id: str, user_id: str, username: str):
-        if doc_id in self.active_connections:
-            message = json.dumps({
-                "type": "user_left",
-                "user_id": user_id,
-                "username": username
-            })
-            for connection in self.active_connections[doc_id]:
-                try:
-                    await connection.send_text(message)
-                except:
-                    pass
-
-    async def broadcast_to_document(self, doc_id: str, message: dict, exclude_websocket: WebSocket = None):
-        if doc_id in self.active_connections:
-            message_str = json.dumps(message)
-            for connection in self.active_connections[doc_id]:
-                if connection != exclude_websocket:
-                    try:
-                        await connection.send_text(message_str)
-                    except:
-                        pass
-
-    async def broadcast_cursor_update(self, doc_id: str, user_id: str, cursor_position: dict, exclude_websocket: WebSocket = None):
-        if doc_id in self.active_connections:
-            message = json.dumps({
-                "type": "cursor_update",
-                "user_id": user_id,
-                "cursor_position": cursor_position
-            })
-            for connection in self.active_connections[doc_id]:
-                if connection != exclude_websocket:
-                    try:
-                        await connection.send_text(message)
-                    except:
-                        pass
-
-manager = ConnectionManager()
+manager = ConnectionManager(
+    doc_manager,
+    send_queue_size=int(os.environ.get("MYCOLLAB_SEND_QUEUE_SIZE", "256")),
+    overflow_policy=os.environ.get("MYCOLLAB_OVERFLOW_POLICY", "drop_cursor"),
+    cursor_tick_interval=int(os.environ.get("MYCOLLAB_CURSOR_TICK_MS", "33")) / 1000,
+    policy=execution_policy,
+    spectator_interval=int(os.environ.get("MYCOLLAB_SPECTATOR_TICK_MS", "100")) / 1000,
+    admission=admission,
+    max_frame_bytes=int(os.environ.get("MYCOLLAB_MAX_FRAME_KB", "4096")) * 1024,
+    connection_rate=float(os.environ.get("MYCOLLAB_CONNECTION_RATE", "100")),
+    connection_burst=float(os.environ.get("MYCOLLAB_CONNECTION_BURST", "200")),
+    document_rate=float(os.environ.get("MYCOLLAB_DOCUMENT_RATE", "500")),
+    document_burst=float(os.environ.get("MYCOLLAB_DOCUMENT_BURST", "1000"))
+)
+
+sequencer = OperationSequencer(
+    doc_manager,
+    manager,
+    tick_interval=int(os.environ.get("MYCOLLAB_SEQUENCER_TICK_MS", "0")) / 1000,
+    policy=execution_policy
+)
+
+HISTORY_PAGE_LIMIT = 1000
+LIST_PAGE_LIMIT = 1000
+BULK_LIMIT = 1000
+PROFILE_SORT_KEYS = ("cumulative", "tottime", "ncalls", "pcalls")
+DIFF_SECONDS = STAGE_SECONDS.labels("diff")
+NORMALIZE_COST = 128
+
+REGISTRY.gauge("mycollab_documents_resident", "Documents held in memory",
+               function=lambda: len(doc_manager.documents))
+REGISTRY.gauge("mycollab_documents_resident_bytes", "Approximate memory used by resident documents",
+               function=lambda: doc_manager.resident_bytes)
+REGISTRY.gauge("mycollab_oplog_operations", "Operations held in resident operation logs",
+               function=lambda: sum(len(doc.operations) for doc in doc_manager.documents.values()))
+REGISTRY.gauge("mycollab_oplog_bytes", "Approximate size of resident operation logs",
+               function=lambda: sum(doc.operations.size_bytes for doc in doc_manager.documents.values()))
+REGISTRY.gauge("mycollab_rooms", "Documents with at least one connection",
+               function=lambda: len(manager.active_connections))
+REGISTRY.gauge("mycollab_connections", "Open websocket connections",
+               function=lambda: len(manager.user_info))
+REGISTRY.gauge("mycollab_spectators", "Open read-only spectator connections",
+               function=lambda: len(manager.spectator_docs))
+REGISTRY.gauge("mycollab_room_connections_max", "Connections in the largest room",
+               function=lambda: max((len(room) for room in manager.active_connections.values()), default=0))
+REGISTRY.gauge("mycollab_send_queue_frames", "Frames waiting in connection send queues",
+               function=lambda: sum(len(queue) for queue in manager.send_queues.values()))
+REGISTRY.gauge("mycollab_send_queue_frames_max", "Frames waiting in the fullest send queue",
+               function=lambda: max((len(queue) for queue in manager.send_queues.values()), default=0))
+REGISTRY.gauge("mycollab_sequencer_queue_operations", "Operations waiting for a sequencer tick",
+               function=lambda: sum(len(seq.queue) for seq in sequencer.sequencers.values()))
+REGISTRY.gauge("mycollab_store_pending_records", "Records waiting for the next storage commit",
+               function=lambda: store.pending if store is not None else 0)
+REGISTRY.counter("mycollab_cache_hits_total", "Document cache hits", function=lambda: doc_manager.hits)
+REGISTRY.counter("mycollab_cache_misses_total", "Document cache misses", function=lambda: doc_manager.misses)
+REGISTRY.counter("mycollab_cache_evictions_total", "Documents evicted from memory",
+                 function=lambda: doc_manager.evictions)
+if cluster is not None:
+    REGISTRY.gauge("mycollab_node_info", "Cluster node serving this scrape", ("node",)).labels(cluster.node_id).set(1)
+
+class DocumentSpec(BaseModel):
+    doc_id: Optional[str] = None
+    content: str = ""
+    language: str = "javascript"
+
+class BulkCreateRequest(BaseModel):
+    documents: List[DocumentSpec] = Field(default=[], max_length=BULK_LIMIT)
+    count: int = Field(default=0, ge=0, le=BULK_LIMIT)
+
+class BulkFetchRequest(BaseModel):
+    doc_ids: List[str] = Field(max_length=BULK_LIMIT)
+    fields: List[str] = list(METADATA_FIELDS)
+
+def check_fields(fields: List[str]) -> List[str]:
+    unknown = [field for field in fields if field not in DOCUMENT_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return fields
 
 @app.get("/")
-async def read_root():
-    return FileResponse("../frontend/index.html")
+async def read_root(request: Request):
+    return static_assets.respond(static_assets.get_index(), request)
+
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def get_static_asset(path: str, request: Request):
+    return static_assets.respond(static_assets.get(path), request)
+
+@app.get("/api/documents")
+async def list_documents(cursor: Optional[str] = None, limit: int = 100, fields: str = ",".join(METADATA_FIELDS)):
+    selected = check_fields([field.strip() for field in fields.split(",") if field.strip()])
+    limit = max(1, min(limit, LIST_PAGE_LIMIT))
+    doc_ids = await doc_manager.list_document_ids(cursor, limit + 1)
+    headers = {}
+    if len(doc_ids) > limit:
+        doc_ids = doc_ids[:limit]
+        headers["X-Next-Cursor"] = doc_ids[-1]
+    return StreamingResponse(
+        (json.dumps(entry) + "\n" async for entry in doc_manager.iter_documents(doc_ids, selected)),
+        media_type="application/x-ndjson",
+        headers=headers
+    )
+
+@app.post("/api/bulk/documents")
+async def create_documents(request: BulkCreateRequest):
+    if len(request.documents) + request.count > BULK_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_LIMIT} documents per request")
+    specs = [spec.model_dump() for spec in request.documents] + [{} for _ in range(request.count)]
+    try:
+        if cluster is None:
+            doc_ids = await doc_manager.create_documents(specs)
+        else:
+            doc_ids = await create_documents_on_owners(specs)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"doc_ids": doc_ids}
+
+async def create_documents_on_owners(specs: List[dict]) -> List[str]:
+    for spec in specs:
+        spec["doc_id"] = spec.get("doc_id") or str(uuid.uuid4())
+    
+    async def create_on(owner: str, group: List[dict]):
+        if owner == cluster.node_id:
+            await doc_manager.create_documents(group)
+            return
+        status, body = await cluster.forward(owner, "POST", "/api/bulk/documents", json.dumps({"documents": group}).encode())
+        if status == 409:
+            raise ValueError(json.loads(body)["detail"])
+        if status != 200:
+            raise HTTPException(status_code=503, detail=f"Document owner {owner} failed with status {status}")
+    
+    groups = cluster.group_by_owner(spec["doc_id"] for spec in specs)
+    await asyncio.gather(*(create_on(owner, [specs[i] for i in indexes]) for owner, indexes in groups.items()))
+    return [spec["doc_id"] for spec in specs]
+
+@app.post("/api/bulk/documents/fetch")
+async def fetch_documents(request: BulkFetchRequest):
+    if len(request.doc_ids) > BULK_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_LIMIT} documents per request")
+    fields = check_fields(request.fields)
+    if "doc_id" not in fields:
+        fields = ["doc_id"] + fields
+    documents = await doc_manager.fetch_documents(request.doc_ids, fields)
+    found = {document["doc_id"] for document in documents}
+    return {"documents": documents, "missing": [doc_id for doc_id in request.doc_ids if doc_id not in found]}
 
 @app.get("/api/documents/{doc_id}")
-async def get_document(doc_id: str):
-    doc = doc_manager.get_document(doc_id)
+async def get_document(doc_id: str, include_history: bool = False):
+    doc = await doc_manager.get_document_snapshot(doc_id, include_history)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     return doc
 
+@app.get("/api/documents/{doc_id}/history")
+async def get_document_history(doc_id: str, since_version: int = 0, limit: int = 100):
+    doc = await doc_manager.get_document_ref(doc_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    limit = max(1, min(limit, HISTORY_PAGE_LIMIT))
+    since_version = max(0, since_version)
+    entries = await doc_manager.iter_document_history(doc_id, since_version, limit)
+    headers = {"X-Document-Version": str(doc.version)}
+    if since_version + limit < doc.version:
+        headers["X-Next-Since-Version"] = str(since_version + limit)
+    return StreamingResponse(
+        (json.dumps(entry) + "\n" for entry in entries),
+        media_type="application/x-ndjson",
+        headers=headers
+    )
+
+@app.get("/api/documents/{doc_id}/versions/{version}")
+async def get_document_version(doc_id: str, version: int):
+    content = await doc_manager.get_document_at_version(doc_id, version)
+    if content is None:
+        raise HTTPException(status_code=404, detail="Version not found")
+    return {"doc_id": doc_id, "version": version, "content": content}
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    return doc_manager.cache_stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+@app.post("/api/documents/{doc_id}/profile")
+async def set_document_profiling(doc_id: str, enabled: bool = True, sample_every: int = 1):
+    if enabled:
+        PROFILER.enable(doc_id, sample_every)
+    else:
+        PROFILER.disable(doc_id)
+    return {"doc_id": doc_id, "profiling": enabled, "sample_every": PROFILER.sample_every.get(doc_id)}
+
+@app.get("/api/documents/{doc_id}/profile")
+async def get_document_profile(doc_id: str, limit: int = 30, sort: str = "cumulative"):
+    if sort not in PROFILE_SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(PROFILE_SORT_KEYS)}")
+    report = PROFILER.report(doc_id, max(1, limit), sort)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profiling is not enabled for this document")
+    return PlainTextResponse(report)
+
+@app.get("/api/profile/documents")
+async def get_busiest_documents(limit: int = 10):
+    return PROFILER.top(max(1, limit))
+
 @app.post("/api/documents")
 async def create_document():
-    doc_id = str(uuid.uuid4())
-    doc_manager.create_document(doc_id)
+    doc_id = await doc_manager.create_document(cluster.new_document_id() if cluster is not None else None)
     return {"doc_id": doc_id, "message": "Document created successfully"}
 
+async def spectate(websocket: WebSocket, doc_id: str):
+    try:
+        interval = int(websocket.query_params.get("interval_ms", "0")) / 1000
+    except ValueError:
+        interval = 0.0
+    try:
+        await manager.connect_spectator(websocket, doc_id, interval)
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+    finally:
+        manager.disconnect_spectator(websocket)
+
 @app.websocket("/ws/{doc_id}")
 async def websocket_endpoint(websocket: WebSocket, doc_id: str):
+    if not admission.admit_join():
+        await manager.reject(websocket, OVERLOADED_CLOSE_CODE)
+        return
+    
+    if websocket.query_params.get("mode") == "spectator":
+        await spectate(websocket, doc_id)
+        return
+    
     user_id = websocket.query_params.get("user_id", str(uuid.uuid4()))
     username = websocket.query_params.get("username", f"User_{user_id[:8]}")
     
-    await manager.connect(websocket, doc_id, user_id, username)
-    
     try:
+        await manager.connect(websocket, doc_id, user_id, username)
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            try:
+                message = await manager.receive(websocket)
+            except ProtocolError as e:
+                manager.send(websocket, {
+                    "type": "error",
+                    "message": str(e)
+                })
+                continue
             
             if message["type"] == "operation":
-                operation = message["operation"]
-                client_version = message["version"]
-                
-                doc_state = doc_manager.get_document(doc_id)
-                if not doc_state:
-                    await websocket.send_text(json.dumps({
+                client_version = message.get("version")
+                if type(client_version) is not int or client_version < 0:
+                    manager.send(websocket, {
                         "type": "error",
-                        "message": "Document not found"
-                    }))
+                        "message": "Invalid document version"
+                    })
                     continue
                 
-                transformed_ops = ot.transform_operation(
-                    operation, 
-                    doc_state["operations"][client_version:],
-                    doc_state["version"]
-                )
-                
-                new_content = ot.apply_operation(doc_state["content"], transformed_ops)
-                new_version = doc_manager.apply_operation(doc_id, transformed_ops, new_content)
-                
-                await manager.broadcast_to_document(doc_id, {
-                    "type": "operation_applied",
-                    "operation": transformed_ops,
-                    "version": new_version,
-                    "user_id": user_id
-                }, exclude_websocket=websocket)
+                raw_operation = message["operation"]
+                cost = len(raw_operation) * NORMALIZE_COST if isinstance(raw_operation, list) else 0
+                try:
+                    operation = await execution_policy.run(
+                        "normalize", cost, TextOperation.normalize, raw_operation, picklable=True
+                    )
+                except ValueError as e:
+                    manager.send(websocket, {
+                        "type": "error",
+                        "message": str(e)
+                    })
+                    continue
                 
-                await websocket.send_text(json.dumps({
-                    "type": "operation_confirmed",
-                    "version": new_version
-                }))
+                await sequencer.submit(doc_id, websocket, user_id, operation, client_version)
                 
             elif message["type"] == "cursor_update":
-                cursor_position = message["cursor_position"]
-                if websocket in manager.user_info:
-                    manager.user_info[websocket]["cursor_position"] = cursor_position
-                
-                await manager.broadcast_cursor_update(
-                    doc_id, user_id, cursor_position, exclude_websocket=websocket
-                )
+                manager.update_cursor(websocket, message["cursor_position"])
                 
             elif message["type"] == "content_update":
+                doc = doc_manager.get_resident_document(doc_id)
+                if not doc:
+                    manager.send(websocket, {
+                        "type": "error",
+                        "message": "Document not found"
+                    })
+                    continue
+                
                 new_content = message["content"]
-                new_version = doc_manager.update_document(doc_id, new_content)
+                client_version = message.get("version", doc.version)
+                if type(client_version) is not int or client_version < 0:
+                    manager.send(websocket, {
+                        "type": "error",
+                        "message": "Invalid document version"
+                    })
+                    continue
+                shadow = manager.user_info[websocket].get("content_shadow")
+                if shadow and client_version < shadow[0]:
+                    client_version, base_content = shadow
+                else:
+                    base_content = doc.content_at_version(client_version, ot)
+                    if base_content is None:
+                        client_version, base_content = doc.version, doc.content
                 
-                await manager.broadcast_to_document(doc_id, {
-                    "type": "content_update",
-                    "content": new_content,
-                    "version": new_version,
-                    "user_id": user_id
-                }, exclude_websocket=websocket)
+                started = time.perf_counter()
+                operation = await execution_policy.run(
+                    "diff", len(base_content) + len(new_content), ot.create_operation, base_content, new_content,
+                    picklable=True, doc_id=doc_id
+                )
+                DIFF_SECONDS.observe(time.perf_counter() - started)
+                new_version = await sequencer.submit(doc_id, websocket, user_id, operation, client_version)
+                if new_version is not None:
+                    manager.user_info[websocket]["content_shadow"] = (new_version, new_content)
                 
             elif message["type"] == "chat_message":
                 await manager.broadcast_to_document(doc_id, {
@@ -217,9 +421,9 @@ async def websocket_endpoint(websocket: WebSocket, doc_id: str):
                 })
                 
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
 
-app.mount("/static", StaticFiles(directory="../frontend/static"), name="static")
-
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
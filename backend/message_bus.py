@@ -0,0 +1,256 @@
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import unquote, urlparse
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[bytes], None]
+
+
+class BusError(RuntimeError):
+    pass
+
+
+class MessageBus:
+    """Ordered pub/sub between cluster nodes. Handlers are plain callables
+    invoked in publish order for each channel; they must not block."""
+
+    async def start(self):
+        pass
+
+    async def subscribe(self, channel: str, handler: Handler):
+        raise NotImplementedError
+
+    async def publish(self, channel: str, data: bytes):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class LocalBus(MessageBus):
+    def __init__(self):
+        self.subscribers: Dict[str, List[Handler]] = {}
+
+    async def subscribe(self, channel: str, handler: Handler):
+        self.subscribers.setdefault(channel, []).append(handler)
+
+    async def publish(self, channel: str, data: bytes):
+        loop = asyncio.get_running_loop()
+        for handler in self.subscribers.get(channel, ()):
+            loop.call_soon(handler, data)
+
+
+def _encode_command(*args) -> bytes:
+    out = bytearray(b"*%d\r\n" % len(args))
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode("utf-8")
+        elif isinstance(arg, int):
+            arg = b"%d" % arg
+        out += b"$%d\r\n" % len(arg)
+        out += arg
+        out += b"\r\n"
+    return bytes(out)
+
+
+async def _read_reply(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed")
+    prefix, body = line[:1], line[1:-2]
+    if prefix == b"+":
+        return body
+    if prefix == b"-":
+        return BusError(body.decode("utf-8", "replace"))
+    if prefix == b":":
+        return int(body)
+    if prefix == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if prefix == b"*":
+        count = int(body)
+        if count < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(count)]
+    raise BusError(f"Unexpected reply: {line!r}")
+
+
+async def _open_connection(address: Tuple[str, ...]):
+    if address[0] == "unix":
+        return await asyncio.open_unix_connection(address[1])
+    return await asyncio.open_connection(address[1], int(address[2]))
+
+
+class RespBus(MessageBus):
+    """Pub/sub over the Redis protocol, against a Redis server or the
+    bundled RespBroker. Uses one connection for PUBLISH and one for
+    SUBSCRIBE, as Redis requires."""
+
+    def __init__(self, address: Tuple[str, ...], password: Optional[str] = None):
+        self.address = address
+        self.password = password
+        self.handlers: Dict[bytes, List[Handler]] = {}
+        self.published = 0
+        self._pub: Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = None
+        self._sub: Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = None
+        self._tasks: List[asyncio.Task] = []
+        self._subscribed: Dict[bytes, asyncio.Future] = {}
+
+    async def _connect(self):
+        reader, writer = await _open_connection(self.address)
+        if self.password:
+            writer.write(_encode_command("AUTH", self.password))
+            reply = await _read_reply(reader)
+            if isinstance(reply, BusError):
+                raise reply
+        return reader, writer
+
+    async def start(self):
+        if self._pub is not None:
+            return
+        self._pub = await self._connect()
+        self._sub = await self._connect()
+        self._tasks.append(asyncio.create_task(self._drain_replies(self._pub[0])))
+        self._tasks.append(asyncio.create_task(self._read_messages(self._sub[0])))
+
+    async def _drain_replies(self, reader: asyncio.StreamReader):
+        while True:
+            reply = await _read_reply(reader)
+            if isinstance(reply, BusError):
+                logger.warning("Publish failed: %s", reply)
+
+    async def _read_messages(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                reply = await _read_reply(reader)
+                if not isinstance(reply, list) or len(reply) < 3:
+                    continue
+                kind, channel = reply[0], reply[1]
+                if kind == b"message":
+                    for handler in self.handlers.get(channel, ()):
+                        try:
+                            handler(reply[2])
+                        except Exception:
+                            logger.exception("Bus handler for %r failed", channel)
+                elif kind == b"subscribe":
+                    future = self._subscribed.pop(channel, None)
+                    if future is not None and not future.done():
+                        future.set_result(None)
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.error("Lost message bus subscription: %s", e)
+
+    async def subscribe(self, channel: str, handler: Handler):
+        await self.start()
+        key = channel.encode("utf-8")
+        first = key not in self.handlers
+        self.handlers.setdefault(key, []).append(handler)
+        if first:
+            future = asyncio.get_running_loop().create_future()
+            self._subscribed[key] = future
+            self._sub[1].write(_encode_command("SUBSCRIBE", key))
+            await future
+
+    async def publish(self, channel: str, data: bytes):
+        writer = self._pub[1]
+        writer.write(_encode_command("PUBLISH", channel, data))
+        self.published += 1
+        await writer.drain()
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        for connection in (self._pub, self._sub):
+            if connection is not None:
+                connection[1].close()
+        self._tasks = []
+        self._pub = self._sub = None
+
+
+class RespBroker:
+    """Minimal Redis-protocol pub/sub server (SUBSCRIBE, UNSUBSCRIBE,
+    PUBLISH, PING) used when the cluster runs on one machine."""
+
+    def __init__(self, path: Optional[str] = None, host: str = "127.0.0.1", port: int = 0):
+        self.path = path
+        self.host = host
+        self.port = port
+        self.channels: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        if self.path is not None:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._server = await asyncio.start_unix_server(self._handle, self.path)
+        else:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscriptions: Set[bytes] = set()
+        try:
+            while True:
+                command = await _read_reply(reader)
+                if not isinstance(command, list) or not command:
+                    writer.write(b"-ERR protocol error\r\n")
+                    continue
+                name = command[0].upper()
+                if name == b"PUBLISH" and len(command) == 3:
+                    subscribers = self.channels.get(command[1], ())
+                    message = _encode_command("message", command[1], command[2])
+                    for subscriber in subscribers:
+                        subscriber.write(message)
+                    writer.write(b":%d\r\n" % len(subscribers))
+                elif name == b"SUBSCRIBE":
+                    for channel in command[1:]:
+                        self.channels.setdefault(channel, set()).add(writer)
+                        subscriptions.add(channel)
+                        writer.write(_encode_command("subscribe", channel, len(subscriptions)))
+                elif name == b"UNSUBSCRIBE":
+                    for channel in command[1:] or list(subscriptions):
+                        self._unsubscribe(channel, writer)
+                        subscriptions.discard(channel)
+                        writer.write(_encode_command("unsubscribe", channel, len(subscriptions)))
+                elif name == b"PING":
+                    writer.write(b"+PONG\r\n")
+                elif name == b"AUTH":
+                    writer.write(b"+OK\r\n")
+                else:
+                    writer.write(b"-ERR unknown command\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in subscriptions:
+                self._unsubscribe(channel, writer)
+            writer.close()
+
+    def _unsubscribe(self, channel: bytes, writer: asyncio.StreamWriter):
+        subscribers = self.channels.get(channel)
+        if subscribers is not None:
+            subscribers.discard(writer)
+            if not subscribers:
+                del self.channels[channel]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+def create_bus(url: str) -> MessageBus:
+    if url == "local":
+        return LocalBus()
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        return RespBus(("unix", unquote(parsed.path)))
+    if parsed.scheme == "redis":
+        return RespBus(("tcp", parsed.hostname or "localhost", parsed.port or 6379), parsed.password)
+    raise ValueError(f"Unknown message bus URL: {url}")
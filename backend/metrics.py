@@ -0,0 +1,278 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import cProfile
+import io
+import math
+import pstats
+import time
+
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+class Metric:
+    """A metric family. Metrics without labels are updated directly; labelled
+    ones through the child returned by labels(), which callers on hot paths
+    should resolve once and keep."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._children: Dict[Tuple[str, ...], "Metric"] = {}
+
+    def _new_child(self) -> "Metric":
+        return type(self)(self.name, self.documentation)
+
+    def labels(self, *values: str) -> "Metric":
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}")
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def samples(self) -> Iterator[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        raise NotImplementedError
+
+    def render(self, out: List[str]):
+        out.append(f"# HELP {self.name} {self.documentation}")
+        out.append(f"# TYPE {self.name} {self.kind}")
+        if self.label_names:
+            children = [(tuple(zip(self.label_names, values)), child) for values, child in self._children.items()]
+        else:
+            children = [((), self)]
+        for labels, child in children:
+            for suffix, extra, value in child.samples():
+                out.append(f"{self.name}{suffix}{_format_labels(labels + extra)} {_format_value(value)}")
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, label_names)
+        self.value = 0
+        self.function = function
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def samples(self):
+        yield "", (), self.function() if self.function is not None else self.value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, label_names)
+        self.value = 0
+        self.function = function
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def samples(self):
+        yield "", (), self.function() if self.function is not None else self.value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def _new_child(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield "_bucket", (("le", _format_value(float(bound))),), cumulative
+        yield "_bucket", (("le", "+Inf"),), self.count
+        yield "_sum", (), self.sum
+        yield "_count", (), self.count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                function: Optional[Callable[[], float]] = None) -> Counter:
+        return self.register(Counter(name, documentation, label_names, function))
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = (),
+              function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, label_names, function))
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> str:
+        out: List[str] = []
+        for metric in self.metrics.values():
+            metric.render(out)
+        out.append("")
+        return "\n".join(out)
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "mycollab_stage_seconds", "Time spent in each stage of the operation and broadcast path", ("stage",))
+COMMIT_BATCH_SIZE = REGISTRY.histogram(
+    "mycollab_commit_batch_operations", "Operations per sequencer commit batch", buckets=SIZE_BUCKETS)
+STORE_BATCH_SIZE = REGISTRY.histogram(
+    "mycollab_store_batch_records", "Records per group-committed storage write", buckets=SIZE_BUCKETS)
+OPERATIONS = REGISTRY.counter("mycollab_operations_total", "Operations committed")
+REJECTED_OPERATIONS = REGISTRY.counter("mycollab_operations_rejected_total", "Operations rejected by the sequencer")
+TRANSFORMS = REGISTRY.counter(
+    "mycollab_transforms_total", "Operations transformed against concurrent operations")
+BROADCAST_FRAMES = REGISTRY.counter(
+    "mycollab_broadcast_frames_total", "Frames queued to connections by broadcasts", ("kind",))
+SENT_FRAMES = REGISTRY.counter("mycollab_sent_frames_total", "Websocket frames written to clients")
+SENT_BYTES = REGISTRY.counter(
+    "mycollab_sent_bytes_total", "Payload size of frames written to clients (characters for text frames)")
+RECEIVED_FRAMES = REGISTRY.counter("mycollab_received_frames_total", "Websocket frames received from clients")
+RECEIVED_BYTES = REGISTRY.counter(
+    "mycollab_received_bytes_total", "Payload size of frames received from clients (characters for text frames)")
+DROPPED_FRAMES = REGISTRY.counter(
+    "mycollab_dropped_frames_total", "Frames dropped or coalesced by full send queues", ("kind",))
+SLOW_CONSUMERS = REGISTRY.counter(
+    "mycollab_slow_consumer_disconnects_total", "Connections closed because their send queue overflowed")
+
+
+class DocumentProfiler:
+    """Accounts CPU time to documents and, for documents it is enabled on,
+    runs cProfile over a sample of their work so hot rooms can be inspected
+    without profiling the whole server."""
+
+    def __init__(self):
+        self.cpu_seconds: Dict[str, float] = {}
+        self.profiles: Dict[str, cProfile.Profile] = {}
+        self.sample_every: Dict[str, int] = {}
+        self._sections: Dict[str, int] = {}
+        self._active = False
+
+    def enable(self, doc_id: str, sample_every: int = 1):
+        self.sample_every[doc_id] = max(1, sample_every)
+        self.profiles.setdefault(doc_id, cProfile.Profile())
+
+    def disable(self, doc_id: str):
+        self.sample_every.pop(doc_id, None)
+        self.profiles.pop(doc_id, None)
+        self._sections.pop(doc_id, None)
+
+    def is_enabled(self, doc_id: str) -> bool:
+        return doc_id in self.sample_every
+
+    @contextmanager
+    def section(self, doc_id: str):
+        profile = None
+        every = self.sample_every.get(doc_id)
+        if every is not None and not self._active:
+            calls = self._sections.get(doc_id, 0)
+            self._sections[doc_id] = calls + 1
+            if calls % every == 0:
+                profile = self.profiles[doc_id]
+        started = time.thread_time()
+        if profile is not None:
+            try:
+                profile.enable()
+                self._active = True
+            except ValueError:
+                profile = None
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._active = False
+            self.cpu_seconds[doc_id] = self.cpu_seconds.get(doc_id, 0.0) + time.thread_time() - started
+
+    def charge(self, doc_id: str, cpu_seconds: float):
+        self.cpu_seconds[doc_id] = self.cpu_seconds.get(doc_id, 0.0) + cpu_seconds
+
+    def forget(self, doc_id: str):
+        if doc_id not in self.sample_every:
+            self.cpu_seconds.pop(doc_id, None)
+
+    def top(self, limit: int = 10) -> List[Dict[str, float]]:
+        busiest = sorted(self.cpu_seconds.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [{"doc_id": doc_id, "cpu_seconds": seconds, "profiling": doc_id in self.sample_every}
+                for doc_id, seconds in busiest]
+
+    def report(self, doc_id: str, limit: int = 30, sort: str = "cumulative") -> Optional[str]:
+        profile = self.profiles.get(doc_id)
+        if profile is None:
+            return None
+        out = io.StringIO()
+        try:
+            stats = pstats.Stats(profile, stream=out)
+        except TypeError:
+            return ""
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+PROFILER = DocumentProfiler()
@@ -0,0 +1,193 @@
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Any, Iterator, List, Optional, Sequence, Tuple, Union
+import threading
+import time
+
+from operational_transform import TextOperation
+from text_buffer import Rope
+
+MIN_CACHED_BLOCK = 8
+MAX_CACHED_BLOCKS = 4096
+CHECKPOINT_INTERVAL = 256
+CHECKPOINT_BYTES = 64 * 1024
+OPERATION_OVERHEAD = 96
+
+
+class CompactedVersionError(ValueError):
+    pass
+
+
+class OperationLogView(Sequence):
+    __slots__ = ("_entries", "_start", "_stop")
+
+    def __init__(self, entries: List, start: int, stop: int):
+        self._entries = entries
+        self._start = start
+        self._stop = stop
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self._entries[self._start + i] for i in range(start, stop, step)]
+            return OperationLogView(self._entries, self._start + start, self._start + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("Operation log view index out of range")
+        return self._entries[self._start + index]
+
+    def __iter__(self) -> Iterator:
+        entries = self._entries
+        for i in range(self._start, self._stop):
+            yield entries[i]
+
+
+class OperationLog(Sequence):
+    """Operations after base_version with their timestamps, plus content
+    checkpoints indexed by version. A checkpoint is taken every
+    checkpoint_interval operations or checkpoint_bytes of inserted and
+    deleted text, so rebuilding any retained version replays a bounded
+    number of operations from the nearest checkpoint. size_bytes counts
+    the operations and the checkpoint contents; a Rope checkpoint shares
+    its unchanged leaves with newer buffers, so it is charged only the text
+    changed since the previous checkpoint."""
+
+    def __init__(self, base_version: int = 0, max_cached_blocks: int = MAX_CACHED_BLOCKS,
+                 base_buffer: Any = None, checkpoint_interval: int = CHECKPOINT_INTERVAL,
+                 checkpoint_bytes: int = CHECKPOINT_BYTES):
+        self.base_version = base_version
+        self._entries: List[TextOperation] = []
+        self.timestamps = array("d")
+        self._blocks: "OrderedDict[Tuple[int, int], TextOperation]" = OrderedDict()
+        self._blocks_lock = threading.Lock()
+        self.max_cached_blocks = max_cached_blocks
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_bytes = checkpoint_bytes
+        self._checkpoint_versions = array("q")
+        self._checkpoint_buffers: List[Any] = []
+        self._checkpoint_sizes = array("q")
+        self._changed_since_checkpoint = 0
+        self.size_bytes = 0
+        if base_buffer is not None:
+            self.add_checkpoint(base_version, base_buffer)
+
+    @property
+    def version(self) -> int:
+        return self.base_version + len(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self._entries))
+            if step != 1:
+                return self._entries[index]
+            return OperationLogView(self._entries, start, max(start, stop))
+        return self._entries[index]
+
+    def __iter__(self) -> Iterator:
+        return iter(self._entries)
+
+    def append(self, operation: Any, timestamp: Optional[float] = None, buffer: Any = None):
+        self._entries.append(operation)
+        self.timestamps.append(time.time() if timestamp is None else timestamp)
+        change_length = operation.change_length
+        self.size_bytes += OPERATION_OVERHEAD + change_length
+        if buffer is None:
+            return
+        self._changed_since_checkpoint += change_length
+        last = self._checkpoint_versions[-1] if self._checkpoint_versions else self.base_version
+        if (self.version - last >= self.checkpoint_interval
+                or self._changed_since_checkpoint >= self.checkpoint_bytes):
+            self.add_checkpoint(self.version, buffer)
+
+    def add_checkpoint(self, version: int, buffer: Any):
+        if self._checkpoint_versions and version <= self._checkpoint_versions[-1]:
+            return
+        size = self._changed_since_checkpoint if isinstance(buffer, Rope) else len(buffer)
+        self._checkpoint_versions.append(version)
+        self._checkpoint_buffers.append(buffer)
+        self._checkpoint_sizes.append(size)
+        self._changed_since_checkpoint = 0
+        self.size_bytes += size
+
+    def compact(self, version: int) -> int:
+        i = bisect_right(self._checkpoint_versions, version) - 1
+        if i < 0 or self._checkpoint_versions[i] <= self.base_version:
+            return 0
+        base_version = self._checkpoint_versions[i]
+        dropped = base_version - self.base_version
+        for operation in self._entries[:dropped]:
+            self.size_bytes -= OPERATION_OVERHEAD + operation.change_length
+        self.size_bytes -= sum(self._checkpoint_sizes[:i])
+        self._entries = self._entries[dropped:]
+        self.timestamps = self.timestamps[dropped:]
+        self._checkpoint_versions = self._checkpoint_versions[i:]
+        self._checkpoint_buffers = self._checkpoint_buffers[i:]
+        self._checkpoint_sizes = self._checkpoint_sizes[i:]
+        self.base_version = base_version
+        with self._blocks_lock:
+            self._blocks = OrderedDict()
+        return dropped
+
+    def checkpoint_before(self, version: int) -> Tuple[int, Any]:
+        self._index(version)
+        i = bisect_right(self._checkpoint_versions, version) - 1
+        if i < 0:
+            raise CompactedVersionError(f"No checkpoint at or before version {version}")
+        return self._checkpoint_versions[i], self._checkpoint_buffers[i]
+
+    @property
+    def checkpoint_count(self) -> int:
+        return len(self._checkpoint_versions)
+
+    def _index(self, version: int) -> int:
+        if version < self.base_version:
+            raise CompactedVersionError(f"Version {version} is older than the retained log (base {self.base_version})")
+        return min(version - self.base_version, len(self._entries))
+
+    def since(self, version: int) -> OperationLogView:
+        start = self._index(version)
+        return OperationLogView(self._entries, start, len(self._entries))
+
+    def compose_range(self, start_version: int, stop_version: int) -> TextOperation:
+        start = self._index(start_version)
+        stop = min(max(self._index(stop_version), start), len(self._entries))
+        result = TextOperation()
+        pos = start
+        while pos < stop:
+            size = 1
+            while pos % (size * 2) == 0 and pos + size * 2 <= stop:
+                size *= 2
+            result = result.compose(self._block(pos, size))
+            pos += size
+        return result
+
+    def _block(self, start: int, size: int) -> TextOperation:
+        if size == 1:
+            return self._entries[start]
+        if size < MIN_CACHED_BLOCK:
+            result = self._entries[start]
+            for op in self._entries[start + 1:start + size]:
+                result = result.compose(op)
+            return result
+        key = (start, size)
+        with self._blocks_lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+                return block
+        half = size // 2
+        block = self._block(start, half).compose(self._block(start + half, half))
+        with self._blocks_lock:
+            self._blocks[key] = block
+            if len(self._blocks) > self.max_cached_blocks:
+                self._blocks.popitem(last=False)
+        return block
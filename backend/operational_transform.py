@@ -1,199 +1,480 @@
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Iterable, Union
 import json
+import sys
+
+from text_buffer import TextBuffer
+
+INTERN_MAX_LENGTH = 64
+MYERS_MAX_LENGTH = 20000
+MYERS_MAX_EDITS = 256
 
 class Operation:
+    __slots__ = ("type", "value", "length")
+
     def __init__(self, type: str, value: Any = None, length: int = 0):
         self.type = type
         self.value = value
         self.length = length
-    
+
     def to_dict(self):
         return {
             "type": self.type,
             "value": self.value,
             "length": self.length
         }
-    
+
     @classmethod
     def from_dict(cls, data: Dict[str, Any]):
         return cls(data["type"], data.get("value"), data.get("length", 0))
 
-class OperationalTransform:
+def _intern(value: str) -> str:
+    if len(value) <= INTERN_MAX_LENGTH:
+        return sys.intern(value)
+    return value
+
+def _checked_length(length: Any) -> int:
+    if type(length) is not int or length < 0:
+        raise ValueError(f"Invalid operation length: {length!r}")
+    return length
+
+def _checked_value(value: Any) -> str:
+    if not isinstance(value, str):
+        raise ValueError(f"Invalid insert value: {value!r}")
+    return value
+
+class _OperationBuilder:
+    __slots__ = ("components",)
+
     def __init__(self):
-        pass
-    
-    def create_operation(self, old_text: str, new_text: str, cursor_pos: int = None) -> List[Operation]:
-        operations = []
-        
-        i = 0
-        while i < len(old_text) and i < len(new_text):
-            if old_text[i] == new_text[i]:
-                operations.append(Operation("retain", length=1))
-                i += 1
+        self.components: List[Union[int, str]] = []
+
+    def retain(self, length: int):
+        if length <= 0:
+            return
+        components = self.components
+        if components and type(components[-1]) is int and components[-1] > 0:
+            components[-1] += length
+        else:
+            components.append(length)
+
+    def insert(self, value: str):
+        if not value:
+            return
+        components = self.components
+        if components and type(components[-1]) is str:
+            components[-1] = _intern(components[-1] + value)
+        elif components and components[-1] < 0:
+            if len(components) > 1 and type(components[-2]) is str:
+                components[-2] = _intern(components[-2] + value)
             else:
-                break
-        
-        if i < len(old_text):
-            operations.append(Operation("delete", length=len(old_text) - i))
-        
-        if i < len(new_text):
-            operations.append(Operation("insert", value=new_text[i:]))
-        
-        return operations
-    
-    def apply_operation(self, text: str, operations: List) -> str:
-        result = ""
-        pos = 0
-        
-        for op in operations:
+                components.insert(len(components) - 1, _intern(value))
+        else:
+            components.append(_intern(value))
+
+    def delete(self, length: int):
+        if length <= 0:
+            return
+        components = self.components
+        if components and type(components[-1]) is int and components[-1] < 0:
+            components[-1] -= length
+        else:
+            components.append(-length)
+
+    def add(self, component: Union[int, str]):
+        if type(component) is str:
+            self.insert(component)
+        elif component > 0:
+            self.retain(component)
+        else:
+            self.delete(-component)
+
+    def build(self) -> "TextOperation":
+        return TextOperation(tuple(self.components))
+
+class TextOperation:
+    """Canonical operation: a tuple of components where a positive int retains,
+    a negative int deletes and a str inserts. Adjacent components of the same
+    kind are merged and an insert always precedes a delete at the same offset."""
+
+    __slots__ = ("components",)
+
+    def __init__(self, components: Tuple[Union[int, str], ...] = ()):
+        self.components = components
+
+    @classmethod
+    def normalize(cls, operation: Any) -> "TextOperation":
+        if type(operation) is cls:
+            return operation
+        if operation is None:
+            return cls()
+        builder = _OperationBuilder()
+        for op in operation:
             if isinstance(op, dict):
                 op_type = op.get("type")
-                op_length = op.get("length", 0)
-                op_value = op.get("value", "")
+                if op_type == "retain":
+                    builder.retain(_checked_length(op.get("length", 0)))
+                elif op_type == "insert":
+                    builder.insert(_checked_value(op.get("value", "")))
+                elif op_type == "delete":
+                    builder.delete(_checked_length(op.get("length", 0)))
+                else:
+                    raise ValueError(f"Unknown operation type: {op_type}")
+            elif isinstance(op, Operation):
+                if op.type == "retain":
+                    builder.retain(_checked_length(op.length))
+                elif op.type == "insert":
+                    builder.insert(_checked_value(op.value))
+                elif op.type == "delete":
+                    builder.delete(_checked_length(op.length))
+                else:
+                    raise ValueError(f"Unknown operation type: {op.type}")
+            elif type(op) is str or type(op) is int:
+                builder.add(op)
             else:
-                op_type = op.type
-                op_length = op.length
-                op_value = op.value
-            
-            if op_type == "retain":
-                if pos + op_length > len(text):
-                    raise ValueError("Retain operation exceeds text length")
-                result += text[pos:pos + op_length]
-                pos += op_length
-            elif op_type == "insert":
-                result += op_value
-            elif op_type == "delete":
-                pos += op_length
-        
-        result += text[pos:]
+                raise ValueError(f"Invalid operation component: {op!r}")
+        return builder.build()
+
+    def __len__(self) -> int:
+        return len(self.components)
+
+    def __iter__(self):
+        for component in self.components:
+            if type(component) is str:
+                yield Operation("insert", value=component)
+            elif component > 0:
+                yield Operation("retain", length=component)
+            else:
+                yield Operation("delete", length=-component)
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, TextOperation) and self.components == other.components
+
+    def __hash__(self) -> int:
+        return hash(self.components)
+
+    def __repr__(self) -> str:
+        return f"TextOperation({self.components!r})"
+
+    @property
+    def base_length(self) -> int:
+        return sum(abs(c) for c in self.components if type(c) is int)
+
+    @property
+    def target_length(self) -> int:
+        return sum(len(c) if type(c) is str else c for c in self.components if type(c) is str or c > 0)
+
+    @property
+    def change_length(self) -> int:
+        return sum(len(c) if type(c) is str else -c for c in self.components if type(c) is str or c < 0)
+
+    def compose(self, other: "TextOperation") -> "TextOperation":
+        builder = _OperationBuilder()
+        ops1 = self.components
+        ops2 = other.components
+        i1 = i2 = 0
+        c1 = ops1[0] if ops1 else None
+        c2 = ops2[0] if ops2 else None
+
+        while c1 is not None or c2 is not None:
+            if c1 is not None and type(c1) is int and c1 < 0:
+                builder.delete(-c1)
+                i1 += 1
+                c1 = ops1[i1] if i1 < len(ops1) else None
+                continue
+            if c2 is not None and type(c2) is str:
+                builder.insert(c2)
+                i2 += 1
+                c2 = ops2[i2] if i2 < len(ops2) else None
+                continue
+            if c1 is None:
+                builder.add(c2)
+                for component in ops2[i2 + 1:]:
+                    builder.add(component)
+                break
+            if c2 is None:
+                builder.add(c1)
+                for component in ops1[i1 + 1:]:
+                    builder.add(component)
+                break
+
+            if type(c1) is str:
+                min_len = min(len(c1), abs(c2))
+                if c2 > 0:
+                    builder.insert(c1[:min_len])
+                c1 = c1[min_len:] or 0
+                c2 = c2 - min_len if c2 > 0 else c2 + min_len
+            else:
+                min_len = min(c1, abs(c2))
+                if c2 > 0:
+                    builder.retain(min_len)
+                else:
+                    builder.delete(min_len)
+                c1 -= min_len
+                c2 = c2 - min_len if c2 > 0 else c2 + min_len
+
+            if c1 == 0:
+                i1 += 1
+                c1 = ops1[i1] if i1 < len(ops1) else None
+            if c2 == 0:
+                i2 += 1
+                c2 = ops2[i2] if i2 < len(ops2) else None
+
+        return builder.build()
+
+    def is_noop(self) -> bool:
+        return all(type(c) is int and c > 0 for c in self.components)
+
+    def transform_index(self, index: int) -> int:
+        new_index = index
+        for component in self.components:
+            if type(component) is str:
+                new_index += len(component)
+            elif component > 0:
+                index -= component
+            else:
+                new_index -= min(index, -component)
+                index += component
+            if index < 0:
+                break
+        return new_index
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        result = []
+        for component in self.components:
+            if type(component) is str:
+                result.append({"type": "insert", "value": component})
+            elif component > 0:
+                result.append({"type": "retain", "length": component})
+            else:
+                result.append({"type": "delete", "length": -component})
         return result
-    
-    def transform_operation(self, operation: List, 
-                          concurrent_operations: List[List], 
-                          base_version: int) -> List:
-        transformed_ops = operation.copy()
-        
-        for concurrent_op in concurrent_operations:
-            transformed_ops = self._transform_against_operation(transformed_ops, concurrent_op)
-        
-        return transformed_ops
-    
-    def _transform_against_operation(self, op1: List, op2: List) -> List:
+
+def _common_prefix_length(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    lo = 0
+    step = 64
+    while lo < n:
+        hi = min(lo + step, n)
+        if a[lo:hi] == b[lo:hi]:
+            lo = hi
+            step *= 2
+            continue
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if a[lo:mid] == b[lo:mid]:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+    return n
+
+def _common_suffix_length(a: str, b: str, limit: int) -> int:
+    la, lb = len(a), len(b)
+    lo = 0
+    step = 64
+    while lo < limit:
+        hi = min(lo + step, limit)
+        if a[la - hi:la - lo] == b[lb - hi:lb - lo]:
+            lo = hi
+            step *= 2
+            continue
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if a[la - mid:la - lo] == b[lb - mid:lb - lo]:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+    return limit
+
+def _myers_diff(builder: _OperationBuilder, a: str, b: str, max_edits: int) -> bool:
+    n, m = len(a), len(b)
+    v = {1: 0}
+    trace = []
+    for d in range(min(max_edits, n + m) + 1):
+        trace.append(v.copy())
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                _build_myers_script(builder, a, b, trace)
+                return True
+    return False
+
+def _build_myers_script(builder: _OperationBuilder, a: str, b: str, trace: List[Dict[int, int]]):
+    script = []
+    x, y = len(a), len(b)
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            script.append(1)
+            x -= 1
+            y -= 1
+        if d > 0:
+            if x == prev_x:
+                script.append(b[prev_y])
+            else:
+                script.append(-1)
+        x, y = prev_x, prev_y
+    for component in reversed(script):
+        builder.add(component)
+
+class OperationalTransform:
+    def __init__(self):
+        pass
+
+    def create_operation(self, old_text: str, new_text: str, cursor_pos: int = None) -> TextOperation:
+        builder = _OperationBuilder()
+        if old_text == new_text:
+            builder.retain(len(old_text))
+            return builder.build()
+
+        prefix = _common_prefix_length(old_text, new_text)
+        suffix = _common_suffix_length(old_text, new_text, min(len(old_text), len(new_text)) - prefix)
+        old_middle = old_text[prefix:len(old_text) - suffix]
+        new_middle = new_text[prefix:len(new_text) - suffix]
+
+        builder.retain(prefix)
+        if (not old_middle or not new_middle or len(old_middle) + len(new_middle) > MYERS_MAX_LENGTH
+                or not _myers_diff(builder, old_middle, new_middle, MYERS_MAX_EDITS)):
+            builder.delete(len(old_middle))
+            builder.insert(new_middle)
+        builder.retain(suffix)
+
+        return builder.build()
+
+    def apply_operation(self, text: str, operations: Any) -> str:
         result = []
-        i1 = i2 = 0
-        
-        while i1 < len(op1) and i2 < len(op2):
-            op1_curr = op1[i1]
-            op2_curr = op2[i2]
-            
-            if isinstance(op1_curr, dict):
-                op1_type = op1_curr.get("type")
-                op1_length = op1_curr.get("length", 0)
-                op1_value = op1_curr.get("value", "")
+        pos = 0
+
+        for component in TextOperation.normalize(operations).components:
+            if type(component) is str:
+                result.append(component)
+            elif component > 0:
+                if pos + component > len(text):
+                    raise ValueError("Retain operation exceeds text length")
+                result.append(text[pos:pos + component])
+                pos += component
             else:
-                op1_type = op1_curr.type
-                op1_length = op1_curr.length
-                op1_value = op1_curr.value
-                
-            if isinstance(op2_curr, dict):
-                op2_type = op2_curr.get("type")
-                op2_length = op2_curr.get("length", 0)
-                op2_value = op2_curr.get("value", "")
+                pos -= component
+
+        result.append(text[pos:])
+        return "".join(result)
+
+    def apply_to_buffer(self, buffer: TextBuffer, operations: Any) -> TextBuffer:
+        pos = 0
+
+        for component in TextOperation.normalize(operations).components:
+            if type(component) is str:
+                buffer = buffer.insert(pos, component)
+                pos += len(component)
+            elif component > 0:
+                if pos + component > len(buffer):
+                    raise ValueError("Retain operation exceeds text length")
+                pos += component
             else:
-                op2_type = op2_curr.type
-                op2_length = op2_curr.length
-                op2_value = op2_curr.value
-            
-            if op1_type == "insert":
-                result.append(op1_curr)
+                if pos - component > len(buffer):
+                    raise ValueError("Delete operation exceeds text length")
+                buffer = buffer.delete(pos, -component)
+
+        return buffer
+
+    def transform_operation(self, operation: Any,
+                          concurrent_operations: Iterable,
+                          base_version: int) -> TextOperation:
+        """Rewrites operation to apply after concurrent_operations. When both
+        insert at the same offset, operation's text goes first. Ties are
+        decided against each concurrent operation as given. The sequencer
+        passes one operation composed from the log, and a composed operation
+        puts its inserts before its deletes at the same offset. So if the
+        concurrent ops delete up to operation's insert point and later insert
+        there, operation's text lands after that insert, where transforming
+        against them one at a time would put it before. Both orders converge
+        because every commit goes through the same composed path."""
+        transformed_ops = TextOperation.normalize(operation)
+
+        for concurrent_op in concurrent_operations:
+            transformed_ops = self._transform_against_operation(transformed_ops, TextOperation.normalize(concurrent_op))
+
+        return transformed_ops
+
+    def _transform_against_operation(self, op1: TextOperation, op2: TextOperation) -> TextOperation:
+        builder = _OperationBuilder()
+        ops1 = op1.components
+        ops2 = op2.components
+        i1 = i2 = 0
+        c1 = ops1[0] if ops1 else None
+        c2 = ops2[0] if ops2 else None
+
+        while c1 is not None:
+            if type(c1) is str:
+                builder.insert(c1)
                 i1 += 1
-            elif op2_type == "insert":
-                if op1_type == "retain":
-                    if isinstance(op1_curr, dict):
-                        op1_curr["length"] += len(op2_value)
-                    else:
-                        op1_curr.length += len(op2_value)
-                elif op1_type == "delete":
-                    result.append({"type": "retain", "length": len(op2_value)})
-                    result.append(op1_curr)
+                c1 = ops1[i1] if i1 < len(ops1) else None
+                continue
+            if c2 is None:
+                builder.add(c1)
+                for component in ops1[i1 + 1:]:
+                    builder.add(component)
+                break
+            if type(c2) is str:
+                builder.retain(len(c2))
                 i2 += 1
-            elif op1_type == "retain" and op2_type == "retain":
-                min_len = min(op1_length, op2_length)
-                result.append({"type": "retain", "length": min_len})
-                
-                if isinstance(op1_curr, dict):
-                    op1_curr["length"] -= min_len
-                else:
-                    op1_curr.length -= min_len
-                    
-                if isinstance(op2_curr, dict):
-                    op2_curr["length"] -= min_len
-                else:
-                    op2_curr.length -= min_len
-                
-                if (isinstance(op1_curr, dict) and op1_curr["length"] == 0) or (not isinstance(op1_curr, dict) and op1_curr.length == 0):
-                    i1 += 1
-                if (isinstance(op2_curr, dict) and op2_curr["length"] == 0) or (not isinstance(op2_curr, dict) and op2_curr.length == 0):
-                    i2 += 1
-            elif op1_type == "retain" and op2_type == "delete":
-                min_len = min(op1_length, op2_length)
-                
-                if isinstance(op1_curr, dict):
-                    op1_curr["length"] -= min_len
-                else:
-                    op1_curr.length -= min_len
-                    
-                if isinstance(op2_curr, dict):
-                    op2_curr["length"] -= min_len
-                else:
-                    op2_curr.length -= min_len
-                
-                if (isinstance(op1_curr, dict) and op1_curr["length"] == 0) or (not isinstance(op1_curr, dict) and op1_curr.length == 0):
-                    i1 += 1
-                if (isinstance(op2_curr, dict) and op2_curr["length"] == 0) or (not isinstance(op2_curr, dict) and op2_curr.length == 0):
-                    i2 += 1
-            elif op1_type == "delete" and op2_type == "retain":
-                result.append(op1_curr)
+                c2 = ops2[i2] if i2 < len(ops2) else None
+                continue
+
+            min_len = min(abs(c1), abs(c2))
+            if c1 > 0 and c2 > 0:
+                builder.retain(min_len)
+            elif c1 < 0 and c2 > 0:
+                builder.delete(min_len)
+
+            c1 = c1 - min_len if c1 > 0 else c1 + min_len
+            c2 = c2 - min_len if c2 > 0 else c2 + min_len
+            if c1 == 0:
                 i1 += 1
-            elif op1_type == "delete" and op2_type == "delete":
-                min_len = min(op1_length, op2_length)
-                
-                if isinstance(op1_curr, dict):
-                    op1_curr["length"] -= min_len
-                else:
-                    op1_curr.length -= min_len
-                    
-                if isinstance(op2_curr, dict):
-                    op2_curr["length"] -= min_len
-                else:
-                    op2_curr.length -= min_len
-                
-                if (isinstance(op1_curr, dict) and op1_curr["length"] == 0) or (not isinstance(op1_curr, dict) and op1_curr.length == 0):
-                    i1 += 1
-                if (isinstance(op2_curr, dict) and op2_curr["length"] == 0) or (not isinstance(op2_curr, dict) and op2_curr.length == 0):
-                    i2 += 1
-        
-        while i1 < len(op1):
-            result.append(op1[i1])
-            i1 += 1
-        
-        return result
-    
-    def compose_operations(self, op1: List[Operation], op2: List[Operation]) -> List[Operation]:
-        return op1 + op2
-    
-    def invert_operation(self, operation: List[Operation], text: str) -> List[Operation]:
-        inverted = []
+                c1 = ops1[i1] if i1 < len(ops1) else None
+            if c2 == 0:
+                i2 += 1
+                c2 = ops2[i2] if i2 < len(ops2) else None
+
+        while c2 is not None:
+            if type(c2) is str:
+                builder.retain(len(c2))
+            i2 += 1
+            c2 = ops2[i2] if i2 < len(ops2) else None
+
+        return builder.build()
+
+    def compose_operations(self, op1: Any, op2: Any) -> TextOperation:
+        return TextOperation.normalize(op1).compose(TextOperation.normalize(op2))
+
+    def invert_operation(self, operation: Any, text: str) -> TextOperation:
+        builder = _OperationBuilder()
         pos = 0
-        
-        for op in operation:
-            if op.type == "retain":
-                inverted.append(Operation("retain", length=op.length))
-                pos += op.length
-            elif op.type == "insert":
-                inverted.append(Operation("delete", length=len(op.value)))
-            elif op.type == "delete":
-                inverted.append(Operation("insert", value=text[pos:pos + op.length]))
-                pos += op.length
-        
-        return inverted
\ No newline at end of file
+
+        for component in TextOperation.normalize(operation).components:
+            if type(component) is str:
+                builder.delete(len(component))
+            elif component > 0:
+                builder.retain(component)
+                pos += component
+            else:
+                builder.insert(text[pos:pos - component])
+                pos -= component
+
+        return builder.build()
@@ -0,0 +1,544 @@
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote
+import asyncio
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+from metrics import STAGE_SECONDS, STORE_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+OpRecord = Tuple[int, float, list]
+
+_RECORD_HEADER = struct.Struct(">II")
+
+STORE_WRITE_SECONDS = STAGE_SECONDS.labels("store_write")
+
+
+class PersistenceBackend:
+    def append_batch(self, records: List[Tuple[str, OpRecord]]):
+        raise NotImplementedError
+
+    def write_snapshot(self, doc_id: str, snapshot: Dict[str, Any]):
+        raise NotImplementedError
+
+    def load(self, doc_id: str) -> Optional[Tuple[Dict[str, Any], List[OpRecord]]]:
+        raise NotImplementedError
+
+    def read_snapshot(self, doc_id: str, version: int) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def read_operations(self, doc_id: str, start_version: int, stop_version: int) -> List[OpRecord]:
+        raise NotImplementedError
+
+    def exists(self, doc_id: str) -> bool:
+        return self.load(doc_id) is not None
+
+    def delete(self, doc_id: str):
+        raise NotImplementedError
+
+    def document_ids(self, after: Optional[str] = None, limit: Optional[int] = None) -> List[str]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def _page(ordered: List[str], after: Optional[str], limit: Optional[int]) -> List[str]:
+    start = bisect_right(ordered, after) if after is not None else 0
+    return ordered[start:] if limit is None else ordered[start:start + limit]
+
+
+def _encode_record(record: OpRecord) -> bytes:
+    payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+    return _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _read_records(path: str) -> Tuple[List[OpRecord], int]:
+    records = []
+    with open(path, "rb") as f:
+        data = f.read()
+    pos = 0
+    while pos + _RECORD_HEADER.size <= len(data):
+        length, crc = _RECORD_HEADER.unpack_from(data, pos)
+        start = pos + _RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        version, timestamp, components = json.loads(payload)
+        records.append((version, timestamp, components))
+        pos = start + length
+    return records, pos
+
+
+def _fsync_directory(path: str):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class SegmentFileBackend(PersistenceBackend):
+    """One directory per document holding snapshot and append-only segment
+    files named after the version they start at. Older snapshots are kept as
+    checkpoints for historical reads. Records are length + crc32 framed so a
+    torn tail write is detected: readers stop at it, and the writer truncates
+    it before appending to that segment again. Reads never touch the append
+    handles, so they may run on other threads than the writer. Document ids
+    are kept in a sorted index that this process updates as it creates and
+    deletes directories; it is rebuilt only when the root's mtime shows that
+    another process changed it."""
+
+    def __init__(self, root: str, segment_max_bytes: int = 4 * 1024 * 1024, max_open_files: int = 256,
+                 fsync: bool = True):
+        self.root = root
+        self.segment_max_bytes = segment_max_bytes
+        self.max_open_files = max_open_files
+        self.fsync = fsync
+        self._open_segments: "OrderedDict[str, Any]" = OrderedDict()
+        self.bytes_written = 0
+        self.records_written = 0
+        self.fsyncs = 0
+        self._index: Optional[List[str]] = None
+        self._index_mtime: Optional[int] = None
+        self._index_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _root_mtime(self) -> int:
+        return os.stat(self.root).st_mtime_ns
+
+    def _make_doc_dir(self, doc_id: str) -> str:
+        doc_dir = self._doc_dir(doc_id)
+        if os.path.isdir(doc_dir):
+            return doc_dir
+        with self._index_lock:
+            before = self._root_mtime()
+            os.makedirs(doc_dir, exist_ok=True)
+            if self._index is not None and before == self._index_mtime:
+                i = bisect_left(self._index, doc_id)
+                if i == len(self._index) or self._index[i] != doc_id:
+                    self._index.insert(i, doc_id)
+                self._index_mtime = self._root_mtime()
+        return doc_dir
+
+    def _doc_dir(self, doc_id: str) -> str:
+        return os.path.join(self.root, quote(doc_id, safe="").replace(".", "%2E"))
+
+    def _versioned_files(self, doc_dir: str, prefix: str, suffix: str) -> List[Tuple[int, str]]:
+        files = []
+        try:
+            names = os.listdir(doc_dir)
+        except FileNotFoundError:
+            return files
+        for name in names:
+            if name.startswith(prefix) and name.endswith(suffix):
+                files.append((int(name[len(prefix):-len(suffix)]), os.path.join(doc_dir, name)))
+        files.sort()
+        return files
+
+    def _segments(self, doc_dir: str) -> List[Tuple[int, str]]:
+        return self._versioned_files(doc_dir, "segment-", ".log")
+
+    def _snapshots(self, doc_dir: str) -> List[Tuple[int, str]]:
+        return self._versioned_files(doc_dir, "snapshot-", ".json")
+
+    def _segment_for_append(self, doc_id: str, version: int):
+        handle = self._open_segments.get(doc_id)
+        if handle is not None and handle.tell() < self.segment_max_bytes:
+            self._open_segments.move_to_end(doc_id)
+            return handle
+        if handle is not None:
+            handle.close()
+            del self._open_segments[doc_id]
+
+        doc_dir = self._make_doc_dir(doc_id)
+        segments = self._segments(doc_dir)
+        created = False
+        if segments and os.path.getsize(segments[-1][1]) < self.segment_max_bytes:
+            path = segments[-1][1]
+            _, valid_bytes = _read_records(path)
+            if valid_bytes < os.path.getsize(path):
+                logger.warning("Truncating torn tail of %s at byte %d", path, valid_bytes)
+                with open(path, "r+b") as f:
+                    f.truncate(valid_bytes)
+        else:
+            path = os.path.join(doc_dir, f"segment-{version:020d}.log")
+            created = True
+        handle = open(path, "ab")
+        if created:
+            _fsync_directory(doc_dir)
+        self._open_segments[doc_id] = handle
+        while len(self._open_segments) > self.max_open_files:
+            _, oldest = self._open_segments.popitem(last=False)
+            oldest.close()
+        return handle
+
+    def append_batch(self, records: List[Tuple[str, OpRecord]]):
+        touched = {}
+        for doc_id, record in records:
+            handle = self._segment_for_append(doc_id, record[0])
+            data = _encode_record(record)
+            handle.write(data)
+            touched[id(handle)] = handle
+            self.bytes_written += len(data)
+            self.records_written += 1
+        for handle in touched.values():
+            handle.flush()
+            if self.fsync:
+                os.fsync(handle.fileno())
+                self.fsyncs += 1
+
+    def write_snapshot(self, doc_id: str, snapshot: Dict[str, Any]):
+        doc_dir = self._make_doc_dir(doc_id)
+        data = json.dumps(snapshot, separators=(",", ":")).encode("utf-8")
+        path = os.path.join(doc_dir, f"snapshot-{snapshot['version']:020d}.json")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+                self.fsyncs += 1
+        os.replace(tmp_path, path)
+        if self.fsync:
+            _fsync_directory(doc_dir)
+        self.bytes_written += len(data)
+
+    def load(self, doc_id: str) -> Optional[Tuple[Dict[str, Any], List[OpRecord]]]:
+        snapshots = self._snapshots(self._doc_dir(doc_id))
+        if not snapshots:
+            return None
+        try:
+            with open(snapshots[-1][1], "rb") as f:
+                snapshot = json.loads(f.read())
+        except FileNotFoundError:
+            return None
+        return snapshot, self.read_operations(doc_id, snapshot["version"] + 1, None)
+
+    def exists(self, doc_id: str) -> bool:
+        try:
+            names = os.listdir(self._doc_dir(doc_id))
+        except FileNotFoundError:
+            return False
+        return any(name.startswith("snapshot-") and name.endswith(".json") for name in names)
+
+    def read_snapshot(self, doc_id: str, version: int) -> Optional[Dict[str, Any]]:
+        path = None
+        for snapshot_version, snapshot_path in self._snapshots(self._doc_dir(doc_id)):
+            if snapshot_version > version:
+                break
+            path = snapshot_path
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def read_operations(self, doc_id: str, start_version: int, stop_version: Optional[int]) -> List[OpRecord]:
+        segments = self._segments(self._doc_dir(doc_id))
+        first = 0
+        for i, (segment_start, _) in enumerate(segments):
+            if segment_start <= start_version:
+                first = i
+
+        records = []
+        for i, (segment_start, path) in enumerate(segments[first:], start=first):
+            if stop_version is not None and segment_start >= stop_version:
+                break
+            try:
+                segment_records, _ = _read_records(path)
+            except FileNotFoundError:
+                break
+            for record in segment_records:
+                if record[0] >= start_version and (stop_version is None or record[0] < stop_version):
+                    records.append(record)
+        return records
+
+    def delete(self, doc_id: str):
+        handle = self._open_segments.pop(doc_id, None)
+        if handle is not None:
+            handle.close()
+        doc_dir = self._doc_dir(doc_id)
+        try:
+            names = os.listdir(doc_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            os.remove(os.path.join(doc_dir, name))
+        with self._index_lock:
+            before = self._root_mtime()
+            os.rmdir(doc_dir)
+            if self._index is not None and before == self._index_mtime:
+                i = bisect_left(self._index, doc_id)
+                if i < len(self._index) and self._index[i] == doc_id:
+                    del self._index[i]
+                self._index_mtime = self._root_mtime()
+
+    def document_ids(self, after: Optional[str] = None, limit: Optional[int] = None) -> List[str]:
+        with self._index_lock:
+            mtime = self._root_mtime()
+            if self._index is None or mtime != self._index_mtime:
+                self._index = sorted(unquote(name) for name in os.listdir(self.root))
+                self._index_mtime = mtime
+            return _page(self._index, after, limit)
+
+    def close(self):
+        for handle in self._open_segments.values():
+            handle.close()
+        self._open_segments.clear()
+
+
+class RedisBackend(PersistenceBackend):
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "mycollab"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("The redis package is required for the redis storage backend")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.bytes_written = 0
+        self.records_written = 0
+        self.fsyncs = 0
+
+    def _ops_key(self, doc_id: str) -> str:
+        return f"{self.prefix}:ops:{doc_id}"
+
+    def _snapshots_key(self, doc_id: str) -> str:
+        return f"{self.prefix}:snapshots:{doc_id}"
+
+    def _index_key(self) -> str:
+        return f"{self.prefix}:document_index"
+
+    def append_batch(self, records: List[Tuple[str, OpRecord]]):
+        pipeline = self.client.pipeline(transaction=False)
+        for doc_id, record in records:
+            data = json.dumps(record, separators=(",", ":"))
+            pipeline.rpush(self._ops_key(doc_id), data)
+            self.bytes_written += len(data)
+            self.records_written += 1
+        pipeline.execute()
+
+    def write_snapshot(self, doc_id: str, snapshot: Dict[str, Any]):
+        data = json.dumps(snapshot, separators=(",", ":"))
+        key = self._snapshots_key(doc_id)
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.zremrangebyscore(key, snapshot["version"], snapshot["version"])
+        pipeline.zadd(key, {data: snapshot["version"]})
+        pipeline.sadd(f"{self.prefix}:documents", doc_id)
+        pipeline.zadd(self._index_key(), {doc_id: 0})
+        pipeline.execute()
+        self.bytes_written += len(data)
+
+    def load(self, doc_id: str) -> Optional[Tuple[Dict[str, Any], List[OpRecord]]]:
+        data = self.client.zrevrange(self._snapshots_key(doc_id), 0, 0)
+        if not data:
+            return None
+        snapshot = json.loads(data[0])
+        return snapshot, self.read_operations(doc_id, snapshot["version"] + 1, None)
+
+    def exists(self, doc_id: str) -> bool:
+        return self.client.exists(self._snapshots_key(doc_id)) > 0
+
+    def read_snapshot(self, doc_id: str, version: int) -> Optional[Dict[str, Any]]:
+        data = self.client.zrevrangebyscore(self._snapshots_key(doc_id), version, "-inf", start=0, num=1)
+        if not data:
+            return None
+        return json.loads(data[0])
+
+    def read_operations(self, doc_id: str, start_version: int, stop_version: Optional[int]) -> List[OpRecord]:
+        stop_index = -1 if stop_version is None else stop_version - 2
+        records = []
+        for data in self.client.lrange(self._ops_key(doc_id), max(start_version - 1, 0), stop_index):
+            version, timestamp, components = json.loads(data)
+            if version >= start_version and (stop_version is None or version < stop_version):
+                records.append((version, timestamp, components))
+        return records
+
+    def delete(self, doc_id: str):
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.delete(self._ops_key(doc_id), self._snapshots_key(doc_id))
+        pipeline.srem(f"{self.prefix}:documents", doc_id)
+        pipeline.zrem(self._index_key(), doc_id)
+        pipeline.execute()
+
+    def document_ids(self, after: Optional[str] = None, limit: Optional[int] = None) -> List[str]:
+        key = self._index_key()
+        if not self.client.exists(key):
+            members = self.client.smembers(f"{self.prefix}:documents")
+            if members:
+                self.client.zadd(key, {doc_id: 0 for doc_id in members})
+        start = "-" if after is None else "(" + after
+        if limit is None:
+            doc_ids = self.client.zrangebylex(key, start, "+")
+        else:
+            doc_ids = self.client.zrangebylex(key, start, "+", start=0, num=limit)
+        return [doc_id.decode("utf-8") for doc_id in doc_ids]
+
+    def close(self):
+        self.client.close()
+
+
+class OperationStore:
+    """Group-commits writes on a single writer thread. Reads go to a
+    separate pool and are awaited, so a cache miss or history read neither
+    blocks the event loop nor queues behind pending fsyncs."""
+
+    def __init__(self, backend: PersistenceBackend, commit_interval: float = 0.002, max_batch: int = 4096,
+                 snapshot_interval: int = 1000, read_threads: int = 4):
+        self.backend = backend
+        self.commit_interval = commit_interval
+        self.max_batch = max_batch
+        self.snapshot_interval = snapshot_interval
+        self.batches_committed = 0
+        self._pending: List[Tuple[str, Any, Optional[asyncio.Future]]] = []
+        self._last_futures: Dict[str, asyncio.Future] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mycollab-store")
+        self._readers = ThreadPoolExecutor(max_workers=read_threads, thread_name_prefix="mycollab-store-read")
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def start(self):
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def _enqueue(self, kind: str, item: Any, doc_id: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._ensure_started()
+        self._pending.append((kind, item, future))
+        self._last_futures[doc_id] = future
+        self._wakeup.set()
+        return future
+
+    def append(self, doc_id: str, version: int, timestamp: float, components: list) -> asyncio.Future:
+        return self._enqueue("op", (doc_id, (version, timestamp, components)), doc_id)
+
+    def snapshot(self, doc_id: str, snapshot: Dict[str, Any]) -> asyncio.Future:
+        return self._enqueue("snapshot", (doc_id, snapshot), doc_id)
+
+    def delete(self, doc_id: str) -> asyncio.Future:
+        return self._enqueue("delete", (doc_id, None), doc_id)
+
+    def persisted(self, doc_id: str) -> Optional[asyncio.Future]:
+        future = self._last_futures.get(doc_id)
+        if future is not None and future.done():
+            del self._last_futures[doc_id]
+            return None
+        return future
+
+    async def _read(self, fn, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._readers, fn, *args)
+
+    async def load(self, doc_id: str) -> Optional[Tuple[Dict[str, Any], List[OpRecord]]]:
+        return await self._read(self.backend.load, doc_id)
+
+    async def read_snapshot(self, doc_id: str, version: int) -> Optional[Dict[str, Any]]:
+        return await self._read(self.backend.read_snapshot, doc_id, version)
+
+    async def read_operations(self, doc_id: str, start_version: int, stop_version: Optional[int]) -> List[OpRecord]:
+        return await self._read(self.backend.read_operations, doc_id, start_version, stop_version)
+
+    async def exists(self, doc_id: str) -> bool:
+        return await self._read(self.backend.exists, doc_id)
+
+    async def document_ids(self, after: Optional[str] = None, limit: Optional[int] = None) -> List[str]:
+        return await self._read(self.backend.document_ids, after, limit)
+
+    def _write(self, batch: List[Tuple[str, Any, Optional[asyncio.Future]]]):
+        records = []
+        for kind, (doc_id, item), _ in batch:
+            if kind == "op":
+                records.append((doc_id, item))
+                continue
+            if records:
+                self.backend.append_batch(records)
+                records = []
+            if kind == "snapshot":
+                self.backend.write_snapshot(doc_id, item)
+            else:
+                self.backend.delete(doc_id)
+        if records:
+            self.backend.append_batch(records)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            if self.commit_interval and len(self._pending) < self.max_batch:
+                await asyncio.sleep(self.commit_interval)
+            self._wakeup.clear()
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            if self._pending:
+                self._wakeup.set()
+            if not batch:
+                continue
+            try:
+                started = time.perf_counter()
+                await loop.run_in_executor(self._executor, self._write, batch)
+                STORE_WRITE_SECONDS.observe(time.perf_counter() - started)
+                STORE_BATCH_SIZE.observe(len(batch))
+                self.batches_committed += 1
+                for kind, (doc_id, _), future in batch:
+                    if not future.done():
+                        future.set_result(None)
+                    if self._last_futures.get(doc_id) is future:
+                        del self._last_futures[doc_id]
+            except Exception as e:
+                logger.exception("Failed to persist %d records", len(batch))
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def flush(self):
+        futures = [future for _, _, future in self._pending]
+        futures.extend(self._last_futures.values())
+        if futures:
+            await asyncio.gather(*futures, return_exceptions=True)
+
+    async def close(self):
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._readers.shutdown(wait=True)
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.backend.close)
+        self._executor.shutdown(wait=True)
+
+
+def create_store(kind: str, data_dir: str = "data", redis_url: str = "redis://localhost:6379/0",
+                 snapshot_interval: int = 1000) -> Optional[OperationStore]:
+    if kind == "memory":
+        return None
+    if kind == "file":
+        return OperationStore(SegmentFileBackend(data_dir), snapshot_interval=snapshot_interval)
+    if kind == "redis":
+        return OperationStore(RedisBackend(redis_url), snapshot_interval=snapshot_interval)
+    raise ValueError(f"Unknown storage backend: {kind}")
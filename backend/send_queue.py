@@ -0,0 +1,132 @@
+from collections import deque
+from typing import Callable, Deque, Optional, Tuple, Union
+import asyncio
+import logging
+
+from fastapi import WebSocket
+
+from metrics import DROPPED_FRAMES, SENT_BYTES, SENT_FRAMES, SLOW_CONSUMERS
+from wire_protocol import JSON_CODEC
+
+logger = logging.getLogger(__name__)
+
+FRAME_CURSOR = "cursor"
+FRAME_CONTENT = "content"
+FRAME_MESSAGE = "message"
+
+POLICY_DROP_CURSOR = "drop_cursor"
+POLICY_COALESCE = "coalesce"
+POLICY_DISCONNECT = "disconnect"
+OVERFLOW_POLICIES = (POLICY_DROP_CURSOR, POLICY_COALESCE, POLICY_DISCONNECT)
+
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+DROPPED_FRAMES_BY_KIND = {kind: DROPPED_FRAMES.labels(kind) for kind in (FRAME_CURSOR, FRAME_CONTENT, FRAME_MESSAGE)}
+
+
+class SendQueue:
+    def __init__(self, websocket: WebSocket, max_size: int = 256,
+                 overflow_policy: str = POLICY_DROP_CURSOR,
+                 on_close: Optional[Callable[[WebSocket], None]] = None, codec=JSON_CODEC):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.websocket = websocket
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self.on_close = on_close
+        self.codec = codec
+        self.frames: Deque[Tuple[str, Optional[str], Union[str, bytes]]] = deque()
+        self.dropped = 0
+        self.sent = 0
+        self.closed = False
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def enqueue(self, frame: Union[str, bytes], kind: str = FRAME_MESSAGE, key: Optional[str] = None) -> bool:
+        if self.closed:
+            return False
+        if len(self.frames) >= self.max_size and not self._make_room(kind, key):
+            self.dropped += 1
+            DROPPED_FRAMES_BY_KIND[kind].inc()
+            return False
+        self.frames.append((kind, key, frame))
+        self._ready.set()
+        return True
+
+    def _make_room(self, kind: str, key: Optional[str]) -> bool:
+        if self.overflow_policy == POLICY_DISCONNECT:
+            self._close_slow_consumer()
+            return False
+
+        if self.overflow_policy == POLICY_COALESCE and key is not None:
+            for i, (queued_kind, queued_key, _) in enumerate(self.frames):
+                if queued_key == key:
+                    del self.frames[i]
+                    self.dropped += 1
+                    DROPPED_FRAMES_BY_KIND[queued_kind].inc()
+                    return True
+
+        if kind == FRAME_CURSOR:
+            return False
+        for i, (queued_kind, _, _) in enumerate(self.frames):
+            if queued_kind == FRAME_CURSOR:
+                del self.frames[i]
+                self.dropped += 1
+                DROPPED_FRAMES_BY_KIND[FRAME_CURSOR].inc()
+                return True
+
+        self._close_slow_consumer()
+        return False
+
+    def _close_slow_consumer(self):
+        SLOW_CONSUMERS.inc()
+        logger.warning("Disconnecting slow consumer with %d queued frames", len(self.frames))
+        self.close()
+        asyncio.create_task(self.close_websocket(SLOW_CONSUMER_CLOSE_CODE))
+
+    async def close_websocket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _run(self):
+        websocket = self.websocket
+        frames = self.frames
+        try:
+            while not self.closed:
+                if not frames:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                _, _, frame = frames.popleft()
+                if type(frame) is bytes:
+                    await websocket.send_bytes(frame)
+                else:
+                    await websocket.send_text(frame)
+                self.sent += 1
+                SENT_FRAMES.inc()
+                SENT_BYTES.inc(len(frame))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info("Send to websocket failed: %s", e)
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.frames.clear()
+        self._ready.set()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+        if self.on_close is not None:
+            self.on_close(self.websocket)
@@ -0,0 +1,283 @@
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import logging
+import time
+
+from fastapi import WebSocket
+
+from connection_manager import ConnectionManager
+from document_manager import Document, DocumentManager
+from execution import ExecutionPolicy
+from metrics import (COMMIT_BATCH_SIZE, OPERATIONS, PROFILER, REJECTED_OPERATIONS, STAGE_SECONDS,
+                     TRANSFORMS)
+from operation_log import CompactedVersionError
+from operational_transform import TextOperation
+from text_buffer import Rope, TextBuffer
+from wire_protocol import Frame
+
+logger = logging.getLogger(__name__)
+
+TRANSFORM_SECONDS = STAGE_SECONDS.labels("transform")
+APPLY_SECONDS = STAGE_SECONDS.labels("apply")
+BROADCAST_SECONDS = STAGE_SECONDS.labels("broadcast")
+PERSIST_WAIT_SECONDS = STAGE_SECONDS.labels("persist_wait")
+COMMIT_SECONDS = STAGE_SECONDS.labels("commit")
+
+COMPONENT_COST = 1024
+VERSION_COST = 512
+
+
+class PendingOperation:
+    __slots__ = ("websocket", "user_id", "operation", "client_version", "future", "version", "buffer", "applied",
+                 "broadcast")
+
+    def __init__(self, websocket: WebSocket, user_id: str, operation: TextOperation, client_version: int,
+                 future: asyncio.Future):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.operation = operation
+        self.client_version = client_version
+        self.future = future
+        self.version: Optional[int] = None
+        self.buffer: Optional[TextBuffer] = None
+        self.applied = False
+        self.broadcast = False
+
+
+class DocumentSequencer:
+    """Owns the commit path of one document. Operations submitted by any
+    connection are queued and, once per tick, transformed and applied in
+    arrival order as a single batch, so no other commit can interleave with
+    a batch in progress. Expensive operations are handed to the execution
+    policy and awaited, which keeps them in order. The task exits when the
+    queue drains."""
+
+    def __init__(self, doc_id: str, doc_manager: DocumentManager, connection_manager: ConnectionManager,
+                 tick_interval: float = 0.0, on_idle=None, policy: Optional[ExecutionPolicy] = None):
+        self.doc_id = doc_id
+        self.doc_manager = doc_manager
+        self.connection_manager = connection_manager
+        self.tick_interval = tick_interval
+        self.policy = policy or ExecutionPolicy()
+        self.on_idle = on_idle
+        self.queue: List[PendingOperation] = []
+        self.batches = 0
+        self.operations = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def submit(self, websocket: WebSocket, user_id: str, operation: TextOperation, client_version: int) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.queue.append(PendingOperation(websocket, user_id, operation, client_version, future))
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return future
+
+    async def _run(self):
+        try:
+            while self.queue:
+                await asyncio.sleep(self.tick_interval)
+                batch = self.queue
+                self.queue = []
+                started = time.perf_counter()
+                try:
+                    await self._commit_batch(batch)
+                except Exception:
+                    logger.exception("Failed to commit batch of %d operations for %s", len(batch), self.doc_id)
+                    self._fail(batch)
+                finally:
+                    COMMIT_SECONDS.observe(time.perf_counter() - started)
+                    COMMIT_BATCH_SIZE.observe(len(batch))
+                    for pending in batch:
+                        if not pending.future.done():
+                            pending.future.set_result(pending.version)
+        finally:
+            self._task = None
+            if self.on_idle is not None:
+                self.on_idle(self)
+
+    def _reject(self, pending: PendingOperation, message: str):
+        REJECTED_OPERATIONS.inc()
+        self.connection_manager.send(pending.websocket, {
+            "type": "error",
+            "message": message
+        })
+
+    def _fail(self, batch: List[PendingOperation]):
+        unsent = [pending for pending in batch if pending.applied and not pending.broadcast]
+        if unsent:
+            try:
+                self._broadcast(unsent, {pending.websocket for pending in batch})
+            except Exception:
+                logger.exception("Failed to broadcast %d applied operations for %s", len(unsent), self.doc_id)
+        doc = self.doc_manager.get_resident_document(self.doc_id)
+        notified: Set[WebSocket] = set()
+        for pending in batch:
+            if pending.future.done():
+                continue
+            if pending.version is None:
+                self._reject(pending, "Failed to commit operation, reloading document")
+            else:
+                self.connection_manager.send(pending.websocket, {
+                    "type": "operation_confirmed",
+                    "version": pending.version
+                })
+            if doc is not None and pending.websocket not in notified:
+                notified.add(pending.websocket)
+                self.connection_manager.send(pending.websocket, {
+                    "type": "document_state",
+                    "content": doc.content,
+                    "version": doc.version
+                })
+
+    def _cost(self, doc: Document, pending: PendingOperation) -> int:
+        components = pending.operation.components
+        cost = len(components) * COMPONENT_COST + (doc.version - pending.client_version) * VERSION_COST
+        if not isinstance(doc.buffer, Rope):
+            cost += len(doc.buffer) * len(components)
+        if cost < self.policy.inline_cost:
+            for component in components:
+                if type(component) is str:
+                    cost += len(component)
+        return cost
+
+    def _prepare(self, doc: Document, operation: TextOperation,
+                 client_version: int) -> Tuple[TextOperation, Optional[TextBuffer], float, float]:
+        ot = self.doc_manager.ot
+        started = time.perf_counter()
+        concurrent_ops = doc.compose_since(client_version)
+        transformed_ops = ot.transform_operation(operation, [concurrent_ops], doc.version)
+        transformed = time.perf_counter()
+        if transformed_ops.base_length != len(doc.buffer):
+            raise ValueError("Operation base length does not match document length")
+        new_buffer = None if transformed_ops.is_noop() else ot.apply_to_buffer(doc.buffer, transformed_ops)
+        return transformed_ops, new_buffer, transformed - started, time.perf_counter() - transformed
+
+    async def _apply_batch(self, doc: Document, batch: List[PendingOperation]) -> List[PendingOperation]:
+        applied: List[PendingOperation] = []
+        for pending in batch:
+            try:
+                transformed_ops, new_buffer, transform_seconds, apply_seconds = await self.policy.run(
+                    "commit", self._cost(doc, pending), self._prepare, doc, pending.operation,
+                    pending.client_version, doc_id=self.doc_id)
+            except CompactedVersionError:
+                self._reject(pending, "Document version is too old, reloading document")
+                self.connection_manager.send(pending.websocket, {
+                    "type": "document_state",
+                    "content": doc.content,
+                    "version": doc.version
+                })
+                continue
+            except ValueError as e:
+                self._reject(pending, str(e))
+                continue
+            except Exception:
+                logger.exception("Failed to prepare operation from %s for %s", pending.user_id, self.doc_id)
+                self._reject(pending, "Failed to apply operation")
+                continue
+
+            TRANSFORM_SECONDS.observe(transform_seconds)
+            if pending.client_version < doc.version:
+                TRANSFORMS.inc()
+            if new_buffer is None:
+                pending.version = doc.version
+                continue
+
+            started = time.perf_counter()
+            pending.operation = transformed_ops
+            pending.version = self.doc_manager.apply_operation(self.doc_id, transformed_ops, new_buffer)
+            pending.buffer = new_buffer
+            pending.applied = True
+            APPLY_SECONDS.observe(apply_seconds + time.perf_counter() - started)
+            applied.append(pending)
+
+        self.batches += 1
+        self.operations += len(applied)
+        OPERATIONS.inc(len(applied))
+        return applied
+
+    def _broadcast(self, applied: List[PendingOperation], senders: Set[WebSocket]) -> Optional[Frame]:
+        if len(applied) == 1:
+            pending = applied[0]
+            self.connection_manager.broadcast_frame(self.doc_id, Frame({
+                "type": "operation_applied",
+                "operation": pending.operation,
+                "version": pending.version,
+                "user_id": pending.user_id
+            }), exclude={pending.websocket})
+            return None
+        if not applied:
+            return None
+        frame = Frame({
+            "type": "operation_applied",
+            "version": applied[-1].version,
+            "operations": [{
+                "operation": pending.operation,
+                "version": pending.version,
+                "user_id": pending.user_id
+            } for pending in applied]
+        })
+        self.connection_manager.broadcast_frame(self.doc_id, frame, exclude=senders)
+        return frame
+
+    async def _commit_batch(self, batch: List[PendingOperation]):
+        doc = await self.doc_manager.get_document_ref(self.doc_id)
+        if not doc:
+            for pending in batch:
+                self._reject(pending, "Document not found")
+            return
+
+        before = doc.buffer
+        applied = await self._apply_batch(doc, batch)
+        senders: Set[WebSocket] = {pending.websocket for pending in batch}
+        with PROFILER.section(self.doc_id):
+            started = time.perf_counter()
+            frame = self._broadcast(applied, senders)
+            for pending in applied:
+                pending.broadcast = True
+            BROADCAST_SECONDS.observe(time.perf_counter() - started)
+            if applied:
+                self.connection_manager.transform_cursors(
+                    self.doc_id, [before] + [pending.buffer for pending in applied],
+                    [pending.operation for pending in applied],
+                    {pending.websocket: i for i, pending in enumerate(applied)})
+                self.connection_manager.notify_spectators(self.doc_id)
+
+        if applied:
+            started = time.perf_counter()
+            await self.doc_manager.wait_persisted(self.doc_id)
+            PERSIST_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+        if frame is not None:
+            for websocket in senders:
+                self.connection_manager.send_frame(websocket, frame)
+        for pending in batch:
+            if pending.version is not None:
+                self.connection_manager.send(pending.websocket, {
+                    "type": "operation_confirmed",
+                    "version": pending.version
+                })
+            if not pending.future.done():
+                pending.future.set_result(pending.version)
+
+
+class OperationSequencer:
+    def __init__(self, doc_manager: DocumentManager, connection_manager: ConnectionManager, tick_interval: float = 0.0,
+                 policy: Optional[ExecutionPolicy] = None):
+        self.doc_manager = doc_manager
+        self.connection_manager = connection_manager
+        self.tick_interval = tick_interval
+        self.policy = policy or ExecutionPolicy()
+        self.sequencers: Dict[str, DocumentSequencer] = {}
+
+    def submit(self, doc_id: str, websocket: WebSocket, user_id: str, operation: TextOperation,
+               client_version: int) -> asyncio.Future:
+        sequencer = self.sequencers.get(doc_id)
+        if sequencer is None:
+            sequencer = DocumentSequencer(doc_id, self.doc_manager, self.connection_manager,
+                                          self.tick_interval, on_idle=self._on_idle, policy=self.policy)
+            self.sequencers[doc_id] = sequencer
+        return sequencer.submit(websocket, user_id, operation, client_version)
+
+    def _on_idle(self, sequencer: DocumentSequencer):
+        if not sequencer.queue and self.sequencers.get(sequencer.doc_id) is sequencer:
+            del self.sequencers[sequencer.doc_id]
@@ -0,0 +1,126 @@
+from typing import Dict, Optional
+import asyncio
+
+from fastapi import WebSocket
+
+from document_manager import MAX_DELTA_OPERATIONS, Document, DocumentManager
+from metrics import REGISTRY
+from operation_log import CompactedVersionError
+from send_queue import FRAME_CONTENT, SendQueue
+from wire_protocol import Frame
+
+SPECTATOR_FRAMES = REGISTRY.counter("mycollab_spectator_frames_total", "Frames sent to spectators")
+SPECTATOR_FRAMES_BUILT = REGISTRY.counter(
+    "mycollab_spectator_frames_built_total", "Distinct spectator frames built (the rest were shared)")
+SPECTATOR_DEFERRED = REGISTRY.counter(
+    "mycollab_spectator_deferred_total",
+    "Spectator updates postponed because the previous send had not finished or the spectator asked for a lower rate")
+
+
+class Spectator:
+    __slots__ = ("websocket", "send_queue", "version", "interval", "next_send")
+
+    def __init__(self, send_queue: SendQueue, version: int, interval: float = 0.0):
+        self.websocket = send_queue.websocket
+        self.send_queue = send_queue
+        self.version = version
+        self.interval = interval
+        self.next_send = 0.0
+
+    def busy(self) -> bool:
+        return len(self.send_queue) > 0
+
+
+class SpectatorRoom:
+    """Read-only viewers of one document. They get no presence, cursor or
+    chat traffic: at most every interval the room composes the operations
+    committed since each spectator's last version into one document_delta.
+    Spectators at the same version share the frame, encoded once per codec
+    and passed to each send queue as is. A spectator whose previous frame
+    is still queued is skipped and later catches up with a single composed
+    delta, so a slow viewer holds at most one frame."""
+
+    def __init__(self, doc_id: str, doc_manager: DocumentManager, interval: float = 0.1):
+        self.doc_id = doc_id
+        self.doc_manager = doc_manager
+        self.interval = interval
+        self.members: Dict[WebSocket, Spectator] = {}
+        self.changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def add(self, spectator: Spectator, sync: Frame):
+        self.members[spectator.websocket] = spectator
+        self._send(spectator, sync)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def remove(self, websocket: WebSocket):
+        spectator = self.members.pop(websocket, None)
+        if spectator is not None:
+            spectator.send_queue.close()
+        if not self.members and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def notify(self):
+        self.changed.set()
+
+    async def _run(self):
+        while self.members:
+            await self.changed.wait()
+            self.changed.clear()
+            if self.publish():
+                self.changed.set()
+            await asyncio.sleep(self.interval)
+
+    def _delta_frame(self, doc: Document, version: int) -> Frame:
+        if doc.version - version <= MAX_DELTA_OPERATIONS:
+            try:
+                return Frame({
+                    "type": "document_delta",
+                    "since_version": version,
+                    "version": doc.version,
+                    "operation": doc.compose_since(version)
+                })
+            except CompactedVersionError:
+                pass
+        return Frame({
+            "type": "document_state",
+            "content": doc.content,
+            "version": doc.version
+        })
+
+    def publish(self) -> bool:
+        doc = self.doc_manager.get_resident_document(self.doc_id)
+        if doc is None:
+            return False
+
+        now = asyncio.get_running_loop().time()
+        frames: Dict[int, Frame] = {}
+        deferred = 0
+        for spectator in list(self.members.values()):
+            if spectator.version >= doc.version:
+                continue
+            if spectator.next_send > now or spectator.busy():
+                deferred += 1
+                continue
+            version = spectator.version
+            frame = frames.get(version)
+            if frame is None:
+                frame = frames[version] = self._delta_frame(doc, version)
+            spectator.version = doc.version
+            spectator.next_send = now + spectator.interval
+            self._send(spectator, frame)
+
+        SPECTATOR_FRAMES_BUILT.inc(len(frames))
+        if deferred:
+            SPECTATOR_DEFERRED.inc(deferred)
+        return deferred > 0
+
+    def _send(self, spectator: Spectator, frame: Frame):
+        send_queue = spectator.send_queue
+        if send_queue.enqueue(frame.encode(send_queue.codec), FRAME_CONTENT):
+            SPECTATOR_FRAMES.inc()
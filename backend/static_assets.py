@@ -0,0 +1,200 @@
+from typing import Dict, List, Optional, Set, Tuple
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESS_MIN_BYTES = 512
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+VERSION_PARAM = "v"
+
+_ASSET_REFERENCE = re.compile(r'((?:src|href)=")static/([^"?#]+)"')
+
+HEALTH_PATH = "/healthz"
+_HEALTH_START = {
+    "type": "http.response.start",
+    "status": 200,
+    "headers": [(b"content-type", b"text/plain"), (b"content-length", b"2"), (b"cache-control", b"no-store")]
+}
+_HEALTH_BODY = {"type": "http.response.body", "body": b"ok"}
+
+
+def _accepted_encodings(header: str) -> Set[str]:
+    accepted = set()
+    for item in header.split(","):
+        name, _, params = item.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q=") and params[2:] in ("0", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+class StaticAsset:
+    __slots__ = ("content_type", "digest", "variants", "mtime", "_headers")
+
+    def __init__(self, body: bytes, content_type: str, mtime: float = 0.0):
+        self.content_type = content_type
+        self.digest = hashlib.sha256(body).hexdigest()[:20]
+        self.variants: Dict[str, bytes] = {"identity": body}
+        self.mtime = mtime
+        self._headers: Dict[Tuple[str, bool], Dict[str, str]] = {}
+
+        if len(body) >= COMPRESS_MIN_BYTES and content_type.startswith(COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(body, 9, mtime=0)
+            if len(compressed) < len(body):
+                self.variants["gzip"] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=11)
+                if len(compressed) < len(body):
+                    self.variants["br"] = compressed
+
+    def etag(self, encoding: str) -> str:
+        return f'"{self.digest}"' if encoding == "identity" else f'"{self.digest}-{encoding}"'
+
+    def matches(self, if_none_match: str) -> bool:
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*":
+                return True
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag.strip('"').split("-", 1)[0] == self.digest:
+                return True
+        return False
+
+    def response(self, encoding: str, immutable: bool, not_modified: bool) -> Response:
+        key = (encoding, immutable)
+        headers = self._headers.get(key)
+        if headers is None:
+            headers = self._headers[key] = {
+                "ETag": self.etag(encoding),
+                "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+                "Vary": "Accept-Encoding"
+            }
+        if not_modified:
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers = {**headers, "Content-Encoding": encoding}
+        return Response(self.variants[encoding], headers=headers, media_type=self.content_type)
+
+
+class StaticAssets:
+    """Frontend files loaded into memory at startup, with gzip (and brotli,
+    when the package is installed) variants and content-hash ETags computed
+    once. References to static/ files in the index page are rewritten to
+    carry the file's hash, and requests for that exact version are cached by
+    browsers as immutable; everything else is revalidated with the ETag."""
+
+    def __init__(self, root: str, index: str = "index.html", static_dir: str = "static", reload: bool = False):
+        self.root = root
+        self.index_name = index
+        self.static_dir = static_dir
+        self.reload = reload
+        self.assets: Dict[str, StaticAsset] = {}
+        self.index: Optional[StaticAsset] = None
+        self.load()
+
+    def _paths(self) -> List[Tuple[str, str]]:
+        directory = os.path.join(self.root, self.static_dir)
+        paths = []
+        for current, _, names in os.walk(directory):
+            for name in names:
+                path = os.path.join(current, name)
+                paths.append((os.path.relpath(path, directory).replace(os.sep, "/"), path))
+        return paths
+
+    def _read(self, path: str) -> Tuple[bytes, float]:
+        with open(path, "rb") as f:
+            return f.read(), os.path.getmtime(path)
+
+    def load(self):
+        assets = {}
+        for name, path in self._paths():
+            body, mtime = self._read(path)
+            assets[name] = StaticAsset(body, mimetypes.guess_type(name)[0] or "application/octet-stream", mtime)
+
+        index = None
+        index_path = os.path.join(self.root, self.index_name)
+        if os.path.isfile(index_path):
+            body, mtime = self._read(index_path)
+            html = _ASSET_REFERENCE.sub(lambda match: self._versioned(match, assets), body.decode("utf-8"))
+            index = StaticAsset(html.encode("utf-8"), "text/html", mtime)
+        elif not assets:
+            logger.warning("No frontend assets found under %s", os.path.abspath(self.root))
+
+        self.assets = assets
+        self.index = index
+
+    def _versioned(self, match: "re.Match", assets: Dict[str, StaticAsset]) -> str:
+        asset = assets.get(match.group(2))
+        if asset is None:
+            return match.group(0)
+        return f'{match.group(1)}static/{match.group(2)}?{VERSION_PARAM}={asset.digest}"'
+
+    def _stale(self) -> bool:
+        paths = self._paths()
+        if len(paths) != len(self.assets):
+            return True
+        for name, path in paths:
+            asset = self.assets.get(name)
+            if asset is None or asset.mtime != os.path.getmtime(path):
+                return True
+        index_path = os.path.join(self.root, self.index_name)
+        if self.index is None:
+            return os.path.isfile(index_path)
+        return not os.path.isfile(index_path) or self.index.mtime != os.path.getmtime(index_path)
+
+    def get(self, path: str) -> Optional[StaticAsset]:
+        if self.reload and self._stale():
+            self.load()
+        return self.assets.get(path)
+
+    def get_index(self) -> Optional[StaticAsset]:
+        if self.reload and self._stale():
+            self.load()
+        return self.index
+
+    def respond(self, asset: Optional[StaticAsset], request: Request) -> Response:
+        if asset is None:
+            return Response(b"Not Found", status_code=404, media_type="text/plain")
+
+        encoding = "identity"
+        if len(asset.variants) > 1:
+            accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+            if "br" in accepted and "br" in asset.variants:
+                encoding = "br"
+            elif "gzip" in accepted and "gzip" in asset.variants:
+                encoding = "gzip"
+        immutable = request.query_params.get(VERSION_PARAM) == asset.digest
+        if_none_match = request.headers.get("if-none-match")
+        return asset.response(encoding, immutable, if_none_match is not None and asset.matches(if_none_match))
+
+
+class HealthCheck:
+    """Answers liveness probes before routing and the other middleware, with
+    prebuilt response messages."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == HEALTH_PATH:
+            await send(_HEALTH_START)
+            await send(_HEALTH_BODY)
+            return
+        await self.app(scope, receive, send)
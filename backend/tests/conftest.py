@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    os.environ["MYCOLLAB_DATA_DIR"] = str(tmp_path_factory.mktemp("data"))
+    os.environ.setdefault("MYCOLLAB_FRONTEND_DIR", os.path.join(os.path.dirname(BACKEND_DIR), "frontend"))
+    import main
+    return main
+
+
+@pytest.fixture(scope="session")
+def client(app_module):
+    from fastapi.testclient import TestClient
+
+    with TestClient(app_module.app) as client:
+        yield client
+
+
+@pytest.fixture
+def doc_id(client):
+    return client.post("/api/documents", json={}).json()["doc_id"]
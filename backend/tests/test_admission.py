@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from fastapi import WebSocketDisconnect
+
+from admission import (FRAME_TOO_LARGE_CLOSE_CODE, LEVEL_NORMAL, LEVEL_REJECT_JOINS, LEVEL_SHED_CURSORS,
+                       OVERLOADED_CLOSE_CODE, AdmissionController, TokenBucket)
+from connection_manager import ConnectionManager
+from document_manager import DocumentManager
+
+
+class ScriptedWebSocket:
+    def __init__(self, *incoming):
+        self.scope = {"subprotocols": []}
+        self.query_params = {}
+        self.incoming = list(incoming)
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def receive(self):
+        return self.incoming.pop(0)
+
+    async def send_text(self, data):
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+def test_token_bucket_lets_the_balance_go_negative_and_reports_the_wait():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve(2) == pytest.approx(0.3, abs=0.01)
+
+
+def test_level_rises_at_once_and_drops_only_after_the_hold():
+    load = {"lag": 0.0, "backlog": 0}
+    controller = AdmissionController(lambda: load["lag"], lambda: load["backlog"],
+                                     cursor_lag=0.05, join_lag=0.25, cursor_backlog=10, join_backlog=100, hold=2.0)
+    assert controller.update(now=0) == LEVEL_NORMAL
+    load["backlog"] = 10
+    assert controller.update(now=1) == LEVEL_SHED_CURSORS
+    assert controller.shedding_cursors and controller.admit_join()
+    load["lag"] = 0.3
+    assert controller.update(now=2) == LEVEL_REJECT_JOINS
+    assert not controller.admit_join()
+
+    load["lag"], load["backlog"] = 0.0, 0
+    assert controller.update(now=3) == LEVEL_REJECT_JOINS
+    assert controller.update(now=4) == LEVEL_NORMAL
+    assert controller.admit_join()
+
+
+def test_cursor_flushes_are_postponed_while_shedding():
+    async def run():
+        manager = DocumentManager()
+        await manager.create_document("d", "")
+        controller = AdmissionController(lambda: 0.0, lambda: 0)
+        controller.level = LEVEL_SHED_CURSORS
+        connections = ConnectionManager(manager, cursor_tick_interval=0.001, admission=controller)
+        websocket = ScriptedWebSocket()
+        await connections.connect(websocket, "d", "u0", "User 0")
+
+        connections.update_cursor(websocket, {"line": 2, "column": 1})
+        await asyncio.sleep(0.02)
+        assert connections.dirty_cursors["d"] == {websocket}
+        controller.level = LEVEL_NORMAL
+        while connections.cursor_tickers:
+            await asyncio.sleep(0.001)
+        assert "d" not in connections.dirty_cursors
+        await asyncio.sleep(0.01)
+        assert any("cursor_updates" in frame for frame in websocket.sent)
+
+    asyncio.run(run())
+
+
+def test_oversized_frame_closes_the_connection():
+    async def run():
+        manager = DocumentManager()
+        await manager.create_document("d", "")
+        connections = ConnectionManager(manager, max_frame_bytes=64)
+        websocket = ScriptedWebSocket({"type": "websocket.receive", "text": "x" * 65})
+        await connections.connect(websocket, "d", "u0", "User 0")
+        with pytest.raises(WebSocketDisconnect):
+            await connections.receive(websocket)
+        assert websocket.close_code == FRAME_TOO_LARGE_CLOSE_CODE
+
+    asyncio.run(run())
+
+
+def test_joins_are_refused_while_overloaded(client, doc_id, app_module, monkeypatch):
+    admission = app_module.admission
+    monkeypatch.setattr(admission, "measure", lambda: LEVEL_REJECT_JOINS)
+    admission.update()
+    try:
+        with pytest.raises(WebSocketDisconnect) as excinfo:
+            with client.websocket_connect(f"/ws/{doc_id}") as websocket:
+                websocket.receive_json()
+        assert excinfo.value.code == OVERLOADED_CLOSE_CODE
+    finally:
+        monkeypatch.undo()
+        admission.level = LEVEL_NORMAL
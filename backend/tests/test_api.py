@@ -0,0 +1,53 @@
+import json
+
+
+def test_bulk_create_returns_ids_in_request_order(client):
+    response = client.post("/api/bulk/documents", json={
+        "documents": [{"doc_id": "bulk-a", "content": "one"}, {"content": "two", "language": "python"}],
+        "count": 2
+    })
+    assert response.status_code == 200
+    doc_ids = response.json()["doc_ids"]
+    assert len(doc_ids) == 4 and doc_ids[0] == "bulk-a"
+    assert client.get(f"/api/documents/{doc_ids[1]}").json()["language"] == "python"
+
+    response = client.post("/api/bulk/documents", json={"documents": [{"doc_id": "bulk-a"}]})
+    assert response.status_code == 409
+
+
+def test_bulk_create_rejects_more_than_the_limit(client):
+    response = client.post("/api/bulk/documents", json={"documents": [{}], "count": 1000})
+    assert response.status_code == 400
+
+
+def test_bulk_fetch_returns_selected_fields_and_missing_ids(client):
+    client.post("/api/bulk/documents", json={"documents": [
+        {"doc_id": "fetch-a", "content": "a\nb"}, {"doc_id": "fetch-b", "content": "c"}
+    ]})
+    response = client.post("/api/bulk/documents/fetch", json={
+        "doc_ids": ["fetch-b", "fetch-missing", "fetch-a"],
+        "fields": ["line_count", "content_length"]
+    })
+    assert response.json() == {
+        "documents": [
+            {"doc_id": "fetch-b", "line_count": 1, "content_length": 1},
+            {"doc_id": "fetch-a", "line_count": 2, "content_length": 3},
+        ],
+        "missing": ["fetch-missing"]
+    }
+
+    response = client.post("/api/bulk/documents/fetch", json={"doc_ids": ["fetch-a"], "fields": ["secret"]})
+    assert response.status_code == 400
+
+
+def test_document_list_is_paged_by_cursor(client):
+    client.post("/api/bulk/documents", json={"documents": [{"doc_id": f"page-{i}"} for i in range(5)]})
+
+    response = client.get("/api/documents", params={"cursor": "page-", "limit": 3, "fields": "doc_id,version"})
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert response.headers["x-next-cursor"] == "page-2"
+    entries = [json.loads(line) for line in response.text.splitlines()]
+    assert entries == [{"doc_id": f"page-{i}", "version": 0} for i in range(3)]
+
+    response = client.get("/api/documents", params={"cursor": "page-2", "limit": 2, "fields": "doc_id"})
+    assert [json.loads(line)["doc_id"] for line in response.text.splitlines()] == ["page-3", "page-4"]
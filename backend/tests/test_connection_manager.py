@@ -0,0 +1,215 @@
+import asyncio
+import base64
+import hashlib
+import json
+import zlib
+
+import pytest
+
+from connection_manager import ConnectionManager
+from document_manager import DocumentManager
+from operational_transform import TextOperation
+from sequencer import OperationSequencer
+from text_buffer import Rope
+
+
+class FakeWebSocket:
+    def __init__(self, **query_params):
+        self.scope = {"subprotocols": []}
+        self.query_params = query_params
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data):
+        self.sent.append(json.loads(data))
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+    def messages(self, kind):
+        return [message for message in self.sent if message["type"] == kind]
+
+
+async def _until(condition):
+    while not condition():
+        await asyncio.sleep(0.001)
+
+
+async def _connect(content="", count=2, **options):
+    manager = DocumentManager()
+    await manager.create_document("d", content)
+    connections = ConnectionManager(manager, **options)
+    websockets = [FakeWebSocket() for _ in range(count)]
+    for i, websocket in enumerate(websockets):
+        await connections.connect(websocket, "d", f"u{i}", f"User {i}")
+    return connections, websockets
+
+
+def _cursors(websocket):
+    return [sorted(message["cursors"], key=lambda cursor: cursor["user_id"])
+            for message in websocket.messages("cursor_updates")]
+
+
+def test_cursor_moves_in_one_tick_are_sent_as_one_shared_frame():
+    async def run():
+        connections, (a, b, c) = await _connect(count=3, cursor_tick_interval=0.01)
+        connections.update_cursor(a, {"line": 1, "column": 2})
+        connections.update_cursor(a, {"line": 1, "column": 5})
+        connections.update_cursor(b, {"line": 2, "column": 1})
+        await _until(lambda: not connections.cursor_tickers)
+        await asyncio.sleep(0.01)
+
+        expected = [[
+            {"user_id": "u0", "cursor_position": {"line": 1, "column": 5}},
+            {"user_id": "u1", "cursor_position": {"line": 2, "column": 1}},
+        ]]
+        for websocket in (a, b, c):
+            assert _cursors(websocket) == expected
+        assert connections.dirty_cursors == {}
+
+    asyncio.run(run())
+
+
+def test_cursor_returned_to_its_flushed_position_is_not_sent():
+    async def run():
+        connections, (a, b) = await _connect(cursor_tick_interval=3600)
+        connections.update_cursor(a, {"line": 3, "column": 1})
+        assert connections.flush_cursor_updates("d") == 1
+        connections.update_cursor(a, {"line": 4, "column": 1})
+        connections.update_cursor(a, {"line": 3, "column": 1})
+        assert connections.flush_cursor_updates("d") == 0
+        await asyncio.sleep(0.01)
+        assert _cursors(b) == [[{"user_id": "u0", "cursor_position": {"line": 3, "column": 1}}]]
+        for task in connections.cursor_tickers.values():
+            task.cancel()
+
+    asyncio.run(run())
+
+
+def test_failed_connect_releases_the_send_queue():
+    async def run():
+        manager = DocumentManager()
+
+        async def broken_open(doc_id):
+            raise OSError("store unavailable")
+
+        manager.open_document = broken_open
+        connections = ConnectionManager(manager)
+        websocket = FakeWebSocket()
+        with pytest.raises(OSError):
+            await connections.connect(websocket, "d", "u0", "User 0")
+        assert connections.send_queues == {}
+        assert connections.rate_limits == {}
+        assert connections.user_info == {}
+
+    asyncio.run(run())
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _append(manager, doc_id, text):
+    doc = manager.get_resident_document(doc_id)
+    operation = TextOperation.normalize([len(doc.buffer), text])
+    manager.apply_operation(doc_id, operation, manager.ot.apply_to_buffer(doc.buffer, operation))
+
+
+def test_reconnect_with_matching_hash_gets_only_the_missed_operations():
+    async def run():
+        manager = DocumentManager()
+        await manager.create_document("d", "a" * 100)
+        connections = ConnectionManager(manager)
+        _append(manager, "d", "b")
+        _append(manager, "d", "c")
+
+        message = await connections.sync_message("d", "0", _sha256("a" * 100))
+        assert message["type"] == "document_delta"
+        assert (message["since_version"], message["version"]) == (0, 2)
+        assert message["operation"].components == (100, "bc")
+
+        for since_version, content_hash in (("0", _sha256("stale")), ("x", _sha256("a" * 100)), ("5", "")):
+            message = await connections.sync_message("d", since_version, content_hash)
+            assert message == {"type": "document_state", "content": "a" * 100 + "bc", "version": 2}
+
+    asyncio.run(run())
+
+
+def test_reconnect_falls_back_to_compressed_state_when_the_delta_is_large():
+    async def run():
+        manager = DocumentManager()
+        await manager.create_document("d", "")
+        connections = ConnectionManager(manager)
+        content = "line of text\n" * 1000
+        _append(manager, "d", content)
+
+        message = await connections.sync_message("d", "0", _sha256(""), compress=True)
+        assert message["type"] == "document_state"
+        assert message["content_encoding"] == "deflate"
+        assert zlib.decompress(base64.b64decode(message["content"])).decode("utf-8") == content
+
+    asyncio.run(run())
+
+
+def test_websocket_reconnect_receives_a_delta(client, doc_id):
+    with client.websocket_connect(f"/ws/{doc_id}?user_id=u1") as websocket:
+        assert websocket.receive_json()["version"] == 0
+        websocket.send_json({"type": "operation", "operation": ["hello world"], "version": 0})
+        assert websocket.receive_json()["version"] == 1
+
+    content_hash = _sha256("hello world")
+    with client.websocket_connect(f"/ws/{doc_id}?user_id=u1") as websocket:
+        websocket.receive_json()
+        websocket.send_json({"type": "operation", "operation": [11, "!"], "version": 1})
+        assert websocket.receive_json()["version"] == 2
+
+    with client.websocket_connect(f"/ws/{doc_id}?user_id=u1&since_version=1&content_hash={content_hash}") as websocket:
+        assert websocket.receive_json() == {
+            "type": "document_delta", "since_version": 1, "version": 2,
+            "operation": [{"type": "retain", "length": 11}, {"type": "insert", "value": "!"}]
+        }
+
+
+def test_cursors_move_through_the_batch_ops_after_their_authors_own():
+    async def run():
+        manager = DocumentManager()
+        await manager.create_document("d", "abc")
+        connections = ConnectionManager(manager, cursor_tick_interval=3600)
+        sequencer = OperationSequencer(manager, connections)
+        a, b, c = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        for i, websocket in enumerate((a, b, c)):
+            await connections.connect(websocket, "d", f"u{i}", f"User {i}")
+
+        connections.update_cursor(a, {"line": 1, "column": 6})
+        connections.update_cursor(b, {"line": 1, "column": 4})
+        connections.update_cursor(c, {"line": 1, "column": 2})
+        await asyncio.gather(
+            sequencer.submit("d", a, "u0", TextOperation.normalize([3, "XX"]), 0),
+            sequencer.submit("d", b, "u1", TextOperation.normalize(["YYY", 3]), 0),
+        )
+
+        assert manager.get_resident_document("d").content == "YYYabcXX"
+        assert connections.user_info[a]["cursor_position"] == {"line": 1, "column": 9}
+        assert connections.user_info[b]["cursor_position"] == {"line": 1, "column": 4}
+        assert connections.user_info[c]["cursor_position"] == {"line": 1, "column": 5}
+        for task in connections.cursor_tickers.values():
+            task.cancel()
+
+    asyncio.run(run())
+
+
+def test_cursors_of_authors_with_no_later_ops_are_left_alone():
+    connections = ConnectionManager(DocumentManager())
+    before, after = Rope("abc\ndef"), Rope("abc\ndefZ")
+    websocket = object()
+    connections.active_connections["d"] = {websocket}
+    connections.user_info[websocket] = {"cursor_position": {"line": 2, "column": 5},
+                                        "flushed_cursor_position": {"line": 2, "column": 5}}
+    connections.transform_cursors("d", [before, after], [TextOperation.normalize([7, "Z"])], {websocket: 0})
+    assert connections.user_info[websocket]["cursor_position"] == {"line": 2, "column": 5}
@@ -0,0 +1,54 @@
+import random
+
+import operational_transform
+from operational_transform import OperationalTransform, TextOperation
+
+ot = OperationalTransform()
+
+
+def _edit(rng, text, edits):
+    chars = list(text)
+    for _ in range(edits):
+        pos = rng.randint(0, len(chars))
+        if rng.random() < 0.5:
+            chars[pos:pos] = rng.choice("abcx") * rng.randint(1, 3)
+        else:
+            del chars[pos:pos + rng.randint(1, 4)]
+    return "".join(chars)
+
+
+def test_diff_round_trips():
+    rng = random.Random(2)
+    for _ in range(2000):
+        old = "".join(rng.choice("abc") for _ in range(rng.randint(0, 60)))
+        new = _edit(rng, old, rng.randint(0, 5))
+        operation = ot.create_operation(old, new)
+        assert operation.base_length == len(old)
+        assert ot.apply_operation(old, operation) == new
+
+
+def test_identical_texts_diff_to_a_retain():
+    assert ot.create_operation("same", "same") == TextOperation.normalize([4])
+    assert ot.create_operation("", "") == TextOperation.normalize([])
+
+
+def test_diff_keeps_common_text_between_edits():
+    operation = ot.create_operation("hello world foo", "hello brave world bar")
+    assert operation.change_length == len("brave ") + len("bar") + len("foo")
+
+
+def test_diff_falls_back_to_replace_past_edit_budget(monkeypatch):
+    monkeypatch.setattr(operational_transform, "MYERS_MAX_EDITS", 2)
+    rng = random.Random(5)
+    old = "".join(rng.choice("ab") for _ in range(200))
+    new = _edit(rng, old, 20)
+    operation = ot.create_operation(old, new)
+    assert ot.apply_operation(old, operation) == new
+    assert sum(1 for component in operation.components if type(component) is str) == 1
+
+
+def test_diff_of_large_text_with_small_change_is_local():
+    old = "x" * 1_000_000
+    new = old[:500_000] + "hello" + old[500_000:]
+    operation = ot.create_operation(old, new)
+    assert operation.components == (500_000, "hello", 500_000)
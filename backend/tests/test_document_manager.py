@@ -0,0 +1,108 @@
+import asyncio
+import threading
+
+from document_manager import DocumentManager
+from operational_transform import TextOperation
+from persistence import OperationStore, SegmentFileBackend
+
+
+class GatedBackend(SegmentFileBackend):
+    def __init__(self, root):
+        super().__init__(root, fsync=False)
+        self.gate = threading.Semaphore(0)
+
+    def append_batch(self, records):
+        self.gate.acquire()
+        super().append_batch(records)
+
+    def write_snapshot(self, doc_id, snapshot):
+        self.gate.acquire()
+        super().write_snapshot(doc_id, snapshot)
+
+
+def _append(manager, doc_id, text):
+    doc = manager.get_resident_document(doc_id)
+    operation = TextOperation.normalize([len(doc.buffer), text])
+    manager.apply_operation(doc_id, operation, manager.ot.apply_to_buffer(doc.buffer, operation))
+
+
+async def _until(condition):
+    while not condition():
+        await asyncio.sleep(0.001)
+
+
+def test_lru_evicts_least_recent_unpinned_document(tmp_path):
+    async def run():
+        store = OperationStore(SegmentFileBackend(str(tmp_path), fsync=False))
+        manager = DocumentManager(store=store, max_documents=2)
+        manager.is_pinned = {"a"}.__contains__
+        for doc_id in ("a", "b", "c", "d"):
+            await manager.create_document(doc_id, doc_id)
+        assert list(manager.documents) == ["a", "d"]
+        assert (await manager.get_document_ref("b")).content == "b"
+        assert "b" in manager.documents
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_reevicted_document_stays_resident_until_its_last_write_lands(tmp_path):
+    async def run():
+        backend = GatedBackend(str(tmp_path))
+        store = OperationStore(backend, commit_interval=0)
+        manager = DocumentManager(store=store, max_documents=1)
+
+        await manager.create_document("a", "")
+        await _until(lambda: store.pending == 0)
+        _append(manager, "a", "1")
+        await manager.create_document("b", "")
+        assert "a" in manager._evicting
+        first = store.persisted("a")
+
+        backend.gate.release()
+        await _until(lambda: store.pending == 0)
+
+        assert (await manager.get_document_ref("a")).content == "1"
+        _append(manager, "a", "2")
+        await manager.create_document("c", "")
+        assert "a" in manager._evicting
+        second = store.persisted("a")
+        assert second is not first
+
+        for _ in range(3):
+            backend.gate.release()
+        await first
+        await asyncio.sleep(0)
+        assert not second.done()
+        assert "a" in manager._evicting
+        assert (await manager.get_document_ref("a")).content == "12"
+
+        for _ in range(100):
+            backend.gate.release()
+        await store.close()
+
+        reopened = DocumentManager(store=OperationStore(SegmentFileBackend(str(tmp_path), fsync=False)))
+        assert (await reopened.get_document_ref("a")).content == "12"
+        await reopened.store.close()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_resident_history_is_bounded_and_older_history_comes_from_the_store(tmp_path):
+    async def run():
+        store = OperationStore(SegmentFileBackend(str(tmp_path), fsync=False), snapshot_interval=100)
+        manager = DocumentManager(store=store, max_history=300)
+        await manager.create_document("a", "")
+        for _ in range(1000):
+            _append(manager, "a", "x")
+        await store.flush()
+
+        doc = manager.get_resident_document("a")
+        assert 300 <= len(doc.operations) < 300 + 256
+        assert doc.operations.base_version == 1000 - len(doc.operations)
+        history = await manager.get_document_history("a", since_version=0)
+        assert [entry["version"] for entry in history] == list(range(1, 1001))
+        assert await manager.get_document_at_version("a", 10) == "x" * 10
+        await store.close()
+
+    asyncio.run(run())
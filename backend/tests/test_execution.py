@@ -0,0 +1,67 @@
+import asyncio
+import os
+import threading
+import time
+
+from execution import MODE_INLINE, MODE_PROCESS, MODE_THREAD, ExecutionPolicy, LoopLagMonitor
+from metrics import PROFILER
+
+
+def _thread_name():
+    return threading.current_thread().name
+
+
+def _spin(seconds):
+    started = time.thread_time()
+    while time.thread_time() - started < seconds:
+        pass
+
+
+def test_mode_follows_cost_and_picklability():
+    policy = ExecutionPolicy(inline_cost=100, process_cost=1000, max_threads=1, max_processes=1)
+    assert policy.mode(99) == MODE_INLINE
+    assert policy.mode(100) == MODE_THREAD
+    assert policy.mode(5000) == MODE_THREAD
+    assert policy.mode(5000, picklable=True) == MODE_PROCESS
+    assert policy.mode(999, picklable=True) == MODE_THREAD
+    assert ExecutionPolicy(inline_cost=100, max_threads=0).mode(5000) == MODE_INLINE
+
+
+def test_run_places_work_where_the_mode_says():
+    async def run():
+        policy = ExecutionPolicy(inline_cost=100, process_cost=1000, max_threads=1, max_processes=1)
+        try:
+            assert await policy.run("test", 1, _thread_name) == threading.current_thread().name
+            assert (await policy.run("test", 500, _thread_name)).startswith("mycollab-ot")
+            assert await policy.run("test", 5000, os.getpid, picklable=True) != os.getpid()
+        finally:
+            policy.close()
+
+    asyncio.run(run())
+
+
+def test_offloaded_cpu_time_is_charged_to_the_document():
+    async def run():
+        policy = ExecutionPolicy(inline_cost=100, max_threads=1)
+        try:
+            PROFILER.forget("offload-doc")
+            await policy.run("test", 500, _spin, 0.02, doc_id="offload-doc")
+            assert PROFILER.cpu_seconds["offload-doc"] >= 0.015
+        finally:
+            policy.close()
+            PROFILER.forget("offload-doc")
+
+    asyncio.run(run())
+
+
+def test_lag_monitor_notices_a_blocked_loop():
+    async def run():
+        monitor = LoopLagMonitor(interval=0.005)
+        monitor.start()
+        await asyncio.sleep(0.02)
+        time.sleep(0.05)
+        await asyncio.sleep(0.006)
+        assert monitor.recent_lag >= 0.02
+        await monitor.close()
+
+    asyncio.run(run())
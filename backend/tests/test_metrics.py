@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+from metrics import CONTENT_TYPE, DocumentProfiler, Registry
+
+
+def test_registry_renders_the_text_exposition_format():
+    registry = Registry()
+    registry.counter("jobs_total", "Jobs run").inc(3)
+    registry.gauge("queue_depth", "Queued jobs", function=lambda: 7)
+    stages = registry.histogram("stage_seconds", "Stage time", ("stage",), buckets=(0.1, 1))
+    stages.labels("load").observe(0.05)
+    stages.labels("load").observe(0.5)
+    errors = registry.counter("errors_total", "Errors", ("path",))
+    errors.labels('a"b\n').inc()
+
+    assert registry.render().splitlines() == [
+        "# HELP jobs_total Jobs run",
+        "# TYPE jobs_total counter",
+        "jobs_total 3",
+        "# HELP queue_depth Queued jobs",
+        "# TYPE queue_depth gauge",
+        "queue_depth 7",
+        "# HELP stage_seconds Stage time",
+        "# TYPE stage_seconds histogram",
+        'stage_seconds_bucket{stage="load",le="0.1"} 1',
+        'stage_seconds_bucket{stage="load",le="1.0"} 2',
+        'stage_seconds_bucket{stage="load",le="+Inf"} 2',
+        'stage_seconds_sum{stage="load"} 0.55',
+        'stage_seconds_count{stage="load"} 2',
+        "# HELP errors_total Errors",
+        "# TYPE errors_total counter",
+        'errors_total{path="a\\"b\\n"} 1',
+    ]
+
+
+def test_registry_rejects_duplicates_and_wrong_label_counts():
+    registry = Registry()
+    counter = registry.counter("jobs_total", "Jobs run", ("kind",))
+    with pytest.raises(ValueError):
+        registry.gauge("jobs_total", "Again")
+    with pytest.raises(ValueError):
+        counter.labels("a", "b")
+    assert counter.labels("a") is counter.labels("a")
+
+
+def test_profiler_accounts_cpu_and_samples_enabled_documents():
+    profiler = DocumentProfiler()
+    with profiler.section("quiet"):
+        pass
+    profiler.enable("hot", sample_every=2)
+    for _ in range(3):
+        with profiler.section("hot"):
+            started = time.thread_time()
+            while time.thread_time() - started < 0.005:
+                pass
+
+    assert [entry["doc_id"] for entry in profiler.top()] == ["hot", "quiet"]
+    assert profiler.top()[0]["profiling"] is True
+    assert "function calls" in profiler.report("hot", sort="tottime")
+    assert profiler.report("quiet") is None
+
+    profiler.forget("hot")
+    profiler.forget("quiet")
+    assert list(profiler.cpu_seconds) == ["hot"]
+    profiler.disable("hot")
+    profiler.forget("hot")
+    assert profiler.cpu_seconds == {}
+
+
+def test_metrics_endpoint_reports_committed_operations(client, doc_id):
+    with client.websocket_connect(f"/ws/{doc_id}") as websocket:
+        websocket.receive_json()
+        websocket.send_json({"type": "operation", "operation": ["x"], "version": 0})
+        websocket.receive_json()
+
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith(CONTENT_TYPE.split(";")[0])
+    samples = dict(line.rsplit(" ", 1) for line in response.text.splitlines() if line and not line.startswith("#"))
+    assert float(samples["mycollab_operations_total"]) >= 1
+    assert 'mycollab_stage_seconds_count{stage="commit"}' in samples
+    assert float(samples["mycollab_documents_resident"]) >= 1
@@ -0,0 +1,45 @@
+import pytest
+
+from operation_log import OPERATION_OVERHEAD, CompactedVersionError, OperationLog
+from operational_transform import OperationalTransform, TextOperation
+from text_buffer import Rope, StringBuffer
+
+
+def _fill(log, buffer, count, text="x"):
+    ot = OperationalTransform()
+    for _ in range(count):
+        operation = TextOperation.normalize([len(buffer), text])
+        buffer = ot.apply_to_buffer(buffer, operation)
+        log.append(operation, buffer=buffer)
+    return buffer
+
+
+def test_rope_checkpoints_are_charged_only_their_changes():
+    initial = "a" * 100000
+    log = OperationLog(base_buffer=Rope(initial), checkpoint_interval=4)
+    _fill(log, Rope(initial), 8)
+    assert log.checkpoint_count == 3
+    assert log.size_bytes == 8 * (OPERATION_OVERHEAD + 1) + 8
+
+
+def test_string_checkpoints_are_charged_their_full_length():
+    log = OperationLog(base_buffer=StringBuffer("abc"), checkpoint_interval=4)
+    _fill(log, StringBuffer("abc"), 4)
+    assert log.size_bytes == 4 * (OPERATION_OVERHEAD + 1) + 3 + 7
+
+
+def test_compact_drops_history_before_the_nearest_checkpoint():
+    log = OperationLog(base_buffer=Rope(""), checkpoint_interval=4)
+    buffer = _fill(log, Rope(""), 10)
+    before = log.compose_range(6, 10)
+    size = log.size_bytes
+
+    assert log.compact(7) == 4
+    assert (log.base_version, len(log), log.version) == (4, 6, 10)
+    assert log.checkpoint_before(7)[0] == 4
+    assert log.size_bytes == size - 4 * (OPERATION_OVERHEAD + 1)
+    assert log.compose_range(6, 10) == before
+    assert str(log.checkpoint_before(10)[1]) == str(buffer)[:8]
+    with pytest.raises(CompactedVersionError):
+        log.since(3)
+    assert log.compact(7) == 0
@@ -0,0 +1,133 @@
+import random
+
+import pytest
+
+from operation_log import OperationLog
+from operational_transform import OperationalTransform, TextOperation
+from text_buffer import Rope
+
+ot = OperationalTransform()
+
+
+def apply(text, operation):
+    return ot.apply_operation(text, operation)
+
+
+def test_concurrent_inserts_at_same_offset_put_transformed_text_first():
+    concurrent = TextOperation.normalize([1, "B", 1])
+    operation = TextOperation.normalize([1, "A", 1])
+    transformed = ot.transform_operation(operation, [concurrent], 0)
+    assert apply(apply("xy", concurrent), transformed) == "xABy"
+
+
+def test_composed_tie_break_differs_from_sequential_after_delete():
+    chain = [TextOperation.normalize([-1, 1]), TextOperation.normalize(["B", 1])]
+    composed = chain[0].compose(chain[1])
+    assert composed == TextOperation.normalize(["B", -1, 1])
+    operation = TextOperation.normalize([1, "A", 1])
+    current = apply(apply("xy", chain[0]), chain[1])
+    assert apply(current, ot.transform_operation(operation, chain, 0)) == "ABy"
+    assert apply(current, ot.transform_operation(operation, [composed], 0)) == "BAy"
+
+
+def test_sequencer_path_matches_composed_log_range():
+    log = OperationLog()
+    text = "xy"
+    for component in ([-1, 1], ["B", 1]):
+        operation = TextOperation.normalize(component)
+        text = apply(text, operation)
+        log.append(operation)
+    operation = TextOperation.normalize([1, "A", 1])
+    transformed = ot.transform_operation(operation, [log.compose_range(0, log.version)], log.version)
+    assert apply(text, transformed) == "BAy"
+
+
+def test_trailing_concurrent_insert_becomes_retain():
+    transformed = ot.transform_operation(TextOperation.normalize(["XY"]), [TextOperation.normalize(["abc"])], 1)
+    assert transformed == TextOperation.normalize(["XY", 3])
+
+
+def _random_operation(rng, text):
+    components = []
+    pos = 0
+    while pos < len(text):
+        length = rng.randint(1, len(text) - pos)
+        kind = rng.random()
+        if kind < 0.4:
+            components.append(length)
+        elif kind < 0.7:
+            components.append(-length)
+        else:
+            components.append("".join(rng.choice("ab\n") for _ in range(rng.randint(1, 3))))
+            continue
+        pos += length
+    if rng.random() < 0.5:
+        components.append("".join(rng.choice("ab\n") for _ in range(rng.randint(1, 3))))
+    return TextOperation.normalize(components)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_transform_against_composed_range_keeps_every_insert(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        text = "".join(rng.choice("ab\n") for _ in range(rng.randint(0, 12)))
+        operation = _random_operation(rng, text)
+        log = OperationLog()
+        current = text
+        for _ in range(rng.randint(1, 5)):
+            concurrent = _random_operation(rng, current)
+            current = apply(current, concurrent)
+            log.append(concurrent)
+        transformed = ot.transform_operation(operation, [log.compose_range(0, log.version)], log.version)
+        assert transformed.base_length == len(current)
+        inserted = "".join(c for c in operation.components if type(c) is str)
+        assert "".join(c for c in transformed.components if type(c) is str) == inserted
+        assert len(apply(current, transformed)) == transformed.target_length
+
+
+def test_normalize_merges_adjacent_components_and_orders_insert_before_delete():
+    assert TextOperation.normalize([2, 3, -1, "a", "b"]).components == (5, "ab", -1)
+    assert TextOperation.normalize([{"type": "retain", "length": 1}, {"type": "insert", "value": "x"}]) \
+        == TextOperation.normalize([1, "x"])
+
+
+def test_compose_matches_sequential_apply():
+    rng = random.Random(11)
+    for _ in range(500):
+        text = "".join(rng.choice("ab\n") for _ in range(rng.randint(0, 15)))
+        first = _random_operation(rng, text)
+        middle = apply(text, first)
+        second = _random_operation(rng, middle)
+        composed = first.compose(second)
+        assert apply(text, composed) == apply(middle, second)
+        assert composed.base_length == len(text)
+
+
+def test_invert_restores_original_text():
+    rng = random.Random(12)
+    for _ in range(500):
+        text = "".join(rng.choice("ab\n") for _ in range(rng.randint(0, 15)))
+        operation = _random_operation(rng, text)
+        inverse = ot.invert_operation(operation, text)
+        assert apply(apply(text, operation), inverse) == text
+
+
+def test_apply_to_buffer_rejects_operation_longer_than_buffer():
+    with pytest.raises(ValueError):
+        ot.apply_to_buffer(Rope("ab"), TextOperation.normalize([3]))
+    with pytest.raises(ValueError):
+        ot.apply_to_buffer(Rope("ab"), TextOperation.normalize([1, -2]))
+
+
+def test_transform_against_single_operation_rebases_onto_it():
+    rng = random.Random(13)
+    for _ in range(500):
+        text = "".join(rng.choice("ab\n") for _ in range(rng.randint(0, 12)))
+        operation = _random_operation(rng, text)
+        concurrent = _random_operation(rng, text)
+        transformed = ot.transform_operation(operation, [concurrent], 1)
+        current = apply(text, concurrent)
+        assert transformed.base_length == len(current)
+        assert "".join(c for c in transformed.components if type(c) is str) \
+            == "".join(c for c in operation.components if type(c) is str)
+        assert ot.apply_to_buffer(Rope(current), transformed).to_string() == apply(current, transformed)
@@ -0,0 +1,107 @@
+import asyncio
+import os
+
+from persistence import OperationStore, SegmentFileBackend
+
+
+def _records(start, stop):
+    return [(version, float(version), [version, "x"]) for version in range(start, stop)]
+
+
+def _write(backend, doc_id, start, stop):
+    backend.append_batch([(doc_id, record) for record in _records(start, stop)])
+
+
+def _segment_paths(root, doc_id):
+    doc_dir = os.path.join(root, doc_id)
+    return sorted(os.path.join(doc_dir, name) for name in os.listdir(doc_dir) if name.startswith("segment-"))
+
+
+def test_load_replays_operations_after_latest_snapshot(tmp_path):
+    backend = SegmentFileBackend(str(tmp_path), fsync=False)
+    backend.write_snapshot("a", {"version": 0, "content": ""})
+    _write(backend, "a", 1, 6)
+    backend.write_snapshot("a", {"version": 3, "content": "xxx"})
+    backend.close()
+
+    reopened = SegmentFileBackend(str(tmp_path), fsync=False)
+    snapshot, records = reopened.load("a")
+    assert snapshot["version"] == 3
+    assert [record[0] for record in records] == [4, 5]
+    assert reopened.read_snapshot("a", 2)["version"] == 0
+    assert [record[0] for record in reopened.read_operations("a", 2, 4)] == [2, 3]
+
+
+def test_torn_tail_is_ignored_and_truncated_before_next_append(tmp_path):
+    backend = SegmentFileBackend(str(tmp_path), fsync=False)
+    backend.write_snapshot("a", {"version": 0, "content": ""})
+    _write(backend, "a", 1, 4)
+    backend.close()
+    segment = _segment_paths(str(tmp_path), "a")[-1]
+    intact = os.path.getsize(segment)
+    with open(segment, "ab") as f:
+        f.write(b"\x00\x00\x00\x40torn")
+
+    reopened = SegmentFileBackend(str(tmp_path), fsync=False)
+    assert [record[0] for record in reopened.load("a")[1]] == [1, 2, 3]
+    _write(reopened, "a", 4, 5)
+    reopened.close()
+    assert os.path.getsize(segment) > intact
+    assert [record[0] for record in SegmentFileBackend(str(tmp_path), fsync=False).load("a")[1]] == [1, 2, 3, 4]
+
+
+def test_corrupted_record_stops_replay(tmp_path):
+    backend = SegmentFileBackend(str(tmp_path), fsync=False)
+    backend.write_snapshot("a", {"version": 0, "content": ""})
+    _write(backend, "a", 1, 4)
+    backend.close()
+    segment = _segment_paths(str(tmp_path), "a")[-1]
+    with open(segment, "r+b") as f:
+        f.seek(-2, os.SEEK_END)
+        f.write(b"!!")
+    assert [record[0] for record in SegmentFileBackend(str(tmp_path), fsync=False).load("a")[1]] == [1, 2]
+
+
+def test_segments_roll_over_and_read_back_in_order(tmp_path):
+    backend = SegmentFileBackend(str(tmp_path), segment_max_bytes=64, fsync=False)
+    backend.write_snapshot("a", {"version": 0, "content": ""})
+    for version in range(1, 21):
+        _write(backend, "a", version, version + 1)
+    backend.close()
+    assert len(_segment_paths(str(tmp_path), "a")) > 1
+    reopened = SegmentFileBackend(str(tmp_path), fsync=False)
+    assert [record[0] for record in reopened.load("a")[1]] == list(range(1, 21))
+    assert [record[0] for record in reopened.read_operations("a", 7, 12)] == list(range(7, 12))
+
+
+def test_delete_and_document_ids(tmp_path):
+    backend = SegmentFileBackend(str(tmp_path), fsync=False)
+    for doc_id in ("b", "a/1", "c"):
+        backend.write_snapshot(doc_id, {"version": 0, "content": ""})
+    assert backend.document_ids() == ["a/1", "b", "c"]
+    assert backend.document_ids("a/1", 1) == ["b"]
+    backend.delete("b")
+    assert not backend.exists("b")
+    assert backend.load("b") is None
+    assert SegmentFileBackend(str(tmp_path), fsync=False).document_ids() == ["a/1", "c"]
+
+
+def test_store_group_commits_and_recovers(tmp_path):
+    async def write():
+        store = OperationStore(SegmentFileBackend(str(tmp_path), fsync=False))
+        store.snapshot("a", {"version": 0, "content": ""})
+        futures = [store.append("a", *record) for record in _records(1, 50)]
+        await asyncio.gather(*futures)
+        assert store.persisted("a") is None
+        await store.close()
+
+    async def read():
+        store = OperationStore(SegmentFileBackend(str(tmp_path), fsync=False))
+        snapshot, records = await store.load("a")
+        await store.close()
+        return snapshot, records
+
+    asyncio.run(write())
+    snapshot, records = asyncio.run(read())
+    assert snapshot["version"] == 0
+    assert [record[0] for record in records] == list(range(1, 50))
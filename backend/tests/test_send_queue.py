@@ -0,0 +1,69 @@
+import asyncio
+
+from send_queue import (FRAME_CONTENT, FRAME_CURSOR, FRAME_MESSAGE, POLICY_COALESCE, POLICY_DISCONNECT,
+                        POLICY_DROP_CURSOR, SLOW_CONSUMER_CLOSE_CODE, SendQueue)
+
+
+class StalledWebSocket:
+    def __init__(self):
+        self.close_code = None
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+def _queue(policy, max_size=3):
+    closed = []
+    websocket = StalledWebSocket()
+    return SendQueue(websocket, max_size, policy, on_close=closed.append), websocket, closed
+
+
+def _frames(queue):
+    return [frame for _, _, frame in queue.frames]
+
+
+def test_drop_cursor_makes_room_by_dropping_queued_cursor_frames():
+    async def run():
+        queue, websocket, closed = _queue(POLICY_DROP_CURSOR)
+        assert queue.enqueue("c1", FRAME_CURSOR)
+        assert queue.enqueue("m1", FRAME_MESSAGE)
+        assert queue.enqueue("m2", FRAME_MESSAGE)
+        assert not queue.enqueue("c2", FRAME_CURSOR)
+        assert queue.enqueue("m3", FRAME_MESSAGE)
+        assert _frames(queue) == ["m1", "m2", "m3"]
+        assert queue.dropped == 2
+
+        assert not queue.enqueue("m4", FRAME_MESSAGE)
+        await asyncio.sleep(0)
+        assert queue.closed and closed == [websocket]
+        assert websocket.close_code == SLOW_CONSUMER_CLOSE_CODE
+
+    asyncio.run(run())
+
+
+def test_coalesce_replaces_the_queued_frame_with_the_same_key():
+    async def run():
+        queue, _, closed = _queue(POLICY_COALESCE)
+        assert queue.enqueue("content v1", FRAME_CONTENT, "content")
+        assert queue.enqueue("cursor a1", FRAME_CURSOR, "cursor:a")
+        assert queue.enqueue("m1", FRAME_MESSAGE)
+        assert queue.enqueue("cursor a2", FRAME_CURSOR, "cursor:a")
+        assert queue.enqueue("content v2", FRAME_CONTENT, "content")
+        assert _frames(queue) == ["m1", "cursor a2", "content v2"]
+        assert not closed
+
+    asyncio.run(run())
+
+
+def test_disconnect_closes_the_slow_consumer_on_overflow():
+    async def run():
+        queue, websocket, closed = _queue(POLICY_DISCONNECT, max_size=1)
+        assert queue.enqueue("c1", FRAME_CURSOR)
+        assert not queue.enqueue("c2", FRAME_CURSOR)
+        await asyncio.sleep(0)
+        assert queue.closed and len(queue) == 0
+        assert closed == [websocket]
+        assert websocket.close_code == SLOW_CONSUMER_CLOSE_CODE
+        assert not queue.enqueue("m1", FRAME_MESSAGE)
+
+    asyncio.run(run())
@@ -0,0 +1,139 @@
+import asyncio
+
+from document_manager import DocumentManager
+from operational_transform import TextOperation
+from sequencer import OperationSequencer
+
+
+class RecordingConnections:
+    def __init__(self):
+        self.sent = []
+        self.broadcasts = []
+
+    def send(self, websocket, message, kind=None):
+        self.sent.append((websocket, message))
+
+    def send_frame(self, websocket, frame, kind=None):
+        self.sent.append((websocket, frame.message))
+
+    def broadcast_frame(self, doc_id, frame, kind=None, exclude=()):
+        self.broadcasts.append((set(exclude), frame.message))
+
+    def transform_cursors(self, doc_id, buffers, operations, authors=None):
+        pass
+
+    def notify_spectators(self, doc_id):
+        pass
+
+    def messages(self, websocket, kind):
+        return [message for target, message in self.sent if target == websocket and message["type"] == kind]
+
+
+def _op(*components):
+    return TextOperation.normalize(list(components))
+
+
+async def _setup(content="abc"):
+    manager = DocumentManager()
+    await manager.create_document("d", content)
+    connections = RecordingConnections()
+    return manager, connections, OperationSequencer(manager, connections)
+
+
+def test_concurrent_operations_commit_as_one_batch():
+    async def run():
+        manager, connections, sequencer = await _setup()
+        versions = await asyncio.gather(
+            sequencer.submit("d", "w1", "u1", _op("X", 3), 0),
+            sequencer.submit("d", "w2", "u2", _op(3, "Y"), 0),
+        )
+        assert versions == [1, 2]
+        assert manager.get_resident_document("d").content == "XabcY"
+        assert len(connections.broadcasts) == 1
+        exclude, frame = connections.broadcasts[0]
+        assert exclude == {"w1", "w2"}
+        assert [entry["version"] for entry in frame["operations"]] == [1, 2]
+        assert connections.messages("w1", "operation_applied") == [frame]
+        assert connections.messages("w2", "operation_confirmed") == [{"type": "operation_confirmed", "version": 2}]
+        assert sequencer.sequencers == {}
+
+    asyncio.run(run())
+
+
+def test_base_length_mismatch_is_rejected_without_affecting_batch():
+    async def run():
+        manager, connections, sequencer = await _setup()
+        versions = await asyncio.gather(
+            sequencer.submit("d", "w1", "u1", _op(3, "X"), 0),
+            sequencer.submit("d", "w2", "u2", _op(9, "bad"), 0),
+        )
+        assert versions == [1, None]
+        assert manager.get_resident_document("d").content == "abcX"
+        assert connections.messages("w2", "error")
+        assert connections.broadcasts[0][1]["version"] == 1
+
+    asyncio.run(run())
+
+
+def test_bad_version_is_rejected_and_earlier_ops_are_still_broadcast():
+    async def run():
+        manager, connections, sequencer = await _setup()
+        versions = await asyncio.gather(
+            sequencer.submit("d", "w1", "u1", _op("X", 3), 0),
+            sequencer.submit("d", "w2", "u2", _op(3, "Y"), "zzz"),
+        )
+        assert versions == [1, None]
+        assert manager.get_resident_document("d").content == "Xabc"
+        exclude, frame = connections.broadcasts[0]
+        assert exclude == {"w1"}
+        assert (frame["version"], frame["user_id"]) == (1, "u1")
+        assert connections.messages("w1", "operation_confirmed") == [{"type": "operation_confirmed", "version": 1}]
+        assert connections.messages("w1", "error") == []
+        assert connections.messages("w2", "error")
+
+    asyncio.run(run())
+
+
+def test_failure_after_apply_confirms_and_resyncs_instead_of_failing():
+    async def run():
+        manager, connections, sequencer = await _setup()
+
+        async def broken_wait(doc_id):
+            raise OSError("disk full")
+
+        manager.wait_persisted = broken_wait
+        versions = await asyncio.gather(
+            sequencer.submit("d", "w1", "u1", _op("X", 3), 0),
+            sequencer.submit("d", "w2", "u2", _op(3, "Y"), 0),
+        )
+        assert versions == [1, 2]
+        assert len(connections.broadcasts) == 1
+        for websocket, version in (("w1", 1), ("w2", 2)):
+            assert connections.messages(websocket, "error") == []
+            assert connections.messages(websocket, "operation_confirmed") == [
+                {"type": "operation_confirmed", "version": version}]
+            assert connections.messages(websocket, "document_state") == [
+                {"type": "document_state", "content": "XabcY", "version": 2}]
+
+    asyncio.run(run())
+
+
+def test_stale_version_is_transformed_against_committed_history():
+    async def run():
+        manager, connections, sequencer = await _setup()
+        await sequencer.submit("d", "w1", "u1", _op("X", 3), 0)
+        assert await sequencer.submit("d", "w2", "u2", _op(3, "Y"), 0) == 2
+        assert manager.get_resident_document("d").content == "XabcY"
+        assert connections.broadcasts[-1][1]["operation"].components == (4, "Y")
+
+    asyncio.run(run())
+
+
+def test_websocket_rejects_non_integer_versions(client, doc_id):
+    with client.websocket_connect(f"/ws/{doc_id}?user_id=u1") as websocket:
+        assert websocket.receive_json()["type"] == "document_state"
+        for version in ("zzz", 1.5, True, -1, None):
+            websocket.send_json({"type": "operation", "operation": ["x"], "version": version})
+            assert websocket.receive_json() == {"type": "error", "message": "Invalid document version"}
+        websocket.send_json({"type": "operation", "operation": ["x"], "version": 0})
+        assert websocket.receive_json() == {"type": "operation_confirmed", "version": 1}
@@ -0,0 +1,91 @@
+import asyncio
+import json
+
+from document_manager import DocumentManager
+from operational_transform import TextOperation
+from send_queue import SendQueue
+from spectators import Spectator, SpectatorRoom
+from wire_protocol import Frame
+
+
+class IdleWebSocket:
+    async def close(self, code=1000):
+        pass
+
+
+def _append(manager, doc_id, text):
+    doc = manager.get_resident_document(doc_id)
+    operation = TextOperation.normalize([len(doc.buffer), text])
+    manager.apply_operation(doc_id, operation, manager.ot.apply_to_buffer(doc.buffer, operation))
+
+
+def _join(room, version, interval=0.0):
+    spectator = Spectator(SendQueue(IdleWebSocket()), version, interval)
+    room.add(spectator, Frame({"type": "document_state", "content": "", "version": version}))
+    spectator.send_queue.frames.clear()
+    return spectator
+
+
+def _payloads(spectator):
+    return [frame for _, _, frame in spectator.send_queue.frames]
+
+
+def test_spectators_at_the_same_version_share_one_encoded_frame():
+    async def run():
+        manager = DocumentManager()
+        await manager.create_document("d", "")
+        room = SpectatorRoom("d", manager, interval=3600)
+        first, second, behind = _join(room, 0), _join(room, 0), _join(room, 0)
+        behind.version = -1
+        _append(manager, "d", "a")
+        _append(manager, "d", "b")
+
+        room.publish()
+        assert _payloads(first)[0] is _payloads(second)[0]
+        assert json.loads(_payloads(first)[0]) == {
+            "type": "document_delta", "since_version": 0, "version": 2,
+            "operation": [{"type": "insert", "value": "ab"}]
+        }
+        assert json.loads(_payloads(behind)[0]) == {"type": "document_state", "content": "ab", "version": 2}
+        for websocket in list(room.members):
+            room.remove(websocket)
+
+    asyncio.run(run())
+
+
+def test_busy_spectator_catches_up_with_one_composed_delta():
+    async def run():
+        manager = DocumentManager()
+        await manager.create_document("d", "")
+        room = SpectatorRoom("d", manager, interval=3600)
+        slow, fast = _join(room, 0), _join(room, 0)
+        slow.send_queue.enqueue("unsent")
+
+        _append(manager, "d", "a")
+        assert room.publish()
+        assert _payloads(slow) == ["unsent"] and len(_payloads(fast)) == 1
+
+        slow.send_queue.frames.clear()
+        fast.send_queue.frames.clear()
+        _append(manager, "d", "b")
+        assert not room.publish()
+        assert json.loads(_payloads(slow)[0])["since_version"] == 0
+        assert json.loads(_payloads(fast)[0])["since_version"] == 1
+        assert slow.version == fast.version == 2
+        for websocket in list(room.members):
+            room.remove(websocket)
+
+    asyncio.run(run())
+
+
+def test_websocket_spectator_gets_deltas_but_no_presence(client, doc_id):
+    with client.websocket_connect(f"/ws/{doc_id}?mode=spectator") as spectator:
+        assert spectator.receive_json() == {"type": "document_state", "content": "", "version": 0}
+        with client.websocket_connect(f"/ws/{doc_id}?user_id=editor") as editor:
+            editor.receive_json()
+            editor.send_json({"type": "cursor_update", "cursor_position": {"line": 1, "column": 1}})
+            editor.send_json({"type": "operation", "operation": ["hi"], "version": 0})
+            assert editor.receive_json()["type"] == "operation_confirmed"
+            message = spectator.receive_json()
+            assert message["type"] == "document_delta"
+            assert (message["since_version"], message["version"]) == (0, 1)
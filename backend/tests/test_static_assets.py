@@ -0,0 +1,106 @@
+import gzip
+import os
+
+import pytest
+from starlette.requests import Request
+
+import static_assets
+from static_assets import IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, StaticAssets
+
+SCRIPT = b"function greet() { return 'hello'; }\n" * 40
+
+
+def _request(query="", **headers):
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "query_string": query.encode(),
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+    })
+
+
+@pytest.fixture
+def frontend(tmp_path):
+    (tmp_path / "static").mkdir()
+    (tmp_path / "static" / "app.js").write_bytes(SCRIPT)
+    (tmp_path / "index.html").write_text('<script src="static/app.js"></script><img src="static/missing.png">')
+    return tmp_path
+
+
+def test_index_references_carry_the_asset_hash(frontend):
+    assets = StaticAssets(str(frontend))
+    digest = assets.get("app.js").digest
+    body = assets.respond(assets.get_index(), _request()).body.decode()
+    assert f'src="static/app.js?v={digest}"' in body
+    assert 'src="static/missing.png"' in body
+
+
+def test_versioned_requests_are_immutable_and_others_revalidate(frontend):
+    assets = StaticAssets(str(frontend))
+    asset = assets.get("app.js")
+    response = assets.respond(asset, _request(f"v={asset.digest}"))
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    response = assets.respond(asset, _request("v=old"))
+    assert response.headers["cache-control"] == REVALIDATE_CACHE_CONTROL
+    assert response.body == SCRIPT
+    assert assets.respond(assets.get("nope.js"), _request()).status_code == 404
+
+
+def test_matching_etag_gets_304_for_any_encoding(frontend):
+    assets = StaticAssets(str(frontend))
+    asset = assets.get("app.js")
+    etag = assets.respond(asset, _request(accept_encoding="gzip")).headers["etag"]
+    assert etag == f'"{asset.digest}-gzip"'
+
+    for if_none_match in (etag, f'"{asset.digest}"', f'W/{etag}', '"other", *'):
+        response = assets.respond(asset, _request(if_none_match=if_none_match))
+        assert response.status_code == 304
+        assert response.body == b""
+        assert response.headers["etag"] == f'"{asset.digest}"'
+    assert assets.respond(asset, _request(if_none_match='"other"')).status_code == 200
+
+
+def test_gzip_is_served_when_brotli_is_not_installed(frontend, monkeypatch):
+    monkeypatch.setattr(static_assets, "brotli", None)
+    assets = StaticAssets(str(frontend))
+    asset = assets.get("app.js")
+    assert set(asset.variants) == {"identity", "gzip"}
+
+    response = assets.respond(asset, _request(accept_encoding="br, gzip"))
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert gzip.decompress(response.body) == SCRIPT
+    response = assets.respond(asset, _request(accept_encoding="gzip;q=0"))
+    assert "content-encoding" not in response.headers
+
+
+def test_brotli_is_preferred_when_installed(frontend, monkeypatch):
+    brotli = pytest.importorskip("brotli")
+    monkeypatch.setattr(static_assets, "brotli", brotli)
+    assets = StaticAssets(str(frontend))
+    asset = assets.get("app.js")
+    assert set(asset.variants) == {"identity", "gzip", "br"}
+
+    response = assets.respond(asset, _request(accept_encoding="gzip, br"))
+    assert response.headers["content-encoding"] == "br"
+    assert response.headers["etag"] == f'"{asset.digest}-br"'
+    assert brotli.decompress(response.body) == SCRIPT
+
+
+def test_reload_picks_up_changed_files(frontend):
+    assets = StaticAssets(str(frontend), reload=True)
+    before = assets.get("app.js").digest
+    path = frontend / "static" / "app.js"
+    path.write_bytes(b"changed")
+    os.utime(path, (1, 1))
+    assert assets.get("app.js").digest != before
+
+
+def test_app_serves_frontend_with_etags(client):
+    response = client.get("/")
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == REVALIDATE_CACHE_CONTROL
+    response = client.get("/", headers={"If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
+    assert client.get("/healthz").text == "ok"
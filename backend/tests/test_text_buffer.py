@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+import text_buffer
+from text_buffer import Rope, StringBuffer
+
+
+@pytest.fixture
+def small_leaves(monkeypatch):
+    monkeypatch.setattr(text_buffer, "LEAF_SIZE", 8)
+
+
+def _random_edits(rng, text, buffer, count):
+    for _ in range(count):
+        if not text or rng.random() < 0.5:
+            pos = rng.randint(0, len(text))
+            value = "".join(rng.choice("xyz\n") for _ in range(rng.choice((1, 2, 5, 30))))
+            text = text[:pos] + value + text[pos:]
+            buffer = buffer.insert(pos, value)
+        else:
+            pos = rng.randint(0, len(text) - 1)
+            length = rng.randint(1, len(text) - pos)
+            text = text[:pos] + text[pos + length:]
+            buffer = buffer.delete(pos, length)
+        assert len(buffer) == len(text)
+    return text, buffer
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_rope_edits_match_string(small_leaves, seed):
+    rng = random.Random(seed)
+    text = "".join(rng.choice("ab\nc") for _ in range(rng.randint(0, 200)))
+    text, rope = _random_edits(rng, text, Rope(text), 300)
+    assert rope.to_string() == text
+    for _ in range(50):
+        start = rng.randint(0, len(text))
+        end = rng.randint(start, len(text))
+        assert rope.substring(start, end) == text[start:end]
+
+
+def test_rope_is_persistent(small_leaves):
+    original = Rope("hello world")
+    edited = original.insert(5, ",").delete(0, 1)
+    assert original.to_string() == "hello world"
+    assert edited.to_string() == "ello, world"
+
+
+def test_rope_stays_shallow_under_many_edits(small_leaves):
+    rng = random.Random(7)
+    text, rope = _random_edits(rng, "q" * 5000, Rope("q" * 5000), 3000)
+    assert rope.to_string() == text
+    assert rope.depth <= 4 * max(1, len(text) // text_buffer.LEAF_SIZE).bit_length()
+
+
+def test_rope_lines_match_string_buffer(small_leaves):
+    rng = random.Random(3)
+    text, rope = _random_edits(rng, "a\nbb\n\nccc", Rope("a\nbb\n\nccc"), 200)
+    reference = StringBuffer(text)
+    assert rope.line_count == reference.line_count
+    for offset in range(len(text) + 1):
+        assert rope.line_of(offset) == reference.line_of(offset)
+        assert rope.offset_to_position(offset) == reference.offset_to_position(offset)
+    for line in range(reference.line_count):
+        assert rope.line_start(line) == reference.line_start(line)
+        assert rope.position_to_offset(line, 2) == reference.position_to_offset(line, 2)
+
+
+def test_empty_rope():
+    rope = Rope("")
+    assert len(rope) == 0
+    assert rope.to_string() == ""
+    assert rope.insert(0, "x").to_string() == "x"
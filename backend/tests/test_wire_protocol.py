@@ -0,0 +1,72 @@
+import pytest
+
+from operational_transform import TextOperation
+from wire_protocol import (BINARY_CODEC, BINARY_SUBPROTOCOL, JSON_CODEC, BinaryCodec, Frame, ProtocolError,
+                           negotiate_codec)
+
+
+@pytest.mark.parametrize("message", [
+    {"type": "operation", "version": 7, "operation": TextOperation.normalize([3, "abc", -2, 1])},
+    {"type": "operation_confirmed", "version": 12},
+    {"type": "cursor_updates", "cursors": [{"user_id": "a", "cursor_position": {"line": 1, "column": 4}}]},
+    {"type": "document_state", "content": "héllo\n", "version": 0, "flag": None, "ratio": 0.5, "ok": True},
+    {"type": "document_delta", "since_version": 1, "version": 3, "operation": TextOperation.normalize(["x", 5])},
+    {"type": "custom", "payload": b"\x00\x01", "items": [1, -2, "three"]},
+])
+def test_binary_round_trip(message):
+    assert BINARY_CODEC.decode(BINARY_CODEC.encode(message)) == message
+
+
+def test_operation_uses_fast_path():
+    frame = BINARY_CODEC.encode({"type": "operation", "version": 1, "operation": TextOperation.normalize(["a"])})
+    assert frame[0] & 0x02
+    assert len(frame) < 10
+
+
+def test_large_frames_are_compressed_and_bounded():
+    message = {"type": "document_state", "content": "x" * 100_000, "version": 1}
+    frame = BINARY_CODEC.encode(message)
+    assert frame[0] & 0x01
+    assert len(frame) < 10_000
+    assert BINARY_CODEC.decode(frame) == message
+    with pytest.raises(ProtocolError):
+        BINARY_CODEC.decode(frame, max_size=1000)
+
+
+def test_compression_can_be_disabled():
+    frame = BinaryCodec(compress_threshold=0).encode({"type": "document_state", "content": "x" * 100_000})
+    assert not frame[0] & 0x01
+
+
+@pytest.mark.parametrize("data", [b"", b"\x00\x05garbage", b"\x01not zlib", "text frame"])
+def test_binary_rejects_malformed_frames(data):
+    with pytest.raises(ProtocolError):
+        BINARY_CODEC.decode(data)
+
+
+def test_binary_rejects_truncated_frames():
+    frame = BINARY_CODEC.encode({"type": "chat_message", "message": "hello", "username": "a"})
+    for end in range(1, len(frame)):
+        with pytest.raises(ProtocolError):
+            BINARY_CODEC.decode(frame[:end])
+
+
+def test_json_codec_serializes_operations_and_rejects_non_objects():
+    payload = JSON_CODEC.encode({"type": "operation_applied", "operation": TextOperation.normalize([1, "a"])})
+    assert JSON_CODEC.decode(payload)["operation"] == [{"type": "retain", "length": 1}, {"type": "insert", "value": "a"}]
+    with pytest.raises(ProtocolError):
+        JSON_CODEC.decode("[1, 2]")
+    with pytest.raises(ProtocolError):
+        JSON_CODEC.decode("{", max_size=10)
+
+
+def test_frame_encodes_once_per_codec():
+    frame = Frame({"type": "operation_confirmed", "version": 1})
+    assert frame.encode(BINARY_CODEC) is frame.encode(BINARY_CODEC)
+    assert isinstance(frame.encode(JSON_CODEC), str)
+
+
+def test_negotiate_codec():
+    assert negotiate_codec([BINARY_SUBPROTOCOL]) == (BINARY_CODEC, BINARY_SUBPROTOCOL)
+    assert negotiate_codec([], "binary")[0] is BINARY_CODEC
+    assert negotiate_codec([])[0] is JSON_CODEC
@@ -0,0 +1,307 @@
+from bisect import bisect_right
+from typing import Callable, Iterator, List, Optional, Tuple
+
+LEAF_SIZE = 2048
+
+
+class TextBuffer:
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def insert(self, pos: int, text: str) -> "TextBuffer":
+        raise NotImplementedError
+
+    def delete(self, pos: int, length: int) -> "TextBuffer":
+        raise NotImplementedError
+
+    def substring(self, start: int, end: int) -> str:
+        raise NotImplementedError
+
+    def to_string(self) -> str:
+        raise NotImplementedError
+
+    @property
+    def line_count(self) -> int:
+        raise NotImplementedError
+
+    def line_of(self, offset: int) -> int:
+        raise NotImplementedError
+
+    def line_start(self, line: int) -> int:
+        raise NotImplementedError
+
+    def offset_to_position(self, offset: int) -> Tuple[int, int]:
+        offset = max(0, min(offset, len(self)))
+        line = self.line_of(offset)
+        return line, offset - self.line_start(line)
+
+    def position_to_offset(self, line: int, column: int) -> int:
+        line_count = self.line_count
+        line = max(0, min(line, line_count - 1))
+        start = self.line_start(line)
+        end = self.line_start(line + 1) - 1 if line + 1 < line_count else len(self)
+        return start + max(0, min(column, end - start))
+
+    def __str__(self) -> str:
+        return self.to_string()
+
+
+class StringBuffer(TextBuffer):
+    __slots__ = ("_text", "_line_starts")
+
+    def __init__(self, text: str = ""):
+        self._text = text
+        self._line_starts: Optional[List[int]] = None
+
+    def __len__(self) -> int:
+        return len(self._text)
+
+    def insert(self, pos: int, text: str) -> "StringBuffer":
+        return StringBuffer(self._text[:pos] + text + self._text[pos:])
+
+    def delete(self, pos: int, length: int) -> "StringBuffer":
+        return StringBuffer(self._text[:pos] + self._text[pos + length:])
+
+    def substring(self, start: int, end: int) -> str:
+        return self._text[start:end]
+
+    def to_string(self) -> str:
+        return self._text
+
+    def _starts(self) -> List[int]:
+        if self._line_starts is None:
+            starts = [0]
+            pos = self._text.find("\n")
+            while pos != -1:
+                starts.append(pos + 1)
+                pos = self._text.find("\n", pos + 1)
+            self._line_starts = starts
+        return self._line_starts
+
+    @property
+    def line_count(self) -> int:
+        return len(self._starts())
+
+    def line_of(self, offset: int) -> int:
+        return bisect_right(self._starts(), offset) - 1
+
+    def line_start(self, line: int) -> int:
+        return self._starts()[line]
+
+
+class _Leaf:
+    __slots__ = ("text", "length", "newlines", "height")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.length = len(text)
+        self.newlines = text.count("\n")
+        self.height = 0
+
+
+class _Node:
+    __slots__ = ("left", "right", "length", "newlines", "height")
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.length = left.length + right.length
+        self.newlines = left.newlines + right.newlines
+        self.height = (left.height if left.height > right.height else right.height) + 1
+
+
+def _build(text: str):
+    if not text:
+        return None
+    level = [_Leaf(text[i:i + LEAF_SIZE]) for i in range(0, len(text), LEAF_SIZE)]
+    while len(level) > 1:
+        paired = [_Node(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return level[0]
+
+
+def _balance(left, right):
+    if left.height > right.height + 1:
+        if left.left.height >= left.right.height:
+            return _Node(left.left, _Node(left.right, right))
+        inner = left.right
+        return _Node(_Node(left.left, inner.left), _Node(inner.right, right))
+    if right.height > left.height + 1:
+        if right.right.height >= right.left.height:
+            return _Node(_Node(left, right.left), right.right)
+        inner = right.left
+        return _Node(_Node(left, inner.left), _Node(inner.right, right.right))
+    return _Node(left, right)
+
+
+def _join(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.height > right.height + 1:
+        return _balance(left.left, _join(left.right, right))
+    if right.height > left.height + 1:
+        return _balance(_join(left, right.left), right.right)
+    if left.height == 0 and right.height == 0 and left.length + right.length <= LEAF_SIZE:
+        return _Leaf(left.text + right.text)
+    return _Node(left, right)
+
+
+def _split(node, pos: int) -> Tuple[Optional[object], Optional[object]]:
+    if node is None:
+        return None, None
+    if pos <= 0:
+        return None, node
+    if pos >= node.length:
+        return node, None
+    if node.height == 0:
+        return _Leaf(node.text[:pos]), _Leaf(node.text[pos:])
+    left_length = node.left.length
+    if pos < left_length:
+        head, tail = _split(node.left, pos)
+        return head, _join(tail, node.right)
+    if pos == left_length:
+        return node.left, node.right
+    head, tail = _split(node.right, pos - left_length)
+    return _join(node.left, head), tail
+
+
+def _insert_small(node, pos: int, text: str):
+    if node.height == 0:
+        merged = node.text[:pos] + text + node.text[pos:]
+        if len(merged) <= LEAF_SIZE:
+            return _Leaf(merged)
+        middle = len(merged) // 2
+        return _Node(_Leaf(merged[:middle]), _Leaf(merged[middle:]))
+    left_length = node.left.length
+    if pos <= left_length:
+        return _balance(_insert_small(node.left, pos, text), node.right)
+    return _balance(node.left, _insert_small(node.right, pos - left_length, text))
+
+
+def _leaves(node, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+    if node is None:
+        return
+    if end is None:
+        end = node.length
+    stack = [(node, 0)]
+    while stack:
+        current, offset = stack.pop()
+        if offset >= end or offset + current.length <= start:
+            continue
+        if current.height == 0:
+            yield current.text[max(start - offset, 0):end - offset]
+            continue
+        stack.append((current.right, offset + current.left.length))
+        stack.append((current.left, offset))
+
+
+def _newlines_before(node, pos: int) -> int:
+    count = 0
+    while node is not None and pos > 0:
+        if node.height == 0:
+            return count + node.text.count("\n", 0, pos)
+        left = node.left
+        if pos <= left.length:
+            node = left
+        else:
+            count += left.newlines
+            pos -= left.length
+            node = node.right
+    return count
+
+
+def _after_newline(node, line: int) -> int:
+    offset = 0
+    while node.height:
+        left = node.left
+        if line <= left.newlines:
+            node = left
+        else:
+            line -= left.newlines
+            offset += left.length
+            node = node.right
+    pos = -1
+    for _ in range(line):
+        pos = node.text.index("\n", pos + 1)
+    return offset + pos + 1
+
+
+class Rope(TextBuffer):
+    """Balanced tree of text leaves. Every node also counts the newlines
+    beneath it, so line counts are O(1) and offset/line conversions descend
+    a single path in O(log n)."""
+
+    __slots__ = ("_root",)
+
+    def __init__(self, text: str = ""):
+        self._root = _build(text)
+
+    @classmethod
+    def _from_root(cls, root) -> "Rope":
+        rope = cls.__new__(cls)
+        rope._root = root
+        return rope
+
+    def __len__(self) -> int:
+        return self._root.length if self._root is not None else 0
+
+    @property
+    def depth(self) -> int:
+        return self._root.height if self._root is not None else 0
+
+    @property
+    def line_count(self) -> int:
+        return self._root.newlines + 1 if self._root is not None else 1
+
+    def line_of(self, offset: int) -> int:
+        return _newlines_before(self._root, offset)
+
+    def line_start(self, line: int) -> int:
+        if line <= 0 or self._root is None:
+            return 0
+        return _after_newline(self._root, min(line, self._root.newlines))
+
+    def insert(self, pos: int, text: str) -> "Rope":
+        if not text:
+            return self
+        if pos < 0 or pos > len(self):
+            raise IndexError("Insert position out of range")
+        if self._root is None:
+            return Rope(text)
+        if len(text) <= LEAF_SIZE:
+            return Rope._from_root(_insert_small(self._root, pos, text))
+        head, tail = _split(self._root, pos)
+        return Rope._from_root(_join(_join(head, _build(text)), tail))
+
+    def delete(self, pos: int, length: int) -> "Rope":
+        if length <= 0:
+            return self
+        if pos < 0 or pos + length > len(self):
+            raise IndexError("Delete range out of range")
+        head, rest = _split(self._root, pos)
+        _, tail = _split(rest, length)
+        return Rope._from_root(_join(head, tail))
+
+    def substring(self, start: int, end: int) -> str:
+        return "".join(_leaves(self._root, max(start, 0), min(end, len(self))))
+
+    def to_string(self) -> str:
+        return "".join(_leaves(self._root))
+
+
+BUFFER_TYPES = {
+    "rope": Rope,
+    "string": StringBuffer,
+}
+
+BufferFactory = Callable[[str], TextBuffer]
+
+
+def get_buffer_factory(name: str) -> BufferFactory:
+    if name not in BUFFER_TYPES:
+        raise ValueError(f"Unknown text buffer type: {name}")
+    return BUFFER_TYPES[name]
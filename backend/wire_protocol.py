@@ -0,0 +1,356 @@
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+import json
+import struct
+import time
+import zlib
+
+from metrics import STAGE_SECONDS
+from operational_transform import TextOperation
+
+JSON_SUBPROTOCOL = "mycollab.json.v1"
+BINARY_SUBPROTOCOL = "mycollab.binary.v1"
+
+COMPRESS_THRESHOLD = 8192
+COMPRESSED_DECODE_COST = 32
+
+MESSAGE_TYPES = (
+    "operation",
+    "operation_applied",
+    "operation_confirmed",
+    "document_state",
+    "content_update",
+    "cursor_update",
+    "cursor_updates",
+    "user_joined",
+    "user_left",
+    "chat_message",
+    "error",
+    "document_delta",
+)
+_TYPE_CODES = {name: code for code, name in enumerate(MESSAGE_TYPES, start=1)}
+
+_FLAG_COMPRESSED = 0x01
+_FLAG_OPERATION = 0x02
+
+_TAG_NONE = 0
+_TAG_FALSE = 1
+_TAG_TRUE = 2
+_TAG_INT = 3
+_TAG_FLOAT = 4
+_TAG_STR = 5
+_TAG_LIST = 6
+_TAG_DICT = 7
+_TAG_BYTES = 8
+_TAG_OPERATION = 9
+
+_COMPONENT_RETAIN = 0
+_COMPONENT_DELETE = 1
+_COMPONENT_INSERT = 2
+
+_DOUBLE = struct.Struct(">d")
+
+ENCODE_SECONDS = STAGE_SECONDS.labels("encode")
+
+Payload = Union[str, bytes]
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, TextOperation):
+        return value.to_list()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class JsonCodec:
+    name = "json"
+    subprotocol = JSON_SUBPROTOCOL
+    binary = False
+
+    def encode(self, message: Dict[str, Any]) -> str:
+        return json.dumps(message, default=_json_default)
+
+    def decode_cost(self, data: Payload) -> int:
+        return len(data)
+
+    def decode(self, data: Payload, max_size: int = 0) -> Dict[str, Any]:
+        if max_size and len(data) > max_size:
+            raise ProtocolError(f"Frame exceeds {max_size} bytes")
+        try:
+            message = json.loads(data)
+        except ValueError as e:
+            raise ProtocolError(f"Invalid JSON frame: {e}")
+        if not isinstance(message, dict):
+            raise ProtocolError("Frame must be a JSON object")
+        return message
+
+
+def _write_varint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise ProtocolError("Truncated varint")
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+        if shift > 70:
+            raise ProtocolError("Varint too long")
+
+
+def _write_str(out: bytearray, value: str):
+    encoded = value.encode("utf-8")
+    _write_varint(out, len(encoded))
+    out += encoded
+
+
+def _read_str(data: bytes, pos: int) -> Tuple[str, int]:
+    length, pos = _read_varint(data, pos)
+    end = pos + length
+    if end > len(data):
+        raise ProtocolError("Truncated string")
+    try:
+        return data[pos:end].decode("utf-8"), end
+    except UnicodeDecodeError as e:
+        raise ProtocolError(f"Invalid UTF-8 string: {e}")
+
+
+def _write_operation(out: bytearray, operation: TextOperation):
+    components = operation.components
+    _write_varint(out, len(components))
+    for component in components:
+        if type(component) is str:
+            out.append(_COMPONENT_INSERT)
+            _write_str(out, component)
+        elif component > 0:
+            out.append(_COMPONENT_RETAIN)
+            _write_varint(out, component)
+        else:
+            out.append(_COMPONENT_DELETE)
+            _write_varint(out, -component)
+
+
+def _read_operation(data: bytes, pos: int) -> Tuple[TextOperation, int]:
+    count, pos = _read_varint(data, pos)
+    components = []
+    for _ in range(count):
+        if pos >= len(data):
+            raise ProtocolError("Truncated operation")
+        kind = data[pos]
+        pos += 1
+        if kind == _COMPONENT_INSERT:
+            value, pos = _read_str(data, pos)
+            components.append(value)
+        elif kind == _COMPONENT_RETAIN:
+            length, pos = _read_varint(data, pos)
+            components.append(length)
+        elif kind == _COMPONENT_DELETE:
+            length, pos = _read_varint(data, pos)
+            components.append(-length)
+        else:
+            raise ProtocolError(f"Unknown operation component kind: {kind}")
+    return TextOperation.normalize(components), pos
+
+
+def _write_value(out: bytearray, value: Any):
+    if value is None:
+        out.append(_TAG_NONE)
+    elif value is True:
+        out.append(_TAG_TRUE)
+    elif value is False:
+        out.append(_TAG_FALSE)
+    elif type(value) is int:
+        out.append(_TAG_INT)
+        _write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+    elif type(value) is float:
+        out.append(_TAG_FLOAT)
+        out += _DOUBLE.pack(value)
+    elif type(value) is str:
+        out.append(_TAG_STR)
+        _write_str(out, value)
+    elif isinstance(value, TextOperation):
+        out.append(_TAG_OPERATION)
+        _write_operation(out, value)
+    elif isinstance(value, dict):
+        out.append(_TAG_DICT)
+        _write_varint(out, len(value))
+        for key, item in value.items():
+            _write_str(out, str(key))
+            _write_value(out, item)
+    elif isinstance(value, (list, tuple)):
+        out.append(_TAG_LIST)
+        _write_varint(out, len(value))
+        for item in value:
+            _write_value(out, item)
+    elif isinstance(value, (bytes, bytearray)):
+        out.append(_TAG_BYTES)
+        _write_varint(out, len(value))
+        out += value
+    else:
+        raise TypeError(f"Cannot encode value of type {type(value).__name__}")
+
+
+def _read_value(data: bytes, pos: int, depth: int = 0) -> Tuple[Any, int]:
+    if depth > 32:
+        raise ProtocolError("Frame nested too deeply")
+    if pos >= len(data):
+        raise ProtocolError("Truncated value")
+    tag = data[pos]
+    pos += 1
+    if tag == _TAG_NONE:
+        return None, pos
+    if tag == _TAG_TRUE:
+        return True, pos
+    if tag == _TAG_FALSE:
+        return False, pos
+    if tag == _TAG_INT:
+        value, pos = _read_varint(data, pos)
+        return (value >> 1) if not value & 1 else -((value + 1) >> 1), pos
+    if tag == _TAG_FLOAT:
+        if pos + 8 > len(data):
+            raise ProtocolError("Truncated float")
+        return _DOUBLE.unpack_from(data, pos)[0], pos + 8
+    if tag == _TAG_STR:
+        return _read_str(data, pos)
+    if tag == _TAG_OPERATION:
+        return _read_operation(data, pos)
+    if tag == _TAG_DICT:
+        count, pos = _read_varint(data, pos)
+        result = {}
+        for _ in range(count):
+            key, pos = _read_str(data, pos)
+            result[key], pos = _read_value(data, pos, depth + 1)
+        return result, pos
+    if tag == _TAG_LIST:
+        count, pos = _read_varint(data, pos)
+        result = []
+        for _ in range(count):
+            item, pos = _read_value(data, pos, depth + 1)
+            result.append(item)
+        return result, pos
+    if tag == _TAG_BYTES:
+        length, pos = _read_varint(data, pos)
+        if pos + length > len(data):
+            raise ProtocolError("Truncated bytes")
+        return data[pos:pos + length], pos + length
+    raise ProtocolError(f"Unknown value tag: {tag}")
+
+
+class BinaryCodec:
+    """Frame layout: one flags byte, a varint message type code, then either
+    the operation fast path (varint version + operation) or the remaining
+    fields as a tagged dict. The body after the flags byte may be zlib
+    compressed when it exceeds compress_threshold bytes."""
+
+    name = "binary"
+    subprotocol = BINARY_SUBPROTOCOL
+    binary = True
+
+    def __init__(self, compress_threshold: int = COMPRESS_THRESHOLD):
+        self.compress_threshold = compress_threshold
+
+    def encode(self, message: Dict[str, Any]) -> bytes:
+        body = bytearray()
+        flags = 0
+        message_type = message.get("type")
+        type_code = _TYPE_CODES.get(message_type, 0)
+        _write_varint(body, type_code)
+
+        operation = message.get("operation")
+        if (message_type == "operation" and len(message) == 3 and isinstance(operation, TextOperation)
+                and type(message.get("version")) is int and message["version"] >= 0):
+            flags |= _FLAG_OPERATION
+            _write_varint(body, message["version"])
+            _write_operation(body, operation)
+        else:
+            fields = message if type_code == 0 else {k: v for k, v in message.items() if k != "type"}
+            _write_value(body, fields)
+
+        if self.compress_threshold and len(body) > self.compress_threshold:
+            compressed = zlib.compress(bytes(body), 6)
+            if len(compressed) < len(body):
+                flags |= _FLAG_COMPRESSED
+                body = compressed
+        return bytes([flags]) + bytes(body)
+
+    def decode_cost(self, data: Payload) -> int:
+        if data and data[0] & _FLAG_COMPRESSED:
+            return len(data) * COMPRESSED_DECODE_COST
+        return len(data)
+
+    def decode(self, data: Payload, max_size: int = 0) -> Dict[str, Any]:
+        if isinstance(data, str):
+            raise ProtocolError("Binary protocol expects binary frames")
+        if not data:
+            raise ProtocolError("Empty frame")
+        flags = data[0]
+        body = data[1:]
+        if flags & _FLAG_COMPRESSED:
+            decompressor = zlib.decompressobj()
+            try:
+                body = decompressor.decompress(body, max_size)
+            except zlib.error as e:
+                raise ProtocolError(f"Invalid compressed frame: {e}")
+            if decompressor.unconsumed_tail:
+                raise ProtocolError(f"Decompressed frame exceeds {max_size} bytes")
+            if not decompressor.eof:
+                raise ProtocolError("Truncated compressed frame")
+
+        type_code, pos = _read_varint(body, 0)
+        if flags & _FLAG_OPERATION:
+            version, pos = _read_varint(body, pos)
+            operation, pos = _read_operation(body, pos)
+            return {"type": "operation", "version": version, "operation": operation}
+
+        fields, pos = _read_value(body, pos)
+        if not isinstance(fields, dict):
+            raise ProtocolError("Frame body must be a dict")
+        if type_code:
+            if type_code > len(MESSAGE_TYPES):
+                raise ProtocolError(f"Unknown message type code: {type_code}")
+            fields["type"] = MESSAGE_TYPES[type_code - 1]
+        return fields
+
+
+JSON_CODEC = JsonCodec()
+BINARY_CODEC = BinaryCodec()
+CODECS = {codec.subprotocol: codec for codec in (JSON_CODEC, BINARY_CODEC)}
+CODECS_BY_NAME = {codec.name: codec for codec in (JSON_CODEC, BINARY_CODEC)}
+
+
+def negotiate_codec(subprotocols: Iterable[str], encoding: Optional[str] = None):
+    for subprotocol in subprotocols:
+        if subprotocol in CODECS:
+            return CODECS[subprotocol], subprotocol
+    if encoding in CODECS_BY_NAME:
+        return CODECS_BY_NAME[encoding], None
+    return JSON_CODEC, None
+
+
+class Frame:
+    __slots__ = ("message", "_encoded")
+
+    def __init__(self, message: Dict[str, Any]):
+        self.message = message
+        self._encoded: Dict[str, Payload] = {}
+
+    def encode(self, codec) -> Payload:
+        payload = self._encoded.get(codec.name)
+        if payload is None:
+            started = time.perf_counter()
+            payload = codec.encode(self.message)
+            ENCODE_SECONDS.observe(time.perf_counter() - started)
+            self._encoded[codec.name] = payload
+        return payload
@@ -10,6 +10,13 @@ class MyCollabApp {
         this.otherUsers = new Map();
         this.pendingOperations = [];
         this.isApplyingRemoteOperation = false;
+        this.awaitingConfirmation = false;
+        this.hasUnsentChanges = false;
+        this.syncedVersion = null;
+        this.syncedContent = null;
+        this.reconnectDelay = 1000;
+        this.messageChain = Promise.resolve();
+        this.isSpectator = new URLSearchParams(window.location.search).get('mode') === 'spectator';
         
         this.initializeApp();
     }
@@ -62,7 +69,8 @@ class MyCollabApp {
                     horizontal: 'auto'
                 },
                 cursorStyle: 'line',
-                cursorBlinking: 'blink'
+                cursorBlinking: 'blink',
+                readOnly: this.isSpectator
             });
             
             this.setupEditorEventListeners();
@@ -133,7 +141,7 @@ class MyCollabApp {
     }
     
     handleCursorChange(e) {
-        if (!this.isConnected) return;
+        if (!this.isConnected || this.isSpectator) return;
         
         const position = {
             line: e.position.lineNumber,
@@ -162,6 +170,14 @@ class MyCollabApp {
     sendContentUpdate(content) {
         if (!this.websocket || this.websocket.readyState !== WebSocket.OPEN) return;
         
+        if (this.awaitingConfirmation) {
+            this.hasUnsentChanges = true;
+            return;
+        }
+        
+        this.awaitingConfirmation = true;
+        this.hasUnsentChanges = false;
+        
         const message = {
             type: 'content_update',
             content: content,
@@ -196,17 +212,30 @@ class MyCollabApp {
         return 'doc_' + Math.random().toString(36).substr(2, 9);
     }
     
-    connectToWebSocket(docId) {
+    async connectToWebSocket(docId) {
         this.showLoading(true);
         
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const wsUrl = `${protocol}//${window.location.host}/ws/${docId}?user_id=${this.userId}&username=${encodeURIComponent(this.username)}`;
+        let wsUrl = `${protocol}//${window.location.host}/ws/${docId}?user_id=${this.userId}&username=${encodeURIComponent(this.username)}`;
+        
+        if (this.isSpectator) {
+            wsUrl += '&mode=spectator';
+        }
+        if (typeof DecompressionStream !== 'undefined') {
+            wsUrl += '&compression=deflate';
+        }
+        if (docId === this.currentDocId && this.syncedVersion !== null && this.editor
+                && this.editor.getModel().getValue() === this.syncedContent) {
+            const contentHash = await this.hashContent(this.syncedContent);
+            wsUrl += `&since_version=${this.syncedVersion}&content_hash=${contentHash}`;
+        }
         
         this.websocket = new WebSocket(wsUrl);
         
         this.websocket.onopen = () => {
             this.isConnected = true;
             this.currentDocId = docId;
+            this.reconnectDelay = 1000;
             this.updateConnectionStatus(true);
             this.showLoading(false);
             this.updateDocumentInfo(docId);
@@ -214,13 +243,23 @@ class MyCollabApp {
         };
         
         this.websocket.onmessage = (event) => {
-            this.handleWebSocketMessage(JSON.parse(event.data));
+            const message = JSON.parse(event.data);
+            this.messageChain = this.messageChain
+                .then(() => this.handleWebSocketMessage(message))
+                .catch((error) => console.error('Failed to handle message:', error));
         };
         
-        this.websocket.onclose = () => {
+        this.websocket.onclose = (event) => {
             this.isConnected = false;
+            this.awaitingConfirmation = false;
             this.updateConnectionStatus(false);
-            this.addChatMessage('system', 'Disconnected from document');
+            this.addChatMessage('system', event.code === 1013 ? 'Server is busy, reconnecting shortly' : 'Disconnected from document');
+            
+            if (this.currentDocId === docId) {
+                const delay = event.code === 1013 ? this.reconnectDelay + Math.random() * 5000 : this.reconnectDelay;
+                setTimeout(() => this.connectToWebSocket(docId), delay);
+                this.reconnectDelay = Math.min(this.reconnectDelay * 2, 30000);
+            }
         };
         
         this.websocket.onerror = (error) => {
@@ -230,11 +269,34 @@ class MyCollabApp {
         };
     }
     
-    handleWebSocketMessage(message) {
+    async hashContent(content) {
+        const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(content));
+        return Array.from(new Uint8Array(digest)).map((b) => b.toString(16).padStart(2, '0')).join('');
+    }
+    
+    async decodeContent(message) {
+        if (message.content_encoding !== 'deflate') return message.content;
+        
+        const compressed = Uint8Array.from(atob(message.content), (c) => c.charCodeAt(0));
+        const stream = new Blob([compressed]).stream().pipeThrough(new DecompressionStream('deflate'));
+        return await new Response(stream).text();
+    }
+    
+    markSynced() {
+        if (this.awaitingConfirmation || this.hasUnsentChanges || !this.editor) return;
+        
+        this.syncedVersion = this.documentVersion;
+        this.syncedContent = this.editor.getModel().getValue();
+    }
+    
+    async handleWebSocketMessage(message) {
         console.log('Received WebSocket message:', message);
         switch (message.type) {
             case 'document_state':
-                this.handleDocumentState(message);
+                await this.handleDocumentState(message);
+                break;
+            case 'document_delta':
+                this.handleDocumentDelta(message);
                 break;
             case 'operation_applied':
                 this.handleRemoteOperation(message);
@@ -254,6 +316,9 @@ class MyCollabApp {
             case 'cursor_update':
                 this.handleRemoteCursorUpdate(message);
                 break;
+            case 'cursor_updates':
+                this.handleRemoteCursorUpdates(message);
+                break;
             case 'chat_message':
                 this.handleChatMessage(message);
                 break;
@@ -263,26 +328,43 @@ class MyCollabApp {
         }
     }
     
-    handleDocumentState(message) {
+    async handleDocumentState(message) {
+        const content = await this.decodeContent(message);
+        
         this.isApplyingRemoteOperation = true;
         
         if (this.editor) {
-            this.editor.setValue(message.content);
+            this.editor.setValue(content);
         }
         
         this.documentVersion = message.version;
         this.isApplyingRemoteOperation = false;
+        this.markSynced();
     }
     
-    handleRemoteOperation(message) {
-        if (message.user_id === this.userId) return;
-        
+    handleDocumentDelta(message) {
         this.isApplyingRemoteOperation = true;
         
         this.applyOperationToEditor(message.operation);
         
         this.documentVersion = message.version;
         this.isApplyingRemoteOperation = false;
+        this.markSynced();
+    }
+    
+    handleRemoteOperation(message) {
+        const entries = message.operations || [message];
+        
+        this.isApplyingRemoteOperation = true;
+        
+        for (const entry of entries) {
+            if (entry.user_id === this.userId) continue;
+            this.applyOperationToEditor(entry.operation);
+        }
+        
+        this.documentVersion = Math.max(this.documentVersion, message.version);
+        this.isApplyingRemoteOperation = false;
+        this.markSynced();
     }
     
     applyOperationToEditor(operations) {
@@ -310,7 +392,6 @@ class MyCollabApp {
                     range: new monaco.Range(pos.lineNumber, pos.column, pos.lineNumber, pos.column),
                     text: op.value
                 });
-                position += op.value.length;
             }
         }
         
@@ -320,7 +401,13 @@ class MyCollabApp {
     }
     
     handleOperationConfirmed(message) {
-        this.documentVersion = message.version;
+        this.documentVersion = Math.max(this.documentVersion, message.version);
+        this.awaitingConfirmation = false;
+        this.markSynced();
+        
+        if (this.hasUnsentChanges && this.editor) {
+            this.sendContentUpdate(this.editor.getModel().getValue());
+        }
     }
     
     handleRemoteContentUpdate(message) {
@@ -334,6 +421,7 @@ class MyCollabApp {
         
         this.documentVersion = message.version;
         this.isApplyingRemoteOperation = false;
+        this.markSynced();
     }
     
     handleUserJoined(message) {
@@ -365,6 +453,24 @@ class MyCollabApp {
         }
     }
     
+    handleRemoteCursorUpdates(message) {
+        let changed = false;
+        
+        for (const cursor of message.cursors) {
+            if (cursor.user_id === this.userId) continue;
+            
+            const user = this.otherUsers.get(cursor.user_id);
+            if (user) {
+                user.cursor = cursor.cursor_position;
+                changed = true;
+            }
+        }
+        
+        if (changed) {
+            this.updateUsersList();
+        }
+    }
+    
     handleChatMessage(message) {
         this.addChatMessage('user', message.message, message.username);
     }
@@ -37,7 +37,7 @@ echo ""
 echo "To stop the server, press Ctrl+C"
 echo ""
 
-python3 -m uvicorn main:app --host 0.0.0.0 --port 8000 --reload
+MYCOLLAB_STATIC_RELOAD=1 python3 -m uvicorn main:app --host 0.0.0.0 --port 8000 --reload
 
 cleanup() {
     echo ""